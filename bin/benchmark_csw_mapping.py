@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Microbenchmark for the CHE / ISO19139.che record mapping (csw_mapping).
+
+Maps the CHE test fixtures with ``GeoMetadataMapping.get_metadata`` and
+reports the time per record, once with the compiled XPath registry from
+``xpath_utils`` and once with every expression compiled again on each call
+(the behaviour before the registry existed).
+
+Run from the ckanext-geocat repo root inside the CKAN virtualenv:
+
+    python3 bin/benchmark_csw_mapping.py --rounds 200
+"""
+
+import argparse
+import os
+import timeit
+from typing import Callable, List
+
+from lxml import etree
+
+from ckanext.geocat.utils import csw_mapping, xpath_utils
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(REPO_ROOT, "ckanext", "geocat", "tests", "fixtures")
+CHE_FIXTURES = [
+    "geocat-testdata.xml",
+    "only_de.xml",
+    "publication_date.xml",
+    "revision_date.xml",
+    "testdata-deprecated-protocols.xml",
+    os.path.join("test_harvesters", "result_1.xml"),
+    os.path.join("test_harvesters", "result_2.xml"),
+]
+
+
+def _load_records() -> List[str]:
+    records = []
+    for filename in CHE_FIXTURES:
+        with open(os.path.join(FIXTURES, filename)) as f:
+            records.append(f.read())
+    return records
+
+
+def _uncompiled_xpath(path: str) -> Callable:
+    return etree.XPath(path, namespaces=xpath_utils.gmd_namespaces)
+
+
+def _time_per_record(records: List[str], rounds: int) -> float:
+    csw_map = csw_mapping.GeoMetadataMapping(
+        organization_slug="swisstopo",
+        geocat_perma_link="https://www.geocat.ch/geonetwork/srv/ger/catalog.search#/metadata/",
+        geocat_perma_label={
+            lang: "geocat.ch Permalink" for lang in ["de", "fr", "en", "it"]
+        },
+        legal_basis_url="",
+        default_rights="",
+        valid_identifiers=[],
+    )
+
+    def _map_all():
+        for record in records:
+            csw_map.get_metadata(record, "benchmark")
+
+    _map_all()
+    seconds = min(timeit.repeat(_map_all, number=rounds, repeat=3))
+    return seconds / (rounds * len(records))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=100)
+    args = parser.parse_args()
+
+    records = _load_records()
+
+    registry_xpath = xpath_utils.get_compiled_xpath
+    xpath_utils.get_compiled_xpath = _uncompiled_xpath
+    try:
+        before = _time_per_record(records, args.rounds)
+    finally:
+        xpath_utils.get_compiled_xpath = registry_xpath
+    after = _time_per_record(records, args.rounds)
+
+    print(f"records: {len(records)}, rounds: {args.rounds}")
+    print(f"compiled on every call: {before * 1000:.3f} ms/record")
+    print(f"compiled XPath registry: {after * 1000:.3f} ms/record")
+    print(f"speedup: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
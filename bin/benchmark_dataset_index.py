@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Benchmark for the existing-dataset index of the gather stage (search_utils).
+
+Reads the datasets of one organization with
+``search_utils.get_dataset_infos_for_organization`` once from Solr and once
+from the package tables, and reports the time, the peak Python memory and
+the number of datasets of each, and whether both returned the same index.
+
+Run from the ckanext-geocat repo root inside the CKAN virtualenv, against a
+site with a large organization (e.g. a copy of production with ~20k
+datasets):
+
+    python3 bin/benchmark_dataset_index.py --config /etc/ckan/default/ckan.ini \\
+        --organization swisstopo --harvest-source-id <id> --rounds 3
+"""
+
+import argparse
+import time
+import tracemalloc
+from typing import Dict, Tuple
+
+from ckan.cli import load_config
+from ckan.config.middleware import make_app
+
+from ckanext.geocat.utils import search_utils
+
+
+def _measure(
+    organization: str, harvest_source_id: str, dataset_index: str, rounds: int
+) -> Tuple[float, int, Dict]:
+    seconds = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        dataset_infos = search_utils.get_dataset_infos_for_organization(
+            organization, harvest_source_id, dataset_index=dataset_index
+        )
+        seconds.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    search_utils.get_dataset_infos_for_organization(
+        organization, harvest_source_id, dataset_index=dataset_index
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(seconds), peak, dataset_infos
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--organization", required=True)
+    parser.add_argument("--harvest-source-id", default="")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    app = make_app(load_config(args.config))
+    with app._wsgi_app.test_request_context():
+        results = {}
+        for dataset_index in search_utils.DATASET_INDEX_BACKENDS:
+            seconds, peak, dataset_infos = _measure(
+                args.organization, args.harvest_source_id, dataset_index, args.rounds
+            )
+            results[dataset_index] = dataset_infos
+            print(
+                f"{dataset_index}: {len(dataset_infos)} datasets in "
+                f"{seconds:.2f} s, peak memory {peak / 1024 / 1024:.1f} MiB"
+            )
+
+    solr = results[search_utils.DATASET_INDEX_SOLR]
+    database = results[search_utils.DATASET_INDEX_DATABASE]
+    differing = {
+        identifier
+        for identifier in solr.keys() | database.keys()
+        if solr.get(identifier) != database.get(identifier)
+    }
+    print(f"identifiers that differ between both indexes: {len(differing)}")
+
+
+if __name__ == "__main__":
+    main()
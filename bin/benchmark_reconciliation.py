@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Benchmark for the identifier reconciliation of the gather stage (search_utils).
+
+Builds a synthetic source of geocat identifiers and an organization of
+existing datasets that overlaps it, and times the identifier handling of a
+gather before and after ``search_utils.reconcile_identifiers``: the old one
+mapped every geocat identifier twice and looked the ogdch identifiers up in
+lists, the new one maps them once and sorts them into sets in one pass.
+
+Run from the ckanext-geocat repo root inside the CKAN virtualenv; no CKAN
+site is needed:
+
+    python3 bin/benchmark_reconciliation.py --identifiers 50000
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List, Tuple
+
+from ckanext.geocat.utils import ogdch_map_utils, search_utils
+
+ORGANIZATION = "swisstopo"
+
+
+def _build(identifiers: int) -> Tuple[List[str], Dict]:
+    """
+    Return the geocat identifiers of the source and the existing datasets:
+    a tenth of the source is new, a tenth of the harvested datasets is
+    missing in the source, and a tenth of the source belongs to datasets
+    that were not harvested.
+    """
+    geocat_identifiers = [f"{i:08x}-geocat" for i in range(identifiers)]
+    existing_dataset_infos = {}
+    for i in range(identifiers // 10, identifiers + identifiers // 10):
+        ogdch_identifier = ogdch_map_utils.map_geocat_to_ogdch_identifier(
+            f"{i:08x}-geocat", ORGANIZATION
+        )
+        existing_dataset_infos[ogdch_identifier] = search_utils.OgdchDatasetInfo(
+            name=f"dataset-{i}",
+            belongs_to_harvester=i % 10 != 0,
+            package_id=f"package-{i}",
+        )
+    return geocat_identifiers, existing_dataset_infos
+
+
+def _list_based(geocat_identifiers: List[str], existing_dataset_infos: Dict) -> int:
+    gathered_ogdch_identifiers = [
+        ogdch_map_utils.map_geocat_to_ogdch_identifier(geocat_id, ORGANIZATION)
+        for geocat_id in geocat_identifiers
+    ]
+    mapped = 0
+    for geocat_id in geocat_identifiers:
+        ogdch_identifier = ogdch_map_utils.map_geocat_to_ogdch_identifier(
+            geocat_id, ORGANIZATION
+        )
+        if ogdch_identifier in gathered_ogdch_identifiers:
+            mapped += 1
+    packages_to_delete = [
+        (identifier, info)
+        for identifier, info in existing_dataset_infos.items()
+        if info.belongs_to_harvester and identifier not in gathered_ogdch_identifiers
+    ]
+    return mapped + len(packages_to_delete)
+
+
+def _set_based(geocat_identifiers: List[str], existing_dataset_infos: Dict) -> int:
+    ogdch_identifiers = {
+        geocat_id: ogdch_map_utils.map_geocat_to_ogdch_identifier(
+            geocat_id, ORGANIZATION
+        )
+        for geocat_id in geocat_identifiers
+    }
+    mapped = sum(
+        1 for geocat_id in geocat_identifiers if geocat_id in ogdch_identifiers
+    )
+    reconciliation = search_utils.reconcile_identifiers(
+        existing_dataset_infos, ogdch_identifiers.values()
+    )
+    packages_to_delete = search_utils.get_packages_to_delete(
+        existing_dataset_infos, reconciliation
+    )
+    return mapped + len(packages_to_delete)
+
+
+def _measure(fn: Callable, *args) -> Tuple[float, int]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--identifiers", type=int, default=50000)
+    parser.add_argument(
+        "--skip-list-based",
+        action="store_true",
+        help="only time the set-based reconciliation",
+    )
+    args = parser.parse_args()
+
+    geocat_identifiers, existing_dataset_infos = _build(args.identifiers)
+    print(
+        f"{len(geocat_identifiers)} gathered identifiers, "
+        f"{len(existing_dataset_infos)} existing datasets"
+    )
+    seconds, result = _measure(_set_based, geocat_identifiers, existing_dataset_infos)
+    print(f"set-based: {seconds:.3f} s")
+    if not args.skip_list_based:
+        list_seconds, list_result = _measure(
+            _list_based, geocat_identifiers, existing_dataset_infos
+        )
+        assert list_result == result
+        print(f"list-based: {list_seconds:.3f} s ({list_seconds / seconds:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
-"""Rebuild response_getrecords_dcat_*.xml from result_1_dcat.xml / result_2_dcat.xml.
+"""Rebuild the batch GetRecords harvest fixtures from the per-record fixtures.
 
-Run from the ckanext-geocat repo root after editing the canonical DCAT fixtures.
+response_getrecords_dcat_*.xml is built from result_1_dcat.xml / result_2_dcat.xml,
+response_getrecords_che_*.xml from result_1.xml / result_2.xml.
+
+Run from the ckanext-geocat repo root after editing the canonical fixtures.
 """
 
 import os
@@ -12,6 +15,10 @@ REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FIXTURES = os.path.join(
     REPO_ROOT, "ckanext", "geocat", "tests", "fixtures", "test_harvesters"
 )
+CHE_RECORD_TAGS = (
+    "{http://www.isotc211.org/2005/gmd}MD_Metadata",
+    "{http://www.geocat.ch/2008/che}CHE_MD_Metadata",
+)
 
 
 def _load_dataset(filename: str) -> ET.Element:
@@ -24,6 +31,16 @@ def _load_dataset(filename: str) -> ET.Element:
     raise SystemExit(f"no dcat:Dataset in {path}")
 
 
+def _load_che_record(filename: str) -> ET.Element:
+    path = os.path.join(FIXTURES, filename)
+    with open(path, "rb") as f:
+        root = ET.fromstring(f.read())
+    for el in root.iter():
+        if el.tag in CHE_RECORD_TAGS:
+            return el
+    raise SystemExit(f"no gmd:MD_Metadata in {path}")
+
+
 def _write_batch(
     path: str, datasets: List[ET.Element], matched: int, returned: int
 ) -> None:
@@ -44,6 +61,24 @@ def _write_batch(
         f.write(out)
 
 
+def _write_che_batch(path: str, records: List[ET.Element]) -> None:
+    get_records_response = ET.Element(
+        "{http://www.opengis.net/cat/csw/2.0.2}GetRecordsResponse"
+    )
+    csw_search_results = ET.SubElement(
+        get_records_response, "{http://www.opengis.net/cat/csw/2.0.2}SearchResults"
+    )
+    csw_search_results.set("numberOfRecordsMatched", str(len(records)))
+    csw_search_results.set("numberOfRecordsReturned", str(len(records)))
+    csw_search_results.set("nextRecord", "0")
+    for record_el in records:
+        csw_search_results.append(record_el)
+    out = ET.tostring(get_records_response, encoding="unicode")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(out)
+
+
 def main() -> None:
     dataset_record_1 = _load_dataset("result_1_dcat.xml")
     dataset_record_2 = _load_dataset("result_2_dcat.xml")
@@ -59,8 +94,19 @@ def main() -> None:
         1,
         1,
     )
+    che_record_1 = _load_che_record("result_1.xml")
+    che_record_2 = _load_che_record("result_2.xml")
+    _write_che_batch(
+        os.path.join(FIXTURES, "response_getrecords_che_batch.xml"),
+        [che_record_1, che_record_2],
+    )
+    _write_che_batch(
+        os.path.join(FIXTURES, "response_getrecords_che_one.xml"),
+        [che_record_1],
+    )
     print(
-        "Wrote response_getrecords_dcat_batch.xml and response_getrecords_dcat_one.xml"
+        "Wrote response_getrecords_dcat_batch.xml, response_getrecords_dcat_one.xml, "
+        "response_getrecords_che_batch.xml and response_getrecords_che_one.xml"
     )
 
 
@@ -0,0 +1,63 @@
+import click
+from ckan import model
+
+from ckanext.geocat.harvester import DEFAULT_GATHER_CONCURRENCY, GeocatHarvesterBase
+from ckanext.geocat.utils import http_utils
+from ckanext.harvest.model import HarvestJob, HarvestSource
+
+
+@click.group("geocat-harvest", short_help="Geocat harvester commands")
+def geocat_harvest():
+    pass
+
+
+@geocat_harvest.command("gather-sources")
+@click.argument("source_ids", nargs=-1)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=DEFAULT_GATHER_CONCURRENCY,
+    show_default=True,
+    help="Number of sources gathered at the same time",
+)
+@click.option(
+    "--host-budget",
+    type=int,
+    default=http_utils.MAX_CONCURRENCY,
+    show_default=True,
+    help="Maximum number of requests in flight to one host",
+)
+def gather_sources(source_ids, concurrency, host_budget):
+    """
+    Gather the new harvest jobs of geocat sources, several at a time, and
+    queue their harvest objects for the fetch stage. Without SOURCE_IDS, the
+    new jobs of all active geocat sources are gathered.
+    """
+    harvest_jobs = _get_new_harvest_jobs(source_ids)
+    if not harvest_jobs:
+        click.echo("No new harvest jobs of geocat sources")
+        return
+
+    harvest_obj_ids = GeocatHarvesterBase.gather_sources(
+        harvest_jobs, concurrency=concurrency, host_budget=host_budget
+    )
+    for harvest_job_id, job_harvest_obj_ids in harvest_obj_ids.items():
+        click.echo(
+            f"Harvest job {harvest_job_id}: "
+            f"{len(job_harvest_obj_ids)} harvest objects queued"
+        )
+
+
+def _get_new_harvest_jobs(source_ids):
+    query = (
+        model.Session.query(HarvestJob)
+        .join(HarvestSource, HarvestJob.source_id == HarvestSource.id)
+        .filter(
+            HarvestJob.status == "New",
+            HarvestSource.active.is_(True),
+            HarvestSource.type.in_(list(GeocatHarvesterBase.get_harvester_classes())),
+        )
+    )
+    if source_ids:
+        query = query.filter(HarvestSource.id.in_(source_ids))
+    return query.all()
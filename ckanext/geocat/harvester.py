@@ -1,7 +1,12 @@
 import logging
+import math
+import time
 import traceback
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
+import ckan.plugins as p
 import ckan.plugins.toolkit as tk
 from ckan import model
 from ckan.lib.helpers import json
@@ -13,6 +18,8 @@ from ckanext.geocat.utils import (
     csw_mapping,
     csw_processor,
     dcat_mapping,
+    harvest_state,
+    http_utils,
     ogdch_map_utils,
     search_utils,
 )
@@ -26,7 +33,8 @@ from ckanext.geocat.utils.mapping_utils import (
     VALID_TERMS_OF_USE,
 )
 from ckanext.harvest.harvesters import HarvesterBase
-from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
+from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestObjectExtra
+from ckanext.harvest.queue import get_fetch_publisher
 
 log = logging.getLogger(__name__)
 
@@ -35,6 +43,40 @@ DEFAULT_PERMA_LINK_URL = (
 )
 DEFAULT_PERMA_LINK_LABEL = "geocat.ch Permalink"
 HARVEST_USER = "harvest"
+MAX_FETCH_CONCURRENCY = 16
+MAX_REQUEST_TIMEOUT = 600
+MAX_PREFETCH_PAGES = 2
+MAX_CAPABILITIES_CACHE_TTL = 7 * 24 * 60 * 60
+MAX_FULL_HARVEST_INTERVAL_DAYS = 90
+MAX_PAGE_SIZE = 1000
+DEFAULT_MIN_PAGE_SIZE = 10
+DEFAULT_MAX_PAGE_SIZE = 500
+DEFAULT_GATHER_CONCURRENCY = 4
+
+BOOLEAN_CONFIG_OPTIONS = [
+    "delete_missing_datasets",
+    "batch_records",
+    "stream_records",
+    "incremental",
+    "cache_dataset_index",
+]
+CHOICE_CONFIG_OPTIONS = {
+    "dataset_index": search_utils.DATASET_INDEX_BACKENDS,
+}
+# option: (allowed types, minimum, maximum)
+NUMBER_CONFIG_OPTIONS = {
+    "fetch_concurrency": (int, 1, MAX_FETCH_CONCURRENCY),
+    "request_timeout": ((int, float), 1, MAX_REQUEST_TIMEOUT),
+    "prefetch_pages": (int, 0, MAX_PREFETCH_PAGES),
+    "fanout_concurrency": (int, 0, MAX_FETCH_CONCURRENCY),
+    "capabilities_cache_ttl": (int, 0, MAX_CAPABILITIES_CACHE_TTL),
+    "full_harvest_interval_days": (int, 1, MAX_FULL_HARVEST_INTERVAL_DAYS),
+    "page_size": (int, 1, MAX_PAGE_SIZE),
+    "min_page_size": (int, 1, MAX_PAGE_SIZE),
+    "max_page_size": (int, 1, MAX_PAGE_SIZE),
+    "hedge_percentile": (int, 0, 99),
+    "hedge_max_extra_load": ((int, float), 0, 1),
+}
 
 
 class GeocatHarvesterBase(HarvesterBase):
@@ -42,6 +84,102 @@ class GeocatHarvesterBase(HarvesterBase):
     Shared import stage and config for classic and DCAT geocat harvesters.
     """
 
+    # HTTP session and host limiters shared by the gathers of gather_sources
+    _shared_csw_args = {}
+
+    @staticmethod
+    def get_harvester_classes():
+        """Return a dict of harvest source type to geocat harvester class."""
+        return {
+            harvester_class().info()["name"]: harvester_class
+            for harvester_class in GeocatHarvesterBase.__subclasses__()
+        }
+
+    @staticmethod
+    def gather_sources(
+        harvest_jobs,
+        concurrency=DEFAULT_GATHER_CONCURRENCY,
+        host_budget=http_utils.MAX_CONCURRENCY,
+    ):
+        """
+        Run the gather stage of the new ``harvest_jobs`` of geocat sources, up
+        to ``concurrency`` of them at a time, each with its own harvester
+        instance. The jobs whose sources took longest in their last gather
+        start first, sources without a known duration before all others. The
+        gathers share one HTTP connection pool and the vocabulary caches, and
+        never have more than ``host_budget`` requests in flight to one host
+        together.
+
+        Like the gather consumer of ckanext-harvest, every job is set to
+        Running, its gather timestamps are saved and its harvest objects are
+        queued for the fetch stage. Jobs that are no longer New when their
+        turn comes are skipped. Returns a dict of harvest job id to the ids
+        of the harvest objects gathered for it.
+        """
+        harvester_classes = GeocatHarvesterBase.get_harvester_classes()
+        host_limiters = http_utils.HostConcurrencyLimiters(maximum=host_budget)
+        shared_csw_args = {
+            "session": http_utils.build_session(
+                pool_maxsize=host_budget, host_limiters=host_limiters
+            ),
+            "host_limiters": host_limiters,
+        }
+        harvest_obj_ids = {}
+        with ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="geocat-gather"
+        ) as executor:
+            futures = [
+                (
+                    harvest_job.id,
+                    executor.submit(
+                        harvester_classes[harvest_job.source.type]()._gather_scheduled,
+                        harvest_job.id,
+                        shared_csw_args,
+                    ),
+                )
+                for harvest_job in _longest_gather_first(harvest_jobs)
+            ]
+            for harvest_job_id, future in futures:
+                try:
+                    harvest_obj_ids[harvest_job_id] = future.result()
+                except Exception:
+                    log.exception(f"Gather of harvest job {harvest_job_id} failed")
+                    harvest_obj_ids[harvest_job_id] = []
+        return harvest_obj_ids
+
+    def _gather_scheduled(self, harvest_job_id, shared_csw_args):
+        """
+        Gather one job in a thread of gather_sources, record its duration
+        and queue its harvest objects.
+        """
+        self._shared_csw_args = shared_csw_args
+        try:
+            harvest_job = model.Session.query(HarvestJob).get(harvest_job_id)
+            if not _claim_harvest_job(harvest_job):
+                log.info(f"Harvest job {harvest_job_id} is not new, skipping it")
+                return []
+            started = time.monotonic()
+            harvest_job.gather_started = datetime.utcnow()
+            try:
+                harvest_obj_ids = self.gather_stage(harvest_job)
+            finally:
+                harvest_job.gather_finished = datetime.utcnow()
+                harvest_job.save()
+            duration = time.monotonic() - started
+            log.info(
+                f"Gathered {len(harvest_obj_ids)} objects for source "
+                f"{harvest_job.source_id} in {duration:.1f}s"
+            )
+            state = harvest_state.load_harvest_state(harvest_job.source_id)
+            harvest_state.save_harvest_state(
+                harvest_job.source_id,
+                harvest_state.record_gather_duration(state, duration),
+            )
+            _queue_for_fetch(harvest_obj_ids)
+            return harvest_obj_ids
+        finally:
+            model.Session.remove()
+
     def validate_config(self, config):
         if not config:
             return config
@@ -51,9 +189,19 @@ class GeocatHarvesterBase(HarvesterBase):
         except Exception as e:
             raise ValueError(f"Configuration could not be parsed. An error {e} occured")
 
-        if "delete_missing_datasets" in config_obj:
-            if not isinstance(config_obj["delete_missing_datasets"], bool):
-                raise ValueError("delete_missing_dataset must be boolean")
+        for key in BOOLEAN_CONFIG_OPTIONS:
+            if key in config_obj and not isinstance(config_obj[key], bool):
+                raise ValueError(f"{key} must be boolean")
+
+        for key, (number_types, minimum, maximum) in NUMBER_CONFIG_OPTIONS.items():
+            if key in config_obj and not _is_number_in_range(
+                config_obj[key], number_types, minimum, maximum
+            ):
+                raise ValueError(
+                    f"{key} must be a number between {minimum} and {maximum}"
+                )
+        _validate_page_sizes(config_obj)
+        _validate_choices(config_obj)
 
         if "rights" in config_obj:
             if not config_obj["rights"] in VALID_TERMS_OF_USE:
@@ -72,6 +220,40 @@ class GeocatHarvesterBase(HarvesterBase):
         self.config["delete_missing_datasets"] = self.config.get(
             "delete_missing_datasets", False
         )
+        self.config["batch_records"] = self.config.get("batch_records", True)
+        self.config["fetch_concurrency"] = self.config.get("fetch_concurrency", 1)
+        self.config["request_timeout"] = self.config.get(
+            "request_timeout", http_utils.DEFAULT_TIMEOUT
+        )
+        self.config["prefetch_pages"] = self.config.get("prefetch_pages", 1)
+        self.config["fanout_concurrency"] = self.config.get("fanout_concurrency", 0)
+        self.config["stream_records"] = self.config.get("stream_records", False)
+        self.config["capabilities_cache_ttl"] = self.config.get(
+            "capabilities_cache_ttl", csw_processor.CAPABILITIES_CACHE_TTL
+        )
+        self.config["incremental"] = self.config.get("incremental", False)
+        self.config["full_harvest_interval_days"] = self.config.get(
+            "full_harvest_interval_days", 7
+        )
+        self.config["page_size"] = self.config.get(
+            "page_size", csw_processor.DEFAULT_PAGE_SIZE
+        )
+        self.config["min_page_size"] = self.config.get(
+            "min_page_size", DEFAULT_MIN_PAGE_SIZE
+        )
+        self.config["max_page_size"] = self.config.get(
+            "max_page_size", DEFAULT_MAX_PAGE_SIZE
+        )
+        self.config["hedge_percentile"] = self.config.get("hedge_percentile", 0)
+        self.config["dataset_index"] = self.config.get(
+            "dataset_index", search_utils.DATASET_INDEX_SOLR
+        )
+        self.config["cache_dataset_index"] = self.config.get(
+            "cache_dataset_index", False
+        )
+        self.config["hedge_max_extra_load"] = self.config.get(
+            "hedge_max_extra_load", http_utils.HEDGE_MAX_EXTRA_LOAD
+        )
 
         self.config["geocat_perma_link_label"] = {
             "fr": self.config.get(
@@ -119,6 +301,188 @@ class GeocatHarvesterBase(HarvesterBase):
 
         log.debug(f"Using config: {self.config!r}")
 
+    def _get_cql_args(self):
+        return {
+            "cql": self.config.get("cql", None),
+            "cql_query": self.config.get("cql_query", None),
+            "cql_search_term": self.config.get("cql_search_term", None),
+        }
+
+    def _get_csw_client_args(self):
+        return {
+            "timeout": self.config["request_timeout"],
+            "capabilities_cache_ttl": self.config["capabilities_cache_ttl"],
+            "hedge_percentile": self.config["hedge_percentile"],
+            "hedge_max_extra_load": self.config["hedge_max_extra_load"],
+            **self._shared_csw_args,
+        }
+
+    def _log_csw_stats(self, csw_url, csw_data):
+        log.info(f"CSW connections for {csw_url}: {csw_data.get_connection_stats()}")
+        hedge_stats = csw_data.get_hedge_stats()
+        if hedge_stats is not None:
+            log.info(f"CSW hedged requests for {csw_url}: {hedge_stats}")
+
+    def _get_page_size(self):
+        """
+        Return the adaptive MAXRECORDS for GetRecords with full records,
+        starting at page_size within min_page_size and max_page_size.
+        """
+        return csw_processor.AdaptivePageSize(
+            self.config["page_size"],
+            minimum=self.config["min_page_size"],
+            maximum=self.config["max_page_size"],
+        )
+
+    def _get_listing_page_size(self):
+        """
+        Brief records are small, so the identifier listing starts at the
+        largest page and only shrinks if the catalogue is slow.
+        """
+        return csw_processor.AdaptivePageSize(
+            csw_processor.ID_LISTING_PAGE_SIZE,
+            minimum=self.config["min_page_size"],
+            maximum=csw_processor.ID_LISTING_PAGE_SIZE,
+        )
+
+    def _get_existing_dataset_infos(self, harvest_job):
+        """
+        With cache_dataset_index, the index of the existing datasets is
+        persisted per harvest source and only refreshed with the datasets
+        changed since the last gather.
+        """
+        if self.config["cache_dataset_index"]:
+            get_dataset_infos = search_utils.get_cached_dataset_infos_for_organization
+        else:
+            get_dataset_infos = search_utils.get_dataset_infos_for_organization
+        return get_dataset_infos(
+            organization_name=self.config["organization"],
+            harvest_source_id=harvest_job.source_id,
+            dataset_index=self.config["dataset_index"],
+        )
+
+    def _get_ogdch_identifiers(self, geocat_identifiers):
+        """Return a dict of geocat identifier to ogdch identifier."""
+        return {
+            geocat_identifier: ogdch_map_utils.map_geocat_to_ogdch_identifier(
+                geocat_identifier=geocat_identifier,
+                organization_slug=self.config["organization"],
+            )
+            for geocat_identifier in geocat_identifiers
+        }
+
+    def _reconcile_identifiers(
+        self, existing_dataset_infos, gathered_ogdch_identifiers
+    ):
+        reconciliation = search_utils.reconcile_identifiers(
+            existing_dataset_infos, gathered_ogdch_identifiers
+        )
+        log.info(
+            f"Gathered {len(reconciliation.create)} new and "
+            f"{len(reconciliation.update)} existing datasets, "
+            f"{len(reconciliation.delete)} datasets are missing in the source"
+        )
+        if reconciliation.double:
+            log.warning(
+                f"{len(reconciliation.double)} gathered datasets already exist "
+                f"without belonging to harvest source, e.g. "
+                f"{sorted(reconciliation.double)[:10]}"
+            )
+        return reconciliation
+
+    def _get_modified_since(self, harvest_job):
+        """
+        Return the datetime from which an incremental gather fetches the
+        changed records, or None if all records are gathered.
+        """
+        if not self.config["incremental"]:
+            return None
+        modified_since = harvest_state.get_modified_since(
+            harvest_state.load_harvest_state(harvest_job.source_id),
+            timedelta(days=self.config["full_harvest_interval_days"]),
+        )
+        if modified_since is None:
+            log.info(f"Full gather for harvest source {harvest_job.source_id}")
+        else:
+            log.info(
+                f"Incremental gather for harvest source {harvest_job.source_id}: "
+                f"records modified since {modified_since.isoformat()}"
+            )
+        return modified_since
+
+    def _get_gather_checkpoint(self, harvest_job, modified_since, gather_started):
+        query = json.dumps(
+            dict(
+                self._get_cql_args(),
+                harvester=self.info()["name"],
+                modified_since=modified_since and modified_since.isoformat(),
+            ),
+            sort_keys=True,
+        )
+        checkpoint = harvest_state.GatherCheckpoint(
+            harvest_job.source_id, query, gather_started
+        )
+        if checkpoint.resumed:
+            log.info(
+                f"Resuming gather of harvest source {harvest_job.source_id} at "
+                f"startPosition={checkpoint.next_record}: the previous job "
+                f"gathered {len(checkpoint.seen_ids)} records"
+            )
+        return checkpoint
+
+    def _collect_harvest_object_ids(self, harvest_obj_id_iter, harvest_obj_ids):
+        """
+        Consume the ids of the harvest objects created while the records are
+        mapped into harvest_obj_ids, so that the ids of the records mapped
+        before an error are still returned by the interrupted job.
+        """
+        for harvest_obj_id in harvest_obj_id_iter:
+            harvest_obj_ids.append(harvest_obj_id)
+
+    def _save_harvest_state(self, harvest_job, gather_started, modified_since):
+        """
+        Remember a gather that finished without errors, so that the next
+        incremental gather starts from it. After errors the next gather
+        starts from the previous one again.
+        """
+        if not self.config["incremental"] or harvest_job.gather_errors:
+            return
+        state = harvest_state.load_harvest_state(harvest_job.source_id)
+        harvest_state.save_harvest_state(
+            harvest_job.source_id,
+            harvest_state.record_gather(
+                state, gather_started, full=modified_since is None
+            ),
+        )
+
+    def _save_harvest_object(
+        self, harvest_job, ogdch_identifier, dataset_dict, existing_dataset_infos
+    ):
+        """
+        Save the harvest object of a mapped dataset. The id and name of the
+        package gather found for its identifier are attached as extras, so
+        that the import stage does not have to search for it again.
+        """
+        extras = []
+        pkg_info = existing_dataset_infos.get(ogdch_identifier)
+        if pkg_info is not None:
+            extras = [
+                HarvestObjectExtra(
+                    key=search_utils.PACKAGE_ID_EXTRA, value=pkg_info.package_id
+                ),
+                HarvestObjectExtra(
+                    key=search_utils.PACKAGE_NAME_EXTRA, value=pkg_info.name
+                ),
+            ]
+        harvest_obj = HarvestObject(
+            guid=ogdch_identifier,
+            job=harvest_job,
+            content=json.dumps(dataset_dict),
+            extras=extras,
+        )
+        harvest_obj.save()
+        return harvest_obj
+
     def delete_geocat_ids(self, harvest_job, harvest_obj_ids, packages_to_delete):
         delete_harvest_obj_ids = []
         for package_info in packages_to_delete:
@@ -170,7 +534,7 @@ class GeocatHarvesterBase(HarvesterBase):
             )
             return False
 
-        pkg_info = search_utils.find_package_for_identifier(harvest_object.guid)
+        pkg_info = search_utils.get_package_info_for_harvest_object(harvest_object)
         context = {
             "ignore_auth": True,
             "user": HARVEST_USER,
@@ -263,10 +627,18 @@ class GeocatHarvesterBase(HarvesterBase):
 @tk.blanket.config_declarations
 class GeocatHarvester(GeocatHarvesterBase):
     """
-    Classic geocat harvester (opendata-swiss): CHE / ISO19139.che per record via OWSLib
-    and ``csw_mapping.GeoMetadataMapping``.
+    Classic geocat harvester (opendata-swiss): CHE / ISO19139.che via batch GetRecords
+    (or per record via OWSLib with ``batch_records: false``) and
+    ``csw_mapping.GeoMetadataMapping``.
     """
 
+    p.implements(p.IClick)
+
+    def get_commands(self):
+        from ckanext.geocat.cli import geocat_harvest
+
+        return [geocat_harvest]
+
     def info(self):
         return {
             "name": "geocat_harvester",
@@ -277,16 +649,20 @@ class GeocatHarvester(GeocatHarvesterBase):
 
     def gather_stage(self, harvest_job):
         log.debug("In GeocatHarvester gather_stage")
+        gather_started = datetime.now(timezone.utc)
         self._set_config(harvest_job.source.config, harvest_job.source.id)
 
         csw_url = harvest_job.source.url
 
         try:
-            csw_data = csw_processor.GeocatCatalogueServiceWeb(url=csw_url)
-            gathered_geocat_identifiers = csw_data.get_geocat_id_from_csw(
-                cql=self.config.get("cql", None),
-                cql_query=self.config.get("cql_query", None),
-                cql_search_term=self.config.get("cql_search_term", None),
+            modified_since = self._get_modified_since(harvest_job)
+            csw_data = csw_processor.GeocatCatalogueServiceWeb(
+                url=csw_url, **self._get_csw_client_args()
+            )
+            gathered_geocat_identifiers = list(
+                csw_data.get_geocat_id_from_csw(
+                    maxrecords=self._get_listing_page_size(), **self._get_cql_args()
+                )
             )
         except Exception as e:
             self._save_gather_error(
@@ -297,10 +673,7 @@ class GeocatHarvester(GeocatHarvesterBase):
             return []
 
         try:
-            existing_dataset_infos = search_utils.get_dataset_infos_for_organization(
-                organization_name=self.config["organization"],
-                harvest_source_id=harvest_job.source_id,
-            )
+            existing_dataset_infos = self._get_existing_dataset_infos(harvest_job)
         except Exception as e:
             self._save_gather_error(
                 "Exception getting dataset info for organization: %s: %s / %s"
@@ -313,21 +686,12 @@ class GeocatHarvester(GeocatHarvesterBase):
             )
             return []
 
-        gathered_ogdch_identifiers = [
-            ogdch_map_utils.map_geocat_to_ogdch_identifier(
-                geocat_identifier=geocat_identifier,
-                organization_slug=self.config["organization"],
-            )
-            for geocat_identifier in gathered_geocat_identifiers
-        ]
-
-        all_ogdch_identifiers = set(
-            gathered_ogdch_identifiers + list(existing_dataset_infos.keys())
+        ogdch_identifiers = self._get_ogdch_identifiers(gathered_geocat_identifiers)
+        reconciliation = self._reconcile_identifiers(
+            existing_dataset_infos, ogdch_identifiers.values()
         )
-
         packages_to_delete = search_utils.get_packages_to_delete(
-            existing_dataset_infos=existing_dataset_infos,
-            gathered_ogdch_identifiers=gathered_ogdch_identifiers,
+            existing_dataset_infos, reconciliation
         )
 
         csw_map = csw_mapping.GeoMetadataMapping(
@@ -336,18 +700,62 @@ class GeocatHarvester(GeocatHarvesterBase):
             geocat_perma_label=self.config["geocat_perma_link_label"],
             legal_basis_url=self.config["legal_basis_url"],
             default_rights=self.config["rights"],
-            valid_identifiers=all_ogdch_identifiers,
+            valid_identifiers=existing_dataset_infos.keys() | reconciliation.create,
         )
 
-        harvest_obj_ids = self._map_geocat_dataset_classic(
-            csw_data,
-            csw_map,
-            gathered_geocat_identifiers,
-            gathered_ogdch_identifiers,
-            harvest_job,
-        )
+        # All identifiers were listed up front, so the full records are
+        # mapped page by page while they are fetched.
+        harvest_obj_ids = []
+        try:
+            if self.config["batch_records"]:
+                checkpoint = self._get_gather_checkpoint(
+                    harvest_job, modified_since, gather_started
+                )
+                gather_started = checkpoint.gather_started
+                geocat_records = csw_data.get_records_che(
+                    maxrecords=self._get_page_size(),
+                    prefetch_pages=self.config["prefetch_pages"],
+                    fanout_concurrency=self.config["fanout_concurrency"],
+                    modified_since=modified_since,
+                    start_position=checkpoint.next_record,
+                    seen_ids=checkpoint.seen_ids,
+                    on_page=checkpoint.page_done,
+                    **self._get_cql_args(),
+                )
+                self._collect_harvest_object_ids(
+                    self._map_geocat_dataset_che(
+                        csw_map,
+                        geocat_records,
+                        ogdch_identifiers,
+                        existing_dataset_infos,
+                        harvest_job,
+                    ),
+                    harvest_obj_ids,
+                )
+                checkpoint.clear()
+            else:
+                harvest_obj_ids = self._map_geocat_dataset_classic(
+                    csw_data,
+                    csw_map,
+                    self._get_changed_geocat_identifiers(
+                        csw_data, gathered_geocat_identifiers, modified_since
+                    ),
+                    ogdch_identifiers,
+                    existing_dataset_infos,
+                    harvest_job,
+                )
+        except Exception as e:
+            # Datasets mapped before the error are still imported and the
+            # next job resumes at the page that failed, but nothing is deleted.
+            self._save_gather_error(
+                "Unable to get content for URL: %s: %s / %s"
+                % (csw_url, str(e), traceback.format_exc()),
+                harvest_job,
+            )
+            return harvest_obj_ids
 
         log.debug(f"IDs: {harvest_obj_ids!r}")
+        self._log_csw_stats(csw_url, csw_data)
 
         if self.config["delete_missing_datasets"]:
             delete_harvest_object_ids = self.delete_geocat_ids(
@@ -355,36 +763,53 @@ class GeocatHarvester(GeocatHarvesterBase):
             )
             harvest_obj_ids.extend(delete_harvest_object_ids)
 
+        self._save_harvest_state(harvest_job, gather_started, modified_since)
         return harvest_obj_ids
 
-    def _map_geocat_dataset_classic(
+    def _get_changed_geocat_identifiers(
+        self, csw_data, gathered_geocat_identifiers, modified_since
+    ):
+        """
+        Return the identifiers of the records to fetch one by one: all of
+        them, or in an incremental gather those changed since modified_since.
+        """
+        if modified_since is None:
+            return gathered_geocat_identifiers
+        changed_geocat_identifiers = list(
+            csw_data.get_geocat_id_from_csw(
+                maxrecords=self._get_listing_page_size(),
+                modified_since=modified_since,
+                **self._get_cql_args(),
+            )
+        )
+        log.info(
+            f"{len(changed_geocat_identifiers)} of "
+            f"{len(gathered_geocat_identifiers)} records changed since "
+            f"{modified_since.isoformat()}"
+        )
+        return changed_geocat_identifiers
+
+    def _map_geocat_dataset_che(
         self,
-        csw_data,
         csw_map,
-        gathered_geocat_identifiers,
-        gathered_ogdch_identifiers,
+        geocat_records,
+        ogdch_identifiers,
+        existing_dataset_infos,
         harvest_job,
     ):
-        mapped_harvest_obj_ids = []
-        for geocat_id in gathered_geocat_identifiers:
-
-            ogdch_identifier = ogdch_map_utils.map_geocat_to_ogdch_identifier(
-                geocat_identifier=geocat_id,
-                organization_slug=self.config["organization"],
-            )
-            if ogdch_identifier in gathered_ogdch_identifiers:
+        """
+        Map the records as they are fetched and yield the ids of the harvest
+        objects. Only records in the dict ogdch_identifiers of the listed
+        geocat identifiers are mapped.
+        """
+        for geocat_id, record_element in geocat_records:
+
+            ogdch_identifier = ogdch_identifiers.get(geocat_id)
+            if ogdch_identifier is not None:
                 try:
-                    csw_record_as_string = csw_data.get_record_by_id(geocat_id)
-                except Exception as e:
-                    self._save_gather_error(
-                        "Error when reading csw record from source: %s %r / %s"
-                        % (ogdch_identifier, e, traceback.format_exc()),
-                        harvest_job,
+                    dataset_dict = csw_map.get_metadata_from_element(
+                        record_element, geocat_id
                     )
-                    continue
-
-                try:
-                    dataset_dict = csw_map.get_metadata(csw_record_as_string, geocat_id)
                 except Exception as e:
                     self._save_gather_error(
                         "Error when mapping csw data to dcat: %s %r / %s"
@@ -394,21 +819,74 @@ class GeocatHarvester(GeocatHarvesterBase):
                     continue
 
                 try:
-                    harvest_obj = HarvestObject(
-                        guid=ogdch_identifier,
-                        job=harvest_job,
-                        content=json.dumps(dataset_dict),
+                    harvest_obj = self._save_harvest_object(
+                        harvest_job,
+                        ogdch_identifier,
+                        dataset_dict,
+                        existing_dataset_infos,
                     )
-                    harvest_obj.save()
                 except Exception as e:
                     self._save_gather_error(
                         "Error when processsing dataset: %s %r / %s"
                         % (ogdch_identifier, e, traceback.format_exc()),
                         harvest_job,
                     )
-                    continue
                 else:
-                    mapped_harvest_obj_ids.append(harvest_obj.id)
+                    yield harvest_obj.id
+
+    def _map_geocat_dataset_classic(
+        self,
+        csw_data,
+        csw_map,
+        gathered_geocat_identifiers,
+        ogdch_identifiers,
+        existing_dataset_infos,
+        harvest_job,
+    ):
+        mapped_harvest_obj_ids = []
+        ogdch_identifiers = {
+            geocat_id: ogdch_identifiers[geocat_id]
+            for geocat_id in gathered_geocat_identifiers
+            if geocat_id in ogdch_identifiers
+        }
+
+        geocat_records = csw_data.get_records_by_id(
+            list(ogdch_identifiers.keys()),
+            fetch_concurrency=self.config["fetch_concurrency"],
+        )
+        for geocat_id, csw_record_as_string, fetch_error in geocat_records:
+            ogdch_identifier = ogdch_identifiers[geocat_id]
+            if fetch_error is not None:
+                self._save_gather_error(
+                    "Error when reading csw record from source: %s %r / %s"
+                    % (ogdch_identifier, fetch_error, _format_exception(fetch_error)),
+                    harvest_job,
+                )
+                continue
+
+            try:
+                dataset_dict = csw_map.get_metadata(csw_record_as_string, geocat_id)
+            except Exception as e:
+                self._save_gather_error(
+                    "Error when mapping csw data to dcat: %s %r / %s"
+                    % (ogdch_identifier, e, traceback.format_exc()),
+                    harvest_job,
+                )
+                continue
+
+            try:
+                harvest_obj = self._save_harvest_object(
+                    harvest_job, ogdch_identifier, dataset_dict, existing_dataset_infos
+                )
+            except Exception as e:
+                self._save_gather_error(
+                    "Error when processsing dataset: %s %r / %s"
+                    % (ogdch_identifier, e, traceback.format_exc()),
+                    harvest_job,
+                )
+                continue
+            else:
+                mapped_harvest_obj_ids.append(harvest_obj.id)
         return mapped_harvest_obj_ids
 
 
@@ -430,24 +908,41 @@ class GeocatEch0271Harvester(GeocatHarvesterBase):
 
     def gather_stage(self, harvest_job):
         log.debug("In GeocatEch0271Harvester gather_stage")
+        gather_started = datetime.now(timezone.utc)
         self._set_config(harvest_job.source.config, harvest_job.source.id)
 
         csw_url = harvest_job.source.url
 
         try:
-            csw_data = csw_processor.GeocatDcatCatalogueServiceWeb(url=csw_url)
-            geocat_records = list(
-                csw_data.get_records_dcat(
-                    cql=self.config.get("cql", None),
-                    cql_query=self.config.get("cql_query", None),
-                    cql_search_term=self.config.get("cql_search_term", None),
-                )
+            modified_since = self._get_modified_since(harvest_job)
+            checkpoint = self._get_gather_checkpoint(
+                harvest_job, modified_since, gather_started
+            )
+            gather_started = checkpoint.gather_started
+            csw_data = csw_processor.GeocatDcatCatalogueServiceWeb(
+                url=csw_url, **self._get_csw_client_args()
+            )
+            # All identifiers are listed up front, so that relations to
+            # records on later pages are valid while the pages are mapped.
+            gathered_ogdch_identifiers = set(
+                self._get_ogdch_identifiers(
+                    csw_data.get_geocat_id_from_csw(
+                        maxrecords=self._get_listing_page_size(),
+                        **self._get_cql_args(),
+                    )
+                ).values()
+            )
+            geocat_records = csw_data.get_records_dcat(
+                maxrecords=self._get_page_size(),
+                prefetch_pages=self.config["prefetch_pages"],
+                fanout_concurrency=self.config["fanout_concurrency"],
+                stream=self.config["stream_records"],
+                modified_since=modified_since,
+                start_position=checkpoint.next_record,
+                seen_ids=checkpoint.seen_ids,
+                on_page=checkpoint.page_done,
+                **self._get_cql_args(),
             )
-            if not geocat_records:
-                raise csw_processor.CswNotFoundError(
-                    f"No dataset found for url {csw_url!r} with current CQL settings"
-                )
-            gathered_geocat_identifiers = [gid for gid, _ in geocat_records]
         except Exception as e:
             self._save_gather_error(
                 "Unable to get content for URL: %s: %s / %s"
@@ -457,10 +952,7 @@ class GeocatEch0271Harvester(GeocatHarvesterBase):
             return []
 
         try:
-            existing_dataset_infos = search_utils.get_dataset_infos_for_organization(
-                organization_name=self.config["organization"],
-                harvest_source_id=harvest_job.source_id,
-            )
+            existing_dataset_infos = self._get_existing_dataset_infos(harvest_job)
         except Exception as e:
             self._save_gather_error(
                 "Exception getting dataset info for organization: %s: %s / %s"
@@ -473,91 +965,98 @@ class GeocatEch0271Harvester(GeocatHarvesterBase):
             )
             return []
 
-        gathered_ogdch_identifiers = [
-            ogdch_map_utils.map_geocat_to_ogdch_identifier(
-                geocat_identifier=geocat_identifier,
-                organization_slug=self.config["organization"],
-            )
-            for geocat_identifier in gathered_geocat_identifiers
-        ]
-
-        all_ogdch_identifiers = set(
-            gathered_ogdch_identifiers + list(existing_dataset_infos.keys())
-        )
-
-        packages_to_delete = search_utils.get_packages_to_delete(
-            existing_dataset_infos=existing_dataset_infos,
-            gathered_ogdch_identifiers=gathered_ogdch_identifiers,
-        )
-
+        # The records are mapped while the next pages are still being fetched.
         csw_map = dcat_mapping.DcatMetadataMapping(
             organization_slug=self.config["organization"],
             geocat_perma_link=self.config["geocat_perma_link_url"],
             geocat_perma_label=self.config["geocat_perma_link_label"],
             legal_basis_url=self.config["legal_basis_url"],
             default_rights=self.config["rights"],
-            valid_identifiers=all_ogdch_identifiers,
+            valid_identifiers=existing_dataset_infos.keys()
+            | gathered_ogdch_identifiers,
         )
 
-        harvest_obj_ids = self._map_geocat_dataset_dcat(
-            csw_map,
-            geocat_records,
-            gathered_ogdch_identifiers,
-            harvest_job,
-        )
+        harvest_obj_ids = []
+        try:
+            self._collect_harvest_object_ids(
+                self._map_geocat_dataset_dcat(
+                    csw_map,
+                    geocat_records,
+                    existing_dataset_infos,
+                    harvest_job,
+                ),
+                harvest_obj_ids,
+            )
+            checkpoint.clear()
+        except Exception as e:
+            # Datasets mapped before the error are still imported and the
+            # next job resumes at the page that failed, but nothing is deleted.
+            self._save_gather_error(
+                "Unable to get content for URL: %s: %s / %s"
+                % (csw_url, str(e), traceback.format_exc()),
+                harvest_job,
+            )
+            return harvest_obj_ids
 
         log.debug(f"IDs: {harvest_obj_ids!r}")
+        self._log_csw_stats(csw_url, csw_data)
 
         if self.config["delete_missing_datasets"]:
+            reconciliation = self._reconcile_identifiers(
+                existing_dataset_infos, gathered_ogdch_identifiers
+            )
+            packages_to_delete = search_utils.get_packages_to_delete(
+                existing_dataset_infos, reconciliation
+            )
             delete_harvest_object_ids = self.delete_geocat_ids(
                 harvest_job, harvest_obj_ids, packages_to_delete
             )
             harvest_obj_ids.extend(delete_harvest_object_ids)
 
+        self._save_harvest_state(harvest_job, gather_started, modified_since)
         return harvest_obj_ids
 
     def _map_geocat_dataset_dcat(
         self,
         csw_map,
         geocat_records,
-        gathered_ogdch_identifiers,
+        existing_dataset_infos,
         harvest_job,
     ):
-        mapped_harvest_obj_ids = []
-        for geocat_id, csw_record_as_string in geocat_records:
+        """
+        Map the records as they are fetched and yield the ids of the harvest
+        objects.
+        """
+        for geocat_id, dataset_element in geocat_records:
 
             ogdch_identifier = ogdch_map_utils.map_geocat_to_ogdch_identifier(
                 geocat_identifier=geocat_id,
                 organization_slug=self.config["organization"],
             )
-            if ogdch_identifier in gathered_ogdch_identifiers:
-                try:
-                    dataset_dict = csw_map.get_metadata(csw_record_as_string, geocat_id)
-                except Exception as e:
-                    self._save_gather_error(
-                        "Error when mapping csw data to dcat: %s %r / %s"
-                        % (ogdch_identifier, e, traceback.format_exc()),
-                        harvest_job,
-                    )
-                    continue
+            try:
+                dataset_dict = csw_map.get_metadata_from_element(
+                    dataset_element, geocat_id
+                )
+            except Exception as e:
+                self._save_gather_error(
+                    "Error when mapping csw data to dcat: %s %r / %s"
+                    % (ogdch_identifier, e, traceback.format_exc()),
+                    harvest_job,
+                )
+                continue
 
-                try:
-                    harvest_obj = HarvestObject(
-                        guid=ogdch_identifier,
-                        job=harvest_job,
-                        content=json.dumps(dataset_dict),
-                    )
-                    harvest_obj.save()
-                except Exception as e:
-                    self._save_gather_error(
-                        "Error when processsing dataset: %s %r / %s"
-                        % (ogdch_identifier, e, traceback.format_exc()),
-                        harvest_job,
-                    )
-                    continue
-                else:
-                    mapped_harvest_obj_ids.append(harvest_obj.id)
-        return mapped_harvest_obj_ids
+            try:
+                harvest_obj = self._save_harvest_object(
+                    harvest_job, ogdch_identifier, dataset_dict, existing_dataset_infos
+                )
+            except Exception as e:
+                self._save_gather_error(
+                    "Error when processsing dataset: %s %r / %s"
+                    % (ogdch_identifier, e, traceback.format_exc()),
+                    harvest_job,
+                )
+            else:
+                yield harvest_obj.id
 
 
 class GeocatConfigError(Exception):
@@ -573,3 +1072,66 @@ def _derive_flat_title(title_dict):
         or title_dict.get("it")
         or ""
     )
+
+
+def _format_exception(e):
+    """traceback.format_exc() for an exception that was caught in another thread"""
+    return "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+
+def _claim_harvest_job(harvest_job):
+    """Set a New harvest job to Running, unless another gather took it."""
+    claimed = (
+        model.Session.query(HarvestJob)
+        .filter(HarvestJob.id == harvest_job.id, HarvestJob.status == "New")
+        .update({"status": "Running"}, synchronize_session=False)
+    )
+    model.Session.commit()
+    model.Session.refresh(harvest_job)
+    return bool(claimed)
+
+
+def _queue_for_fetch(harvest_obj_ids):
+    if not harvest_obj_ids:
+        return
+    publisher = get_fetch_publisher()
+    try:
+        for harvest_obj_id in harvest_obj_ids:
+            publisher.send({"harvest_object_id": harvest_obj_id})
+    finally:
+        publisher.close()
+
+
+def _longest_gather_first(harvest_jobs):
+    def _last_duration(harvest_job):
+        state = harvest_state.load_harvest_state(harvest_job.source_id)
+        seconds = harvest_state.get_last_gather_seconds(state)
+        return math.inf if seconds is None else seconds
+
+    return sorted(harvest_jobs, key=_last_duration, reverse=True)
+
+
+def _validate_choices(config_obj):
+    for key, choices in CHOICE_CONFIG_OPTIONS.items():
+        if key in config_obj and config_obj[key] not in choices:
+            raise ValueError(f"{key} must be one of {', '.join(choices)}")
+
+
+def _validate_page_sizes(config_obj):
+    min_page_size = config_obj.get("min_page_size", DEFAULT_MIN_PAGE_SIZE)
+    max_page_size = config_obj.get("max_page_size", DEFAULT_MAX_PAGE_SIZE)
+    page_size = config_obj.get("page_size", csw_processor.DEFAULT_PAGE_SIZE)
+    if not min_page_size <= page_size <= max_page_size:
+        raise ValueError(
+            f"page_size {page_size} must be between min_page_size "
+            f"{min_page_size} and max_page_size {max_page_size}"
+        )
+
+
+def _is_number_in_range(value, number_types, minimum, maximum):
+    """bool is a subclass of int, but not a valid number option"""
+    return (
+        isinstance(value, number_types)
+        and not isinstance(value, bool)
+        and minimum <= value <= maximum
+    )
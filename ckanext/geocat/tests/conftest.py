@@ -52,6 +52,20 @@ def harvest_source(org):
     )
 
 
+@pytest.fixture
+def harvest_source_per_record(org):
+    """Harvest source for the classic harvester fetching one GetRecordById per
+    dataset (``batch_records: false``)."""
+    return harvest_factories.HarvestSource(
+        title="Geocat harvester",
+        name="geocat-harvester",
+        url="http://mock-geocat.ch",
+        source_type="geocat_harvester",
+        owner_org=org["id"],
+        config=json.dumps({"delete_missing_datasets": True, "batch_records": False}),
+    )
+
+
 @pytest.fixture
 def harvest_source_ech0271(org):
     """Harvest source for DCAT-AP-CH / eCH-0271 (``geocat-ech0271``) functional tests."""
@@ -63,3 +77,17 @@ def harvest_source_ech0271(org):
         owner_org=org["id"],
         config=json.dumps({"delete_missing_datasets": True}),
     )
+
+
+@pytest.fixture
+def harvest_source_ech0271_incremental(org):
+    """eCH-0271 harvest source that only gathers the records changed since the
+    last gather (``incremental: true``)."""
+    return harvest_factories.HarvestSource(
+        title="Geocat eCH-0271 harvester",
+        name="geocat-ech0271-harvester",
+        url="http://mock-geocat.ch",
+        source_type="geocat-ech0271",
+        owner_org=org["id"],
+        config=json.dumps({"delete_missing_datasets": True, "incremental": True}),
+    )
@@ -0,0 +1,780 @@
+"""Tests for the CSW clients in csw_processor (batch GetRecords)."""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import requests
+import requests_mock
+from lxml import etree
+
+from ckanext.geocat.utils import csw_mapping, csw_processor, dcat_mapping, http_utils
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+MOCK_URL = "http://mock-geocat.ch"
+MOCK_RECORD_URL = "http://mock-geocat.ch/geonetwork/srv/eng/csw-BAKOM"
+GEOCAT_ID_1 = "2466-4690-b54d-c1d958f1c3b8-93814e81"
+ORG_SLUG = "swisstopo"
+
+
+def _load_xml(filename):
+    path = os.path.join(__location__, "fixtures", "test_harvesters", filename)
+    with open(path) as f:
+        return f.read()
+
+
+def _paged(filename, matched, next_record):
+    """Return a one-record GetRecords fixture as a page of ``matched`` records."""
+    return (
+        _load_xml(filename)
+        .replace('numberOfRecordsMatched="1"', f'numberOfRecordsMatched="{matched}"')
+        .replace('nextRecord="0"', f'nextRecord="{next_record}"')
+    )
+
+
+def _make_client(client_class):
+    return client_class(MOCK_URL, capabilities_cache_ttl=0)
+
+
+def _mapping_args():
+    return dict(
+        organization_slug=ORG_SLUG,
+        geocat_perma_link="https://perma-link/",
+        geocat_perma_label={lang: "geocat link" for lang in ["de", "fr", "en", "it"]},
+        legal_basis_url="",
+        default_rights="",
+        valid_identifiers=[],
+    )
+
+
+def _make_csw_map():
+    return csw_mapping.GeoMetadataMapping(**_mapping_args())
+
+
+def _make_dcat_map():
+    return dcat_mapping.DcatMetadataMapping(**_mapping_args())
+
+
+class TestGetRecordsChe(unittest.TestCase):
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatCatalogueServiceWeb)
+
+    def test_get_records_che_splits_page_into_records(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("response_getrecords_che_batch.xml"))
+            geocat_records = list(self.csw_data.get_records_che())
+            self.assertEqual(1, m.call_count)
+            params = m.last_request.qs
+            self.assertEqual(["getrecords"], params["request"])
+            self.assertEqual([csw_processor.CHE_SCHEMA], params["outputschema"])
+            self.assertEqual(["full"], params["elementsetname"])
+
+        self.assertEqual(2, len(geocat_records))
+        self.assertEqual(GEOCAT_ID_1, geocat_records[0][0])
+        for _, record_element in geocat_records:
+            self.assertIn(record_element.tag, csw_processor._CHE_RECORD_TAGS)
+
+    def test_get_records_che_maps_like_get_record_by_id(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("response_getrecords_che_batch.xml"))
+            geocat_records = list(self.csw_data.get_records_che())
+
+        csw_map = _make_csw_map()
+        for (geocat_id, record_element), filename in zip(
+            geocat_records, ["result_1.xml", "result_2.xml"]
+        ):
+            self.assertEqual(
+                csw_map.get_metadata(_load_xml(filename), geocat_id),
+                csw_map.get_metadata_from_element(record_element, geocat_id),
+            )
+
+    def test_get_records_che_skips_duplicate_ids(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                MOCK_URL,
+                [
+                    {"text": _paged("response_getrecords_che_one.xml", 2, 2)},
+                    {"text": _paged("response_getrecords_che_one.xml", 2, 0)},
+                ],
+            )
+            geocat_records = list(self.csw_data.get_records_che(maxrecords=1))
+            self.assertEqual(2, m.call_count)
+            self.assertEqual(["2"], m.last_request.qs["startposition"])
+
+        self.assertEqual([GEOCAT_ID_1], [gid for gid, _ in geocat_records])
+
+
+def _brief_page(geocat_ids, matched, next_record):
+    """Return a GetRecords page of brief records for ``geocat_ids``."""
+    records = "".join(
+        f"<csw:BriefRecord><dc:identifier>{geocat_id}</dc:identifier>"
+        f"<dc:title>{geocat_id}</dc:title></csw:BriefRecord>"
+        for geocat_id in geocat_ids
+    )
+    return (
+        '<csw:GetRecordsResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<csw:SearchResults numberOfRecordsMatched="{matched}" '
+        f'numberOfRecordsReturned="{len(geocat_ids)}" elementSet="brief" '
+        f'nextRecord="{next_record}">{records}</csw:SearchResults>'
+        "</csw:GetRecordsResponse>"
+    )
+
+
+class TestGetGeocatIdFromCsw(unittest.TestCase):
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatCatalogueServiceWeb)
+
+    def test_lists_identifiers_of_brief_records(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_brief_page(["id-1", "id-2"], 2, 0))
+            geocat_ids = list(
+                self.csw_data.get_geocat_id_from_csw(
+                    cql_query="subject", cql_search_term="opendata.swiss"
+                )
+            )
+            params = m.last_request.qs
+            self.assertEqual(["getrecords"], params["request"])
+            self.assertEqual(["brief"], params["elementsetname"])
+            self.assertEqual(
+                [csw_processor.CSW_RECORD_SCHEMA.lower()], params["outputschema"]
+            )
+            self.assertEqual(
+                [str(csw_processor.ID_LISTING_PAGE_SIZE)], params["maxrecords"]
+            )
+
+        self.assertEqual(["id-1", "id-2"], geocat_ids)
+
+    def test_accepts_summary_records(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("response_all_results.xml"))
+            geocat_ids = list(self.csw_data.get_geocat_id_from_csw())
+
+        self.assertEqual(
+            [GEOCAT_ID_1, "93814e81-2466-4690-b54d-c1d958f1c3b8"], geocat_ids
+        )
+
+    def test_pages_until_next_record_is_zero(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                MOCK_URL,
+                [
+                    {"text": _brief_page(["id-1", "id-2"], 3, 3)},
+                    {"text": _brief_page(["id-3"], 3, 0)},
+                ],
+            )
+            geocat_ids = list(self.csw_data.get_geocat_id_from_csw(maxrecords=2))
+            self.assertEqual(2, m.call_count)
+            self.assertEqual(["3"], m.last_request.qs["startposition"])
+
+        self.assertEqual(["id-1", "id-2", "id-3"], geocat_ids)
+
+    def test_stops_on_non_advancing_next_record(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_brief_page(["id-1", "id-2"], 4, 1))
+            geocat_ids = list(self.csw_data.get_geocat_id_from_csw(maxrecords=2))
+            self.assertEqual(1, m.call_count)
+
+        self.assertEqual(["id-1", "id-2"], geocat_ids)
+
+    def test_raises_when_nothing_matches(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_brief_page([], 0, 0))
+            with self.assertRaises(csw_processor.CswNotFoundError):
+                list(self.csw_data.get_geocat_id_from_csw())
+
+    def test_lists_records_modified_since(self):
+        modified_since = datetime(
+            2024, 3, 9, 3, 30, tzinfo=timezone(timedelta(hours=1))
+        )
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_brief_page([], 0, 0))
+            geocat_ids = list(
+                self.csw_data.get_geocat_id_from_csw(modified_since=modified_since)
+            )
+            constraint = m.last_request.qs["constraint"][0]
+
+        self.assertEqual([], geocat_ids)
+        self.assertEqual(
+            "(subject = 'opendata.swiss') and modified >= '2024-03-09t02:30:00z'",
+            constraint,
+        )
+
+
+class TestCapabilitiesCache(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+
+    def _make_client(self, capabilities_cache_ttl=60):
+        return csw_processor.GeocatCatalogueServiceWeb(
+            MOCK_URL,
+            capabilities_cache_ttl=capabilities_cache_ttl,
+            capabilities_cache_dir=self.cache_dir,
+        )
+
+    def _get_record_by_id_url(self, csw):
+        get_verbs = csw.get_operation_by_name("GetRecordById").methods
+        return [m["url"] for m in get_verbs if m["type"] == "Get"][0]
+
+    def test_capabilities_are_requested_on_first_use(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("capabilities.xml"))
+            csw_data = self._make_client()
+            self.assertEqual(0, m.call_count)
+
+            csw = csw_data.csw
+            self.assertIs(csw, csw_data.csw)
+            self.assertEqual(1, m.call_count)
+            self.assertEqual(["getcapabilities"], m.last_request.qs["request"])
+
+        self.assertEqual(MOCK_RECORD_URL, self._get_record_by_id_url(csw))
+
+    def test_cached_endpoint_is_reused(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("capabilities.xml"))
+            self._make_client().csw
+            csw_data = self._make_client()
+            csw = csw_data.csw
+            self.assertEqual(1, m.call_count)
+
+            m.get(MOCK_RECORD_URL, text=_load_xml("result_1.xml"))
+            self.assertTrue(csw_data.get_record_by_id(GEOCAT_ID_1))
+            self.assertEqual(2, m.call_count)
+            self.assertEqual(["getrecordbyid"], m.last_request.qs["request"])
+            self.assertTrue(m.last_request.url.startswith(MOCK_RECORD_URL))
+
+        self.assertEqual(MOCK_RECORD_URL, csw.url)
+
+    def test_record_is_fetched_without_host_limiters(self):
+        csw_data = csw_processor.GeocatCatalogueServiceWeb(
+            MOCK_URL, capabilities_cache_ttl=0, host_limiters=None
+        )
+        self.assertIsNone(csw_data.limiter)
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("capabilities.xml"))
+            m.get(MOCK_RECORD_URL, text=_load_xml("result_1.xml"))
+            self.assertTrue(csw_data.get_record_by_id(GEOCAT_ID_1))
+
+    def test_stale_capabilities_are_requested_again(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("capabilities.xml"))
+            self._make_client().csw
+            (cache_file,) = os.listdir(self.cache_dir)
+            stale = time.time() - 120
+            os.utime(os.path.join(self.cache_dir, cache_file), (stale, stale))
+            self._make_client().csw
+            self.assertEqual(2, m.call_count)
+
+    def test_cache_is_not_written_when_disabled(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("capabilities.xml"))
+            self._make_client(capabilities_cache_ttl=0).csw
+
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+
+class TestReadAhead(unittest.TestCase):
+    def _counting_iterator(self, count, produced):
+        for i in range(count):
+            produced.append(i)
+            yield i
+
+    def _wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+
+    def test_read_ahead_yields_items_in_order(self):
+        produced = []
+        self.assertEqual(
+            list(range(10)),
+            list(csw_processor._read_ahead(self._counting_iterator(10, produced), 2)),
+        )
+
+    def test_read_ahead_is_bounded(self):
+        produced = []
+        pages = csw_processor._read_ahead(self._counting_iterator(10, produced), 2)
+        self.assertEqual(0, next(pages))
+        # While item 0 is processed, items 1 and 2 are fetched, but not item 3.
+        self._wait_for(lambda: len(produced) >= 3)
+        time.sleep(0.05)
+        self.assertEqual([0, 1, 2], produced)
+        pages.close()
+
+    def test_read_ahead_raises_errors_in_order(self):
+        def _failing_iterator():
+            yield 1
+            raise csw_processor.CswNotFoundError("page 2")
+
+        pages = csw_processor._read_ahead(_failing_iterator(), 1)
+        self.assertEqual(1, next(pages))
+        with self.assertRaises(csw_processor.CswNotFoundError):
+            next(pages)
+
+    def test_get_records_dcat_with_prefetch(self):
+        csw_data = _make_client(csw_processor.GeocatDcatCatalogueServiceWeb)
+        with requests_mock.Mocker() as m:
+            m.get(
+                MOCK_URL,
+                [
+                    {"text": _paged("response_getrecords_dcat_one.xml", 2, 2)},
+                    {"text": _load_xml("response_getrecords_dcat_batch.xml")},
+                ],
+            )
+            geocat_records = csw_data.get_records_dcat(maxrecords=1, prefetch_pages=1)
+            self.assertEqual(GEOCAT_ID_1, next(geocat_records)[0])
+            # the second page is requested before the first one is used up
+            self._wait_for(lambda: m.call_count == 2)
+            self.assertEqual(2, m.call_count)
+            self.assertEqual(
+                ["93814e81-2466-4690-b54d-c1d958f1c3b8"],
+                [gid for gid, _ in geocat_records],
+            )
+
+
+def _dcat_page(geocat_ids, matched, next_record):
+    datasets = "".join(
+        f"<dcat:Dataset><dct:identifier>{geocat_id}</dct:identifier></dcat:Dataset>"
+        for geocat_id in geocat_ids
+    )
+    return (
+        '<csw:GetRecordsResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+        'xmlns:dcat="http://www.w3.org/ns/dcat#" xmlns:dct="http://purl.org/dc/terms/">'
+        f'<csw:SearchResults numberOfRecordsMatched="{matched}" '
+        f'numberOfRecordsReturned="{len(geocat_ids)}" nextRecord="{next_record}"/>'
+        f"{datasets}</csw:GetRecordsResponse>"
+    )
+
+
+class _Catalogue(object):
+    """Answers GetRecords requests from a list of ids that can change while the
+    harvester pages through it, with pages of ``page_size`` or of the requested
+    MAXRECORDS. Records the start positions, the requested page sizes and the
+    number of requests in flight."""
+
+    def __init__(self, geocat_ids, page_size=None):
+        self.geocat_ids = geocat_ids
+        self.page_size = page_size
+        self.starts = []
+        self.maxrecords = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request, context):
+        start = int(request.qs["startposition"][0])
+        maxrecords = int(request.qs["maxrecords"][0])
+        with self.lock:
+            self.starts.append(start)
+            self.maxrecords.append(maxrecords)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            geocat_ids = list(self.geocat_ids)
+        time.sleep(0.01)
+        page_size = self.page_size or maxrecords
+        page = geocat_ids[start - 1 : start - 1 + page_size]
+        next_record = start + len(page)
+        with self.lock:
+            self.in_flight -= 1
+        return _dcat_page(
+            page, len(geocat_ids), next_record if next_record <= len(geocat_ids) else 0
+        )
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatDcatCatalogueServiceWeb)
+
+    def test_fan_out_merges_pages_in_start_order(self):
+        catalogue = _Catalogue([f"id-{i}" for i in range(1, 12)], page_size=2)
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=catalogue)
+            geocat_ids = [
+                gid
+                for gid, _ in self.csw_data.get_records_dcat(
+                    maxrecords=2, fanout_concurrency=3
+                )
+            ]
+
+        self.assertEqual(catalogue.geocat_ids, geocat_ids)
+        self.assertEqual([1, 3, 5, 7, 9, 11], sorted(catalogue.starts))
+        self.assertLessEqual(catalogue.max_in_flight, 3)
+
+    def test_fan_out_falls_back_to_sequential_when_catalogue_shifts(self):
+        catalogue = _Catalogue([f"id-{i}" for i in range(1, 6)], page_size=2)
+
+        def _first_page_then_insert(request, context):
+            body = catalogue(request, context)
+            if request.qs["startposition"] == ["1"]:
+                # a record is added at the front after the first page
+                with catalogue.lock:
+                    catalogue.geocat_ids.insert(0, "id-0")
+            return body
+
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_first_page_then_insert)
+            with self.assertLogs(csw_processor.log, "WARNING"):
+                geocat_ids = [
+                    gid
+                    for gid, _ in self.csw_data.get_records_dcat(
+                        maxrecords=2, fanout_concurrency=2
+                    )
+                ]
+
+        # Pages 3 and 5 are fetched again sequentially; id-2 is returned again
+        # on the shifted page 3 and suppressed as a duplicate.
+        self.assertEqual(["id-1", "id-2", "id-3", "id-4", "id-5"], geocat_ids)
+        self.assertEqual([1, 3, 3, 5, 5], sorted(catalogue.starts))
+
+    def test_is_expected_page(self):
+        root = etree.fromstring(_dcat_page(["a", "b"], 5, 5))
+        self.assertTrue(csw_processor._is_expected_page(root, 3, 5, 2))
+        self.assertFalse(csw_processor._is_expected_page(root, 3, 6, 2))
+        self.assertFalse(csw_processor._is_expected_page(root, 1, 5, 2))
+        last_page = etree.fromstring(_dcat_page(["e"], 5, 0))
+        self.assertTrue(csw_processor._is_expected_page(last_page, 5, 5, 2))
+
+
+class TestStreamRecords(unittest.TestCase):
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatDcatCatalogueServiceWeb)
+
+    def test_stream_matches_parsed_pages(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                MOCK_URL,
+                [
+                    {"text": _paged("response_getrecords_dcat_one.xml", 2, 2)},
+                    {"text": _load_xml("response_getrecords_dcat_batch.xml")},
+                ]
+                * 2,
+            )
+            dcat_map = _make_dcat_map()
+            # streamed elements are cleared once the next one is requested,
+            # so every record is mapped as it arrives
+            parsed = [
+                dcat_map.get_metadata_from_element(dataset_element, geocat_id)
+                for geocat_id, dataset_element in self.csw_data.get_records_dcat(
+                    maxrecords=1
+                )
+            ]
+            streamed = [
+                dcat_map.get_metadata_from_element(dataset_element, geocat_id)
+                for geocat_id, dataset_element in self.csw_data.get_records_dcat(
+                    maxrecords=1, stream=True
+                )
+            ]
+            self.assertEqual(4, m.call_count)
+
+        self.assertEqual(2, len(streamed))
+        self.assertEqual(parsed, streamed)
+
+    def test_stream_clears_earlier_records(self):
+        geocat_ids = [f"id-{i}" for i in range(1, 501)]
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_dcat_page(geocat_ids, 500, 0))
+            streamed_ids = []
+            for dataset_elem in self.csw_data._stream_records(
+                csw_processor.DCAT_AP_CH_SCHEMA,
+                (csw_processor._DCAT_DATASET_TAG,),
+                maxrecords=500,
+            ):
+                # only the (cleared) previous record is still in the tree
+                self.assertLessEqual(
+                    len(list(dataset_elem.itersiblings(preceding=True))), 1
+                )
+                streamed_ids.append(
+                    dataset_elem.find(csw_processor._DCT_IDENTIFIER_TAG).text
+                )
+
+        self.assertEqual(geocat_ids, streamed_ids)
+
+    def test_stream_raises_on_invalid_xml(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_dcat_page(["a"], 1, 0)[:-10])
+            with self.assertRaises(csw_processor.CswNotFoundError):
+                list(self.csw_data.get_records_dcat(stream=True))
+
+
+class TestResumePaging(unittest.TestCase):
+    modes = [
+        {},
+        {"prefetch_pages": 1},
+        {"fanout_concurrency": 3},
+        {"stream": True},
+    ]
+
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatDcatCatalogueServiceWeb)
+
+    def test_on_page_reports_next_start_position(self):
+        for mode in self.modes:
+            with self.subTest(**mode):
+                catalogue = _Catalogue([f"id-{i}" for i in range(1, 6)], page_size=2)
+                next_records = []
+                with requests_mock.Mocker() as m:
+                    m.get(MOCK_URL, text=catalogue)
+                    geocat_ids = [
+                        gid
+                        for gid, _ in self.csw_data.get_records_dcat(
+                            maxrecords=2, on_page=next_records.append, **mode
+                        )
+                    ]
+
+                self.assertEqual(catalogue.geocat_ids, geocat_ids)
+                self.assertEqual([3, 5, None], next_records)
+
+    def test_on_page_waits_until_page_is_consumed(self):
+        catalogue = _Catalogue([f"id-{i}" for i in range(1, 6)], page_size=2)
+        next_records = []
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=catalogue)
+            geocat_records = self.csw_data.get_records_dcat(
+                maxrecords=2, prefetch_pages=1, on_page=next_records.append
+            )
+            next(geocat_records)
+            next(geocat_records)
+            self.assertEqual([], next_records)
+            self.assertEqual("id-3", next(geocat_records)[0])
+            self.assertEqual([3], next_records)
+
+    def test_resume_at_start_position(self):
+        for mode in self.modes:
+            with self.subTest(**mode):
+                catalogue = _Catalogue([f"id-{i}" for i in range(1, 6)], page_size=2)
+                seen_ids = {"id-1", "id-2"}
+                with requests_mock.Mocker() as m:
+                    m.get(MOCK_URL, text=catalogue)
+                    geocat_ids = [
+                        gid
+                        for gid, _ in self.csw_data.get_records_dcat(
+                            maxrecords=2, start_position=3, seen_ids=seen_ids, **mode
+                        )
+                    ]
+
+                self.assertEqual(["id-3", "id-4", "id-5"], geocat_ids)
+                self.assertEqual([3, 5], sorted(catalogue.starts))
+                self.assertEqual(set(catalogue.geocat_ids), seen_ids)
+
+
+class TestAdaptivePageSize(unittest.TestCase):
+    modes = [{}, {"prefetch_pages": 1}, {"stream": True}]
+
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatDcatCatalogueServiceWeb)
+
+    def test_fast_pages_grow_up_to_maximum(self):
+        page_size = csw_processor.AdaptivePageSize(10, minimum=5, maximum=30)
+        page_size.page_done(1, 10, 0.5, 10000)
+        self.assertEqual(20, page_size.size)
+        page_size.page_done(11, 20, 0.5, 20000)
+        self.assertEqual(30, page_size.size)
+
+    def test_slow_pages_shrink_by_at_most_half(self):
+        page_size = csw_processor.AdaptivePageSize(40, minimum=5, maximum=100)
+        page_size.page_done(1, 40, 4 * csw_processor.TARGET_PAGE_SECONDS, 10000)
+        self.assertEqual(20, page_size.size)
+        page_size.page_done(41, 20, 1.25 * csw_processor.TARGET_PAGE_SECONDS, 5000)
+        self.assertEqual(16, page_size.size)
+
+    def test_large_pages_shrink_to_byte_limit(self):
+        page_size = csw_processor.AdaptivePageSize(100, minimum=5, maximum=1000)
+        page_size.page_done(1, 100, 0.1, int(1.6 * csw_processor.MAX_PAGE_BYTES))
+        self.assertEqual(62, page_size.size)
+
+    def test_size_without_bounds_is_fixed(self):
+        page_size = csw_processor.AdaptivePageSize(50)
+        page_size.page_done(1, 50, 0.1, 1000)
+        self.assertEqual(50, page_size.size)
+        self.assertFalse(page_size.shrink())
+
+    def test_shrink_stops_at_minimum(self):
+        page_size = csw_processor.AdaptivePageSize(20, minimum=8, maximum=20)
+        self.assertTrue(page_size.shrink())
+        self.assertEqual(10, page_size.size)
+        self.assertTrue(page_size.shrink())
+        self.assertEqual(8, page_size.size)
+        self.assertFalse(page_size.shrink())
+
+    def test_pages_are_requested_with_adapted_size(self):
+        for mode in self.modes:
+            with self.subTest(**mode):
+                catalogue = _Catalogue([f"id-{i}" for i in range(1, 16)])
+                with requests_mock.Mocker() as m:
+                    m.get(MOCK_URL, text=catalogue)
+                    geocat_ids = [
+                        gid
+                        for gid, _ in self.csw_data.get_records_dcat(
+                            maxrecords=csw_processor.AdaptivePageSize(
+                                2, minimum=1, maximum=6
+                            ),
+                            **mode,
+                        )
+                    ]
+
+                self.assertEqual(catalogue.geocat_ids, geocat_ids)
+                self.assertEqual([1, 3, 7, 13], catalogue.starts)
+                self.assertEqual([2, 4, 6, 6], catalogue.maxrecords)
+
+    def test_timed_out_page_is_retried_smaller(self):
+        for mode in self.modes:
+            with self.subTest(**mode):
+                catalogue = _Catalogue([f"id-{i}" for i in range(1, 6)])
+
+                def _time_out_large_pages(request, context):
+                    if int(request.qs["maxrecords"][0]) > 2:
+                        catalogue.maxrecords.append(request.qs["maxrecords"][0])
+                        raise requests.exceptions.ReadTimeout()
+                    return catalogue(request, context)
+
+                with requests_mock.Mocker() as m:
+                    m.get(MOCK_URL, text=_time_out_large_pages)
+                    with self.assertLogs(csw_processor.log, "WARNING"):
+                        geocat_ids = [
+                            gid
+                            for gid, _ in self.csw_data.get_records_dcat(
+                                maxrecords=csw_processor.AdaptivePageSize(
+                                    8, minimum=2, maximum=8
+                                ),
+                                **mode,
+                            )
+                        ]
+
+                self.assertEqual(catalogue.geocat_ids, geocat_ids)
+                self.assertEqual(["8", "4", 2, 2, 2], catalogue.maxrecords)
+
+    def test_timeout_at_minimum_size_is_raised(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, exc=requests.exceptions.ReadTimeout)
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                list(
+                    self.csw_data.get_records_dcat(
+                        maxrecords=csw_processor.AdaptivePageSize(
+                            4, minimum=2, maximum=8
+                        )
+                    )
+                )
+            self.assertEqual(2, m.call_count)
+
+
+class TestGetRecordsById(unittest.TestCase):
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatCatalogueServiceWeb)
+        self.geocat_ids = [f"id-{i}" for i in range(6)]
+
+    def test_get_records_by_id_sequential(self):
+        self.csw_data.get_record_by_id = lambda geocat_id: f"<{geocat_id}/>"
+        self.assertEqual(
+            [(geocat_id, f"<{geocat_id}/>", None) for geocat_id in self.geocat_ids],
+            list(self.csw_data.get_records_by_id(self.geocat_ids)),
+        )
+
+    def test_get_records_by_id_fetches_concurrently_in_order(self):
+        # Every fetch waits until three fetches are running at the same time:
+        # this only finishes if the records are fetched three at a time.
+        barrier = threading.Barrier(3, timeout=5)
+
+        def _get_record_by_id(geocat_id):
+            barrier.wait()
+            return f"<{geocat_id}/>"
+
+        self.csw_data.get_record_by_id = _get_record_by_id
+        self.assertEqual(
+            [(geocat_id, f"<{geocat_id}/>", None) for geocat_id in self.geocat_ids],
+            list(self.csw_data.get_records_by_id(self.geocat_ids, fetch_concurrency=3)),
+        )
+
+    def test_get_records_by_id_reports_errors_per_record(self):
+        error = csw_processor.CswNotFoundError("no record")
+
+        def _get_record_by_id(geocat_id):
+            if geocat_id == "id-2":
+                raise error
+            return f"<{geocat_id}/>"
+
+        self.csw_data.get_record_by_id = _get_record_by_id
+        geocat_records = list(
+            self.csw_data.get_records_by_id(self.geocat_ids, fetch_concurrency=4)
+        )
+        self.assertEqual(self.geocat_ids, [gid for gid, _, _ in geocat_records])
+        self.assertEqual(("id-2", None, error), geocat_records[2])
+        self.assertEqual(
+            [None] * 5, [e for gid, _, e in geocat_records if gid != "id-2"]
+        )
+
+    def test_threads_use_their_own_csw_copy(self):
+        self.csw_data._csw = mock.Mock()
+        main_csw = self.csw_data._get_thread_csw()
+        self.assertIs(main_csw, self.csw_data._get_thread_csw())
+
+        thread_csws = []
+        thread = threading.Thread(
+            target=lambda: thread_csws.append(self.csw_data._get_thread_csw())
+        )
+        thread.start()
+        thread.join()
+        self.assertIsNot(main_csw, thread_csws[0])
+
+    def test_clients_share_the_limiter_of_their_host(self):
+        host_limiters = http_utils.HostConcurrencyLimiters()
+        che_client = csw_processor.GeocatCatalogueServiceWeb(
+            MOCK_URL, host_limiters=host_limiters
+        )
+        dcat_client = csw_processor.GeocatDcatCatalogueServiceWeb(
+            MOCK_RECORD_URL, host_limiters=host_limiters
+        )
+        self.assertIs(che_client.limiter, dcat_client.limiter)
+
+    def test_throttled_get_record_by_id_halves_limit(self):
+        csw_data = csw_processor.GeocatCatalogueServiceWeb(
+            MOCK_URL,
+            host_limiters=http_utils.HostConcurrencyLimiters(initial=4),
+        )
+        resp = requests.Response()
+        resp.status_code = 503
+        csw_data._csw = mock.Mock()
+        csw_data._csw.getrecordbyid.side_effect = requests.HTTPError(response=resp)
+        with self.assertRaises(requests.HTTPError):
+            csw_data.get_record_by_id(GEOCAT_ID_1)
+
+        self.assertEqual(2, csw_data.limiter.limit)
+        self.assertEqual(0, csw_data.limiter.in_flight)
+
+
+class TestGetRecordsDcat(unittest.TestCase):
+    def setUp(self):
+        self.csw_data = _make_client(csw_processor.GeocatDcatCatalogueServiceWeb)
+
+    def test_get_records_dcat_yields_dataset_elements(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("response_getrecords_dcat_batch.xml"))
+            geocat_records = list(self.csw_data.get_records_dcat())
+            self.assertEqual(
+                [csw_processor.DCAT_AP_CH_SCHEMA], m.last_request.qs["outputschema"]
+            )
+
+        self.assertEqual(2, len(geocat_records))
+        self.assertEqual(GEOCAT_ID_1, geocat_records[0][0])
+        self.assertEqual(dcat_mapping.DCAT_DATASET_TAG, geocat_records[0][1].tag)
+
+    def test_get_records_dcat_maps_like_get_record_by_id(self):
+        with requests_mock.Mocker() as m:
+            m.get(MOCK_URL, text=_load_xml("response_getrecords_dcat_batch.xml"))
+            geocat_records = list(self.csw_data.get_records_dcat())
+
+        dcat_map = _make_dcat_map()
+        for (geocat_id, dataset_element), filename in zip(
+            geocat_records, ["result_1_dcat.xml", "result_2_dcat.xml"]
+        ):
+            self.assertEqual(
+                dcat_map.get_metadata(_load_xml(filename), geocat_id),
+                dcat_map.get_metadata_from_element(dataset_element, geocat_id),
+            )
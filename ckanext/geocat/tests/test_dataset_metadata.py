@@ -5,7 +5,10 @@ import os
 import unittest
 from pprint import pprint
 
+from lxml import etree
+
 from ckanext.geocat.utils import csw_mapping, dcat_mapping
+from ckanext.geocat.utils.mapping_utils import MetadataFormatError
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
@@ -281,6 +284,27 @@ class TestDcatDatasetWithLegalBasis(unittest.TestCase):
         self.assertIn("https://example.ch/legal", urls)
 
 
+class TestDcatDatasetFromElement(unittest.TestCase):
+    """Test that an already parsed dcat:Dataset maps like the XML string."""
+
+    def setUp(self):
+        self.mapper = _make_mapper()
+        self.xml = _load_xml("geocat-dcat-testdata.xml")
+
+    def test_element_maps_like_string(self):
+        root = etree.fromstring(self.xml.encode("utf-8"))
+        node = root.find(dcat_mapping.DCAT_DATASET_TAG)
+        self.assertEqual(
+            self.mapper.get_metadata(self.xml, GEOCAT_ID),
+            self.mapper.get_metadata_from_element(node, GEOCAT_ID),
+        )
+
+    def test_element_must_be_dataset(self):
+        root = etree.fromstring(self.xml.encode("utf-8"))
+        with self.assertRaises(MetadataFormatError):
+            self.mapper.get_metadata_from_element(root, GEOCAT_ID)
+
+
 class TestDcatDatasetWithPeriodOfTime(unittest.TestCase):
     """Test that dct:temporal/dct:PeriodOfTime is mapped correctly."""
 
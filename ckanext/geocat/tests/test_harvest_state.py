@@ -0,0 +1,244 @@
+"""Tests for the persisted gather state and checkpoints in harvest_state."""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from ckanext.geocat.utils import harvest_state
+
+NOW = datetime(2024, 3, 10, 2, 0, tzinfo=timezone.utc)
+FULL_HARVEST_INTERVAL = timedelta(days=7)
+
+
+class TestGetModifiedSince(unittest.TestCase):
+    def _state(self, last_gather, last_full_gather):
+        return {
+            "last_gather": last_gather.isoformat(),
+            "last_full_gather": last_full_gather.isoformat(),
+        }
+
+    def test_first_gather_is_full(self):
+        self.assertIsNone(
+            harvest_state.get_modified_since({}, FULL_HARVEST_INTERVAL, now=NOW)
+        )
+
+    def test_incremental_gather_starts_before_last_gather(self):
+        last_gather = NOW - timedelta(days=1)
+        state = self._state(last_gather, NOW - timedelta(days=3))
+        self.assertEqual(
+            last_gather - harvest_state.MODIFIED_SINCE_OVERLAP,
+            harvest_state.get_modified_since(state, FULL_HARVEST_INTERVAL, now=NOW),
+        )
+
+    def test_full_gather_is_forced_after_interval(self):
+        state = self._state(NOW - timedelta(days=1), NOW - FULL_HARVEST_INTERVAL)
+        self.assertIsNone(
+            harvest_state.get_modified_since(state, FULL_HARVEST_INTERVAL, now=NOW)
+        )
+
+    def test_invalid_timestamp_forces_full_gather(self):
+        state = {"last_gather": "yesterday", "last_full_gather": NOW.isoformat()}
+        self.assertIsNone(
+            harvest_state.get_modified_since(state, FULL_HARVEST_INTERVAL, now=NOW)
+        )
+
+
+class TestRecordGather(unittest.TestCase):
+    def test_full_gather_sets_both_timestamps(self):
+        self.assertEqual(
+            {"last_gather": NOW.isoformat(), "last_full_gather": NOW.isoformat()},
+            harvest_state.record_gather({}, NOW, full=True),
+        )
+
+    def test_incremental_gather_keeps_last_full_gather(self):
+        last_full_gather = (NOW - timedelta(days=2)).isoformat()
+        state = harvest_state.record_gather(
+            {"last_gather": last_full_gather, "last_full_gather": last_full_gather},
+            NOW,
+            full=False,
+        )
+        self.assertEqual(
+            {"last_gather": NOW.isoformat(), "last_full_gather": last_full_gather},
+            state,
+        )
+        self.assertEqual(
+            NOW - harvest_state.MODIFIED_SINCE_OVERLAP,
+            harvest_state.get_modified_since(state, FULL_HARVEST_INTERVAL, now=NOW),
+        )
+
+    def test_gather_duration_is_recorded(self):
+        state = harvest_state.record_gather_duration({"last_gather": "x"}, 12.345)
+        self.assertEqual({"last_gather": "x", "last_gather_seconds": 12.3}, state)
+        self.assertEqual(12.3, harvest_state.get_last_gather_seconds(state))
+        self.assertIsNone(harvest_state.get_last_gather_seconds({}))
+
+
+class _SystemInfo(object):
+    """The get/set/delete_system_info functions of ckan.model, in a dict."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get_system_info(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set_system_info(self, key, value):
+        self.values[key] = value
+
+    def delete_system_info(self, key, default=None):
+        self.values.pop(key, None)
+
+
+class TestGatherCheckpoint(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(harvest_state, "model", _SystemInfo())
+        self.system_info = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _checkpoint(self, query="query", gather_started=NOW):
+        return harvest_state.GatherCheckpoint("source-id", query, gather_started)
+
+    def _gather_two_pages(self):
+        checkpoint = self._checkpoint()
+        for geocat_id in ["id-1", "id-2"]:
+            checkpoint.seen_ids.add(geocat_id)
+        checkpoint.page_done(2)
+        checkpoint.seen_ids.add("id-2")
+        checkpoint.seen_ids.add("id-3")
+        checkpoint.page_done(4)
+        return checkpoint
+
+    def test_new_checkpoint_starts_at_first_record(self):
+        checkpoint = self._checkpoint()
+        self.assertFalse(checkpoint.resumed)
+        self.assertEqual(1, checkpoint.next_record)
+        self.assertEqual(set(), checkpoint.seen_ids)
+        self.assertEqual(NOW, checkpoint.gather_started)
+
+    def test_next_gather_resumes_after_last_page(self):
+        self._gather_two_pages()
+
+        checkpoint = self._checkpoint(gather_started=NOW + timedelta(hours=1))
+        self.assertTrue(checkpoint.resumed)
+        self.assertEqual(4, checkpoint.next_record)
+        self.assertEqual({"id-1", "id-2", "id-3"}, checkpoint.seen_ids)
+        self.assertEqual(NOW, checkpoint.gather_started)
+
+    def test_each_page_only_saves_its_new_ids(self):
+        checkpoint = self._gather_two_pages()
+        self.assertEqual(
+            '["id-1", "id-2"]', self.system_info.values[checkpoint.key + ".0"]
+        )
+        self.assertEqual('["id-3"]', self.system_info.values[checkpoint.key + ".1"])
+
+    def test_checkpoint_of_other_query_is_ignored(self):
+        self._gather_two_pages()
+        self.assertFalse(self._checkpoint(query="other query").resumed)
+
+    def test_old_checkpoint_is_ignored(self):
+        self._gather_two_pages()
+        self.assertFalse(
+            self._checkpoint(
+                gather_started=datetime.now(timezone.utc)
+                + harvest_state.CHECKPOINT_MAX_AGE
+            ).resumed
+        )
+
+    def test_cleared_checkpoint_is_not_resumed(self):
+        self._gather_two_pages().clear()
+        self.assertEqual({}, self.system_info.values)
+        self.assertFalse(self._checkpoint().resumed)
+
+    def test_ignored_checkpoint_is_deleted(self):
+        self._gather_two_pages()
+        checkpoint = self._checkpoint(query="other query")
+        self.assertEqual(set(), checkpoint.seen_ids)
+        self.assertEqual({}, self.system_info.values)
+
+
+class TestRefreshDatasetIndex(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        self.datasets = {
+            "id-1": ["name-1", True, "package-1"],
+            "id-2": ["name-2", False, "package-2"],
+        }
+        self.modified = {}
+        self.listed_since = []
+
+    def _list_datasets(self, modified_since):
+        self.listed_since.append(modified_since)
+        if modified_since is None:
+            return iter(self.datasets.items())
+        return iter(self.modified.items())
+
+    def _list_package_ids(self):
+        return (info[2] for info in self.datasets.values())
+
+    def _refresh(self, scope="solr:org", now=NOW):
+        return harvest_state.refresh_dataset_index(
+            "source-id",
+            scope,
+            self._list_datasets,
+            self._list_package_ids,
+            now=now,
+            cache_dir=self.cache_dir,
+        )
+
+    def test_first_index_is_built_in_full(self):
+        self.assertEqual(self.datasets, self._refresh())
+        self.assertEqual([None], self.listed_since)
+        self.assertEqual(["source-id.json"], os.listdir(self.cache_dir))
+
+    def test_index_is_refreshed_with_modified_datasets(self):
+        self._refresh()
+        self.datasets["id-3"] = self.modified["id-3"] = ["name-3", True, "package-3"]
+        self.datasets["id-1"] = self.modified["id-1"] = ["renamed-1", True, "package-1"]
+        later = NOW + timedelta(days=1)
+
+        self.assertEqual(self.datasets, self._refresh(now=later))
+        self.assertEqual(
+            [None, NOW - harvest_state.DATASET_INDEX_OVERLAP], self.listed_since
+        )
+        # the next refresh starts from the refreshed index
+        self._refresh(now=later + timedelta(days=1))
+        self.assertEqual(
+            later - harvest_state.DATASET_INDEX_OVERLAP, self.listed_since[-1]
+        )
+
+    def test_deleted_dataset_is_dropped(self):
+        self._refresh()
+        del self.datasets["id-2"]
+        # the number of datasets stays the same
+        self.datasets["id-3"] = self.modified["id-3"] = ["name-3", True, "package-3"]
+
+        self.assertEqual(self.datasets, self._refresh(now=NOW + timedelta(days=1)))
+        self.assertIsNotNone(self.listed_since[-1])
+
+    def test_changed_identifier_is_replaced(self):
+        self._refresh()
+        self.datasets["id-1-new"] = self.modified["id-1-new"] = self.datasets.pop(
+            "id-1"
+        )
+
+        self.assertEqual(self.datasets, self._refresh(now=NOW + timedelta(days=1)))
+        self.assertIsNotNone(self.listed_since[-1])
+
+    def test_index_of_other_scope_or_too_old_is_rebuilt(self):
+        self._refresh()
+        self._refresh(scope="database:org")
+        self._refresh(
+            scope="database:org", now=NOW + harvest_state.DATASET_INDEX_MAX_AGE
+        )
+        self.assertEqual([None, None, None], self.listed_since)
+
+    def test_invalid_index_is_rebuilt(self):
+        with open(os.path.join(self.cache_dir, "source-id.json"), "w") as f:
+            f.write("{")
+
+        self.assertEqual(self.datasets, self._refresh())
+        self.assertEqual([None], self.listed_since)
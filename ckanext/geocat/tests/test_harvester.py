@@ -1,15 +1,22 @@
 import logging
 import os
+import re
 
 import ckan.plugins.toolkit as tk
 import pytest
+from ckan import model
+from ckan.lib import search
 
-from ckanext.geocat.harvester import GeocatHarvester
+from ckanext.geocat.harvester import GeocatHarvester, GeocatHarvesterBase
+from ckanext.geocat.utils import harvest_state, search_utils
+from ckanext.harvest.model import HarvestJob, HarvestObject
 from ckanext.harvest.tests.lib import run_harvest
 
 log = logging.getLogger(__name__)
 
 # result_1.xml / result_2.xml: CHE/ISO19139.che GetRecordById payloads (opendata-swiss).
+# response_getrecords_che_*.xml is assembled from those; after edits run:
+#   python3 bin/regen_dcat_harvest_fixtures.py
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
 MOCK_URL = "http://mock-geocat.ch"
@@ -17,14 +24,6 @@ mock_record_url = "http://mock-geocat.ch/geonetwork/srv/eng/csw-BAKOM"
 
 
 def _mock_csw_results(all_results_filename, single_results_filenames, mocker):
-    path = os.path.join(
-        __location__, "fixtures", "test_harvesters", all_results_filename
-    )
-    with open(path) as xml:
-        all_results = xml.read()
-
-    mocker.post(mock_record_url, text=all_results)
-
     responses = []
     for filename in single_results_filenames:
         path = os.path.join(__location__, "fixtures", "test_harvesters", filename)
@@ -34,6 +33,30 @@ def _mock_csw_results(all_results_filename, single_results_filenames, mocker):
         responses.append({"text": result})
 
     mocker.get(mock_record_url, responses)
+    # registered last, so the GetRecords listing takes precedence
+    _mock_getrecords(mocker, all_results_filename, "ELEMENTSETNAME=BRIEF")
+
+
+def _mock_getrecords(mocker, xml_filename, marker="GETRECORDS"):
+    path = os.path.join(__location__, "fixtures", "test_harvesters", xml_filename)
+    with open(path) as xml:
+        body = xml.read()
+
+    def _is_getrecords(request):
+        url = request.url.upper()
+        return "GETRECORDS" in url and marker in url
+
+    mocker.get(
+        re.compile(r"^http://mock-geocat\.ch"),
+        text=body,
+        additional_matcher=_is_getrecords,
+    )
+
+
+def _mock_getrecords_che(mocker, xml_filename, listing_xml_filename):
+    """Mock the brief listing of all identifiers and the full CHE records."""
+    _mock_getrecords(mocker, xml_filename, "ELEMENTSETNAME=FULL")
+    _mock_getrecords(mocker, listing_xml_filename, "ELEMENTSETNAME=BRIEF")
 
 
 def _test_harvest_create(
@@ -44,7 +67,21 @@ def _test_harvest_create(
     harvest_source,
 ):
     _mock_csw_results(all_results_filename, single_results_filenames, mocker)
+    return _run_harvest_and_check(expected_packages, harvest_source)
+
+
+def _test_harvest_create_batch(
+    batch_xml_filename,
+    listing_xml_filename,
+    expected_packages,
+    mocker,
+    harvest_source,
+):
+    _mock_getrecords_che(mocker, batch_xml_filename, listing_xml_filename)
+    return _run_harvest_and_check(expected_packages, harvest_source)
 
+
+def _run_harvest_and_check(expected_packages, harvest_source):
     results_by_guid = run_harvest(MOCK_URL, GeocatHarvester())
 
     for harvest_object_result in results_by_guid.values():
@@ -66,6 +103,142 @@ def _test_harvest_create(
 @pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index", "clean_queues")
 class TestGeocatHarvestFunctional:
     def test_harvest_create_simple(self, ogdch_requests_mock, harvest_source):
+        _test_harvest_create_batch(
+            "response_getrecords_che_batch.xml",
+            "response_all_results.xml",
+            expected_packages=2,
+            mocker=ogdch_requests_mock,
+            harvest_source=harvest_source,
+        )
+
+    def test_harvest_deleted_dataset(self, ogdch_requests_mock, harvest_source):
+        _test_harvest_create_batch(
+            "response_getrecords_che_batch.xml",
+            "response_all_results.xml",
+            expected_packages=2,
+            mocker=ogdch_requests_mock,
+            harvest_source=harvest_source,
+        )
+
+        results = _test_harvest_create_batch(
+            "response_getrecords_che_one.xml",
+            "response_just_one_result.xml",
+            expected_packages=1,
+            mocker=ogdch_requests_mock,
+            harvest_source=harvest_source,
+        )
+        assert (
+            results["results"][0]["name"]
+            == "larmbelastung-durch-eisenbahnverkehr-nacht"
+        )
+
+    def test_harvest_update_uses_package_found_by_gather(
+        self, ogdch_requests_mock, harvest_source
+    ):
+        results = _test_harvest_create_batch(
+            "response_getrecords_che_batch.xml",
+            "response_all_results.xml",
+            expected_packages=2,
+            mocker=ogdch_requests_mock,
+            harvest_source=harvest_source,
+        )
+        package_ids = {pkg["identifier"]: pkg["id"] for pkg in results["results"]}
+
+        _test_harvest_create_batch(
+            "response_getrecords_che_batch.xml",
+            "response_all_results.xml",
+            expected_packages=2,
+            mocker=ogdch_requests_mock,
+            harvest_source=harvest_source,
+        )
+        harvest_objects = (
+            model.Session.query(HarvestObject)
+            .filter(HarvestObject.current == True)  # noqa: E712
+            .all()
+        )
+        assert len(harvest_objects) == 2
+        for harvest_object in harvest_objects:
+            assert harvest_object.package_id == package_ids[harvest_object.guid]
+            assert (
+                harvest_object.package_id
+                == search_utils.get_value_from_object_extra(
+                    harvest_object.extras, search_utils.PACKAGE_ID_EXTRA
+                )
+            )
+
+    def test_dataset_index_backends_agree(self, ogdch_requests_mock, harvest_source):
+        results = _test_harvest_create_batch(
+            "response_getrecords_che_batch.xml",
+            "response_all_results.xml",
+            expected_packages=2,
+            mocker=ogdch_requests_mock,
+            harvest_source=harvest_source,
+        )
+        # detach one dataset from the harvest source in the database and index
+        detached_package_id = results["results"][0]["id"]
+        model.Session.query(HarvestObject).filter(
+            HarvestObject.package_id == detached_package_id
+        ).update({"current": False})
+        model.Session.commit()
+        search.rebuild(detached_package_id)
+
+        organization_name = tk.get_action("organization_show")(
+            {}, {"id": harvest_source["owner_org"]}
+        )["name"]
+        solr_infos = search_utils.get_dataset_infos_for_organization(
+            organization_name,
+            harvest_source["id"],
+            search_utils.DATASET_INDEX_SOLR,
+        )
+        database_infos = search_utils.get_dataset_infos_for_organization(
+            organization_name,
+            harvest_source["id"],
+            search_utils.DATASET_INDEX_DATABASE,
+        )
+        assert database_infos == solr_infos
+        assert set(
+            search_utils.iter_package_ids_for_organization(
+                organization_name, search_utils.DATASET_INDEX_DATABASE
+            )
+        ) == set(
+            search_utils.iter_package_ids_for_organization(
+                organization_name, search_utils.DATASET_INDEX_SOLR
+            )
+        )
+        assert {
+            info.package_id: info.belongs_to_harvester for info in solr_infos.values()
+        } == {pkg["id"]: pkg["id"] != detached_package_id for pkg in results["results"]}
+
+    def test_gather_sources(self, ogdch_requests_mock, harvest_source):
+        _mock_getrecords_che(
+            ogdch_requests_mock,
+            "response_getrecords_che_batch.xml",
+            "response_all_results.xml",
+        )
+        harvest_job = tk.get_action("harvest_job_create")(
+            {"ignore_auth": True}, {"source_id": harvest_source["id"], "run": True}
+        )
+
+        harvest_obj_ids = GeocatHarvesterBase.gather_sources(
+            [HarvestJob.get(harvest_job["id"])]
+        )
+
+        assert list(harvest_obj_ids) == [harvest_job["id"]]
+        assert len(harvest_obj_ids[harvest_job["id"]]) == 2
+        job = HarvestJob.get(harvest_job["id"])
+        assert job.status == "Running"
+        assert job.gather_started is not None
+        assert job.gather_finished is not None
+        state = harvest_state.load_harvest_state(harvest_source["id"])
+        assert harvest_state.get_last_gather_seconds(state) is not None
+
+        # a job that is already running is not gathered again
+        harvest_obj_ids = GeocatHarvesterBase.gather_sources([job])
+        assert harvest_obj_ids == {harvest_job["id"]: []}
+
+    def test_harvest_create_per_record(
+        self, ogdch_requests_mock, harvest_source_per_record
+    ):
         _test_harvest_create(
             "response_all_results.xml",
             [
@@ -74,10 +247,12 @@ class TestGeocatHarvestFunctional:
             ],
             expected_packages=2,
             mocker=ogdch_requests_mock,
-            harvest_source=harvest_source,
+            harvest_source=harvest_source_per_record,
         )
 
-    def test_harvest_deleted_dataset(self, ogdch_requests_mock, harvest_source):
+    def test_harvest_deleted_dataset_per_record(
+        self, ogdch_requests_mock, harvest_source_per_record
+    ):
         # Import two datasets
         _test_harvest_create(
             "response_all_results.xml",
@@ -87,7 +262,7 @@ class TestGeocatHarvestFunctional:
             ],
             expected_packages=2,
             mocker=ogdch_requests_mock,
-            harvest_source=harvest_source,
+            harvest_source=harvest_source_per_record,
         )
 
         # Import again, this time with only one dataset
@@ -96,7 +271,7 @@ class TestGeocatHarvestFunctional:
             ["result_1.xml"],
             expected_packages=1,
             mocker=ogdch_requests_mock,
-            harvest_source=harvest_source,
+            harvest_source=harvest_source_per_record,
         )
         assert (
             results["results"][0]["name"]
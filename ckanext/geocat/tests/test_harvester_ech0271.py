@@ -18,21 +18,54 @@ __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file
 MOCK_URL = "http://mock-geocat.ch"
 
 
+# brief listing of the identifiers of each DCAT GetRecords response
+LISTING_XML_FILENAMES = {
+    "response_getrecords_dcat_batch.xml": "response_all_results.xml",
+    "response_getrecords_dcat_one.xml": "response_just_one_result.xml",
+}
+
+
 def _mock_getrecords_dcat(mocker, xml_filename):
-    path = os.path.join(__location__, "fixtures", "test_harvesters", xml_filename)
-    with open(path) as xml:
-        body = xml.read()
+    """Mock the GetRecords requests of a full gather: the brief listing of
+    all identifiers, and the DCAT records."""
+    _mock_getrecords(
+        mocker,
+        [
+            (xml_filename, "ELEMENTSETNAME=FULL"),
+            (LISTING_XML_FILENAMES[xml_filename], "ELEMENTSETNAME=BRIEF"),
+        ],
+    )
 
-    def _is_getrecords(request):
-        return "GETRECORDS" in request.url.upper()
 
-    mocker.get(
-        re.compile(r"^http://mock-geocat\.ch"),
-        text=body,
-        additional_matcher=_is_getrecords,
+def _mock_getrecords_incremental(mocker, changed_xml_filename, listing_xml_filename):
+    """Mock the GetRecords requests of an incremental gather: the changed
+    DCAT records, and the brief listing of all identifiers."""
+    _mock_getrecords(
+        mocker,
+        [
+            (changed_xml_filename, "MODIFIED"),
+            (listing_xml_filename, "ELEMENTSETNAME=BRIEF"),
+        ],
     )
 
 
+def _mock_getrecords(mocker, xml_filenames_by_marker):
+    for xml_filename, marker in xml_filenames_by_marker:
+        path = os.path.join(__location__, "fixtures", "test_harvesters", xml_filename)
+        with open(path) as xml:
+            body = xml.read()
+
+        def _matches(request, marker=marker):
+            url = request.url.upper()
+            return "GETRECORDS" in url and marker in url
+
+        mocker.get(
+            re.compile(r"^http://mock-geocat\.ch"),
+            text=body,
+            additional_matcher=_matches,
+        )
+
+
 def _test_harvest_create_ech0271(
     batch_xml_filename,
     expected_packages,
@@ -40,7 +73,10 @@ def _test_harvest_create_ech0271(
     harvest_source_ech0271,
 ):
     _mock_getrecords_dcat(mocker, batch_xml_filename)
+    return _run_harvest_and_check(expected_packages, harvest_source_ech0271)
+
 
+def _run_harvest_and_check(expected_packages, harvest_source_ech0271):
     results_by_guid = run_harvest(MOCK_URL, GeocatEch0271Harvester())
 
     for harvest_object_result in results_by_guid.values():
@@ -51,7 +87,7 @@ def _test_harvest_create_ech0271(
     results = tk.get_action("package_search")({}, {"fq": fq})
     assert results["count"] == expected_packages
 
-    return results
+    return results, results_by_guid
 
 
 @pytest.mark.ckan_config(
@@ -77,7 +113,7 @@ class TestGeocatEch0271HarvestFunctional:
             harvest_source_ech0271=harvest_source_ech0271,
         )
 
-        results = _test_harvest_create_ech0271(
+        results, _ = _test_harvest_create_ech0271(
             "response_getrecords_dcat_one.xml",
             expected_packages=1,
             mocker=ogdch_requests_mock,
@@ -87,3 +123,34 @@ class TestGeocatEch0271HarvestFunctional:
             results["results"][0]["name"]
             == "larmbelastung-durch-eisenbahnverkehr-nacht"
         )
+
+    def test_harvest_incremental(
+        self, ogdch_requests_mock, harvest_source_ech0271_incremental
+    ):
+        # The first gather of a source is a full one
+        _test_harvest_create_ech0271(
+            "response_getrecords_dcat_batch.xml",
+            expected_packages=2,
+            mocker=ogdch_requests_mock,
+            harvest_source_ech0271=harvest_source_ech0271_incremental,
+        )
+
+        # Only the changed record is mapped; the brief listing shows that the
+        # other one was removed from the source
+        _mock_getrecords_incremental(
+            ogdch_requests_mock,
+            "response_getrecords_dcat_one.xml",
+            "response_just_one_result.xml",
+        )
+        results, _ = _run_harvest_and_check(
+            expected_packages=1,
+            harvest_source_ech0271=harvest_source_ech0271_incremental,
+        )
+        assert any(
+            "MODIFIED" in request.url.upper()
+            for request in ogdch_requests_mock.request_history
+        )
+        assert (
+            results["results"][0]["name"]
+            == "larmbelastung-durch-eisenbahnverkehr-nacht"
+        )
@@ -0,0 +1,419 @@
+"""Tests for the pooled HTTP session and the concurrency limiter in
+http_utils, against a local server."""
+
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from ckanext.geocat.utils import http_utils
+
+
+class _ScriptedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.paths.append(self.path)
+            status, headers = server.responses.pop(0) if server.responses else (200, {})
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        body = b"<ok/>"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """Runs a local HTTP/1.1 keep-alive server that answers GET requests with
+    the (status, headers) tuples in ``self.server.responses``, then 200, after
+    ``self.server.delay`` seconds. Counts the requests in flight."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _ScriptedHandler)
+        self.server.lock = threading.Lock()
+        self.server.paths = []
+        self.server.responses = []
+        self.server.delay = 0
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/csw"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestPooledSession(LocalServerTestCase):
+    def test_session_reuses_kept_alive_connection(self):
+        session = http_utils.build_session()
+        for _ in range(3):
+            session.get(self.url, timeout=5).raise_for_status()
+
+        self.assertEqual(
+            http_utils.ConnectionStats(
+                requests=3, new_connections=1, reused_connections=2
+            ),
+            http_utils.get_connection_stats(session),
+        )
+
+    def test_session_retries_on_retry_after(self):
+        self.server.responses = [(503, {"Retry-After": "0"}), (429, {})]
+        session = http_utils.build_session(backoff_factor=0)
+        resp = session.get(self.url, timeout=5)
+
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(3, len(self.server.paths))
+        self.assertEqual(3, http_utils.get_connection_stats(session).requests)
+
+    def test_session_returns_last_response_when_retries_are_exhausted(self):
+        self.server.responses = [(503, {"Retry-After": "0"})] * (
+            http_utils.MAX_RETRIES + 1
+        )
+        session = http_utils.build_session(backoff_factor=0)
+        resp = session.get(self.url, timeout=5)
+
+        self.assertEqual(503, resp.status_code)
+        self.assertEqual(http_utils.MAX_RETRIES + 1, len(self.server.paths))
+
+    def test_retry_after_is_capped(self):
+        class _Response:
+            headers = {"Retry-After": "3600"}
+
+        retry = http_utils._CappedRetry()
+        self.assertEqual(http_utils.MAX_RETRY_AFTER, retry.get_retry_after(_Response()))
+
+    def test_retried_read_timeout_is_a_timeout(self):
+        self.server.delay = 0.5
+        session = http_utils.build_session(backoff_factor=0)
+        with self.assertRaises(requests.ConnectionError) as cm:
+            session.get(self.url, timeout=0.1)
+
+        self.assertTrue(http_utils.is_timeout(cm.exception))
+        self.assertEqual(http_utils.MAX_RETRIES + 1, len(self.server.paths))
+
+    def test_refused_connection_is_not_a_timeout(self):
+        self.tearDown()
+        session = http_utils.build_session(backoff_factor=0)
+        with self.assertRaises(requests.ConnectionError) as cm:
+            session.get(self.url, timeout=1)
+
+        self.assertFalse(http_utils.is_timeout(cm.exception))
+
+
+class TestAdaptiveConcurrencyLimiter(LocalServerTestCase):
+    def _session(self, **limiter_kwargs):
+        self.host_limiters = http_utils.HostConcurrencyLimiters(**limiter_kwargs)
+        return http_utils.build_session(
+            backoff_factor=0, host_limiters=self.host_limiters
+        )
+
+    def test_healthy_responses_raise_limit_additively(self):
+        session = self._session(initial=2)
+        for _ in range(3):
+            session.get(self.url, timeout=5).raise_for_status()
+
+        limiter = self.host_limiters.get(self.url)
+        self.assertAlmostEqual(2 + 1 / 2 + 1 / 2.5 + 1 / 2.9, limiter.limit)
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_every_throttled_attempt_halves_limit(self):
+        self.server.responses = [(503, {"Retry-After": "0"}), (429, {})]
+        session = self._session(initial=8)
+        resp = session.get(self.url, timeout=5)
+
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(2 + 1 / 2, self.host_limiters.get(self.url).limit)
+
+    def test_timeout_halves_limit(self):
+        self.server.delay = 0.5
+        session = self._session(initial=16)
+        with self.assertRaises(requests.ConnectionError):
+            session.get(self.url, timeout=0.1)
+
+        # one halving per attempt
+        self.assertEqual(
+            16 / 2 ** (http_utils.MAX_RETRIES + 1),
+            self.host_limiters.get(self.url).limit,
+        )
+
+    def test_retry_after_does_not_hold_a_slot(self):
+        self.server.responses = [(503, {"Retry-After": "1"})]
+        session = self._session(initial=1, maximum=1)
+        finished = []
+
+        def _get(name):
+            session.get(self.url, timeout=5).raise_for_status()
+            finished.append(name)
+
+        throttled = threading.Thread(target=_get, args=("throttled",))
+        throttled.start()
+        time.sleep(0.3)
+        _get("other")
+        throttled.join()
+
+        self.assertEqual(["other", "throttled"], finished)
+
+    def test_streamed_response_holds_slot_until_closed(self):
+        session = self._session()
+        limiter = self.host_limiters.get(self.url)
+        resp = session.get(self.url, timeout=5, stream=True)
+        self.assertEqual(1, limiter.in_flight)
+
+        resp.close()
+        self.assertEqual(0, limiter.in_flight)
+        resp.close()
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_streamed_response_releases_slot_once_read(self):
+        session = self._session()
+        limiter = self.host_limiters.get(self.url)
+        resp = session.get(self.url, timeout=5, stream=True)
+        self.assertEqual(b"<ok/>", b"".join(resp.iter_content(chunk_size=2)))
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_retried_streamed_response_is_closed(self):
+        self.server.responses = [(503, {"Retry-After": "0"})]
+        session = self._session()
+        with session.get(self.url, timeout=5, stream=True) as resp:
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual(1, self.host_limiters.get(self.url).in_flight)
+
+        self.assertEqual(0, self.host_limiters.get(self.url).in_flight)
+        self.assertEqual(1, http_utils.get_connection_stats(session).new_connections)
+
+    def test_limit_bounds_requests_in_flight(self):
+        self.server.delay = 0.05
+        session = self._session(initial=2, maximum=2)
+        statuses = []
+
+        def _get():
+            statuses.append(session.get(self.url, timeout=5).status_code)
+
+        threads = [threading.Thread(target=_get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([200] * 8, statuses)
+        self.assertLessEqual(self.server.max_in_flight, 2)
+
+    def test_limiter_is_shared_per_host(self):
+        self._session()
+        limiter = self.host_limiters.get(self.url)
+        self.assertIs(limiter, self.host_limiters.get(self.url + "?REQUEST=GetRecords"))
+        self.assertIsNot(limiter, self.host_limiters.get("http://localhost:1/csw"))
+
+    def test_burst_of_errors_halves_limit_once(self):
+        limiter = http_utils.AdaptiveConcurrencyLimiter("host", initial=8)
+        tokens = [limiter.acquire() for _ in range(4)]
+        for token in tokens:
+            limiter.release(token, throttled=True)
+        self.assertEqual(4, limiter.limit)
+
+        limiter.release(limiter.acquire(), throttled=True)
+        self.assertEqual(2, limiter.limit)
+        for _ in range(3):
+            limiter.release(limiter.acquire(), throttled=True)
+        self.assertEqual(1, limiter.limit)
+
+    def test_slow_responses_and_errors_keep_limit(self):
+        limiter = http_utils.AdaptiveConcurrencyLimiter("host", initial=4)
+        limiter.latency = 1.0
+        epoch, _ = limiter.acquire()
+        limiter.release((epoch, time.monotonic() - 3))
+        limiter.release(limiter.acquire(), failed=True)
+        self.assertEqual(4, limiter.limit)
+
+    def test_request_releases_slot_on_errors(self):
+        limiter = http_utils.AdaptiveConcurrencyLimiter("host", initial=4)
+        resp = requests.Response()
+        resp.status_code = 429
+        with self.assertRaises(requests.HTTPError):
+            with limiter.request():
+                raise requests.HTTPError(response=resp)
+
+        self.assertEqual(0, limiter.in_flight)
+        self.assertEqual(2, limiter.limit)
+
+
+class TestRequestHedger(unittest.TestCase):
+    def setUp(self):
+        self.hedger = http_utils.RequestHedger(90)
+        self.calls = []
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _prime(self, count=http_utils.HEDGE_MIN_SAMPLES):
+        for _ in range(count):
+            self.hedger.call("GetRecordById", lambda: "fast")
+
+    def _straggler(self, *results):
+        """The first call waits until the test ends, the others answer at once."""
+
+        def _fetch():
+            with self.hedger._lock:
+                call = len(self.calls)
+                self.calls.append(call)
+            if call == 0:
+                self.release.wait(5)
+            result = results[min(call, len(results) - 1)]
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return _fetch
+
+    def test_no_hedge_without_enough_latencies(self):
+        self._prime(http_utils.HEDGE_MIN_SAMPLES - 1)
+        threading.Timer(0.05, self.release.set).start()
+        result = self.hedger.call("GetRecordById", self._straggler("primary"))
+
+        self.assertEqual("primary", result)
+        self.assertEqual([0], self.calls)
+        self.assertEqual(
+            http_utils.HedgeStats(requests=20, hedged=0, hedge_wins=0),
+            self.hedger.get_stats(),
+        )
+
+    def test_straggler_is_hedged(self):
+        self._prime()
+        result = self.hedger.call("GetRecordById", self._straggler("primary", "hedge"))
+
+        self.assertEqual("hedge", result)
+        self.assertEqual(
+            http_utils.HedgeStats(requests=21, hedged=1, hedge_wins=1),
+            self.hedger.get_stats(),
+        )
+
+    def test_latencies_are_kept_per_kind(self):
+        self._prime()
+        threading.Timer(0.05, self.release.set).start()
+        result = self.hedger.call("GetRecords", self._straggler("primary"))
+
+        self.assertEqual("primary", result)
+        self.assertEqual(0, self.hedger.get_stats().hedged)
+
+    def test_extra_load_is_capped(self):
+        self.hedger.max_extra_load = 0.05
+        self._prime()
+        self.hedger.call("GetRecordById", self._straggler("primary", "hedge"))
+        self.release.set()
+        self.calls.clear()
+        self.release.clear()
+        threading.Timer(0.05, self.release.set).start()
+        result = self.hedger.call("GetRecordById", self._straggler("primary"))
+
+        self.assertEqual("primary", result)
+        self.assertEqual(
+            http_utils.HedgeStats(requests=22, hedged=1, hedge_wins=1),
+            self.hedger.get_stats(),
+        )
+
+    def test_failed_hedge_waits_for_primary(self):
+        self._prime()
+        threading.Timer(0.05, self.release.set).start()
+        result = self.hedger.call(
+            "GetRecordById", self._straggler("primary", ValueError("hedge"))
+        )
+
+        self.assertEqual("primary", result)
+        self.assertEqual(0, self.hedger.get_stats().hedge_wins)
+
+    def test_primary_error_is_raised_if_both_fail(self):
+        self._prime()
+        threading.Timer(0.05, self.release.set).start()
+        with self.assertRaisesRegex(ValueError, "primary"):
+            self.hedger.call(
+                "GetRecordById",
+                self._straggler(ValueError("primary"), ValueError("hedge")),
+            )
+
+    def test_unhedged_request_runs_in_calling_thread(self):
+        threads = []
+        self.hedger.call(
+            "GetRecordById", lambda: threads.append(threading.current_thread())
+        )
+
+        self.assertEqual([threading.current_thread()], threads)
+
+    def test_hedgers_do_not_start_threads_of_their_own(self):
+        self._prime()
+        self.hedger.call("GetRecordById", self._straggler("primary", "hedge"))
+        thread_count = threading.active_count()
+        for _ in range(10):
+            http_utils.RequestHedger(90).call("GetRecordById", lambda: "fast")
+
+        self.assertEqual(thread_count, threading.active_count())
+
+    def test_loser_response_is_closed(self):
+        class _Response(object):
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        primary = _Response()
+        self._prime()
+        result = self.hedger.call("GetRecordById", self._straggler(primary, "hedge"))
+        self.assertEqual("hedge", result)
+        self.assertFalse(primary.closed)
+
+        self.release.set()
+        for _ in range(500):
+            if primary.closed:
+                break
+            time.sleep(0.01)
+        self.assertTrue(primary.closed)
+
+
+class TestHedgedRequests(LocalServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host_limiters = http_utils.HostConcurrencyLimiters()
+        self.session = http_utils.build_session(host_limiters=self.host_limiters)
+
+    def test_latency_is_timed_per_attempt(self):
+        self.server.responses = [(503, {"Retry-After": "1"})]
+        hedger = http_utils.RequestHedger(90)
+        resp = hedger.call("GetRecords", self.session.get, self.url)
+
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(2, len(self.server.paths))
+        (latency,) = hedger._latencies["GetRecords"]
+        self.assertLess(latency, 0.5)
+
+    def test_abandoned_call_sends_no_retries(self):
+        self.server.responses = [(500, {})]
+        call = http_utils._HedgedCall()
+        call.abandoned.set()
+        http_utils._hedged_calls.current = call
+        try:
+            resp = self.session.get(self.url, timeout=5)
+        finally:
+            http_utils._hedged_calls.current = None
+
+        self.assertEqual(500, resp.status_code)
+        self.assertEqual(1, len(self.server.paths))
+        self.assertEqual([], call.latencies)
+        limiter = self.host_limiters.get(self.url)
+        self.assertEqual(0, limiter.in_flight)
+        self.assertEqual(http_utils.INITIAL_CONCURRENCY, limiter.limit)
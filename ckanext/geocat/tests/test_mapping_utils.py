@@ -0,0 +1,115 @@
+"""Tests for mapping utils"""
+
+import unittest
+
+from rdflib import Literal
+
+from ckanext.geocat.utils import mapping_utils, ogdch_map_utils
+from ckanext.geocat.utils.mapping_utils import SKOS
+
+
+def _map_format_by_linear_scan(geocat_format, valid_formats, valid_media_types):
+    """The format mapping as it was done before the vocabulary index existed."""
+    for key, value in list(valid_formats.items()):
+        if geocat_format.replace(" ", "_") == key:
+            return value
+    for key, value in list(valid_media_types.items()):
+        if geocat_format.replace(" ", "_") == key:
+            return value
+    return geocat_format
+
+
+class TestVocabularyIndex(unittest.TestCase):
+    def test_vocabulary_index_is_built_once(self):
+        self.assertIs(
+            mapping_utils.get_vocabulary_index(),
+            mapping_utils.get_vocabulary_index(),
+        )
+
+    def test_vocabulary_index_is_read_only(self):
+        vocabulary_index = mapping_utils.get_vocabulary_index()
+        with self.assertRaises(TypeError):
+            vocabulary_index.formats["CSV"] = "changed"
+
+    def test_format_mapping_matches_linear_scan(self):
+        vocabulary_index = mapping_utils.get_vocabulary_index()
+        valid_formats = mapping_utils.get_format_values()
+        valid_media_types = mapping_utils.get_iana_media_type_values()
+        geocat_formats = (
+            list(valid_formats.keys())
+            + list(valid_media_types.keys())
+            + [
+                "INTERLIS",
+                "ESRI Shapefile",
+                "Geopackage (ogc)",
+                "vnd.google-earth.kml+xml",
+                "remote-printing (OBSOLETE)",
+                "not a known format",
+                "",
+            ]
+        )
+        self.assertTrue(len(vocabulary_index.formats) > 0)
+        self.assertTrue(len(vocabulary_index.media_types) > 0)
+        for geocat_format in geocat_formats:
+            self.assertEqual(
+                _map_format_by_linear_scan(
+                    geocat_format, valid_formats, valid_media_types
+                ),
+                ogdch_map_utils._map_geocat_resource_format_to_valid_format(
+                    geocat_format
+                ),
+                geocat_format,
+            )
+
+
+class TestTermsOfUseIndex(unittest.TestCase):
+    def test_terms_of_use_index_is_built_once(self):
+        self.assertIs(
+            mapping_utils.get_terms_of_use_index(),
+            mapping_utils.get_terms_of_use_index(),
+        )
+
+    def test_terms_of_use_index_maps_label(self):
+        terms_of_use_index = mapping_utils.get_terms_of_use_index()
+        self.assertEqual(
+            mapping_utils.TERMS_OF_USE_OPEN,
+            terms_of_use_index[("de", "Opendata OPEN: Freie Nutzung.")],
+        )
+        self.assertEqual(
+            mapping_utils.TERMS_OF_USE_BY,
+            terms_of_use_index[
+                (
+                    "fr",
+                    mapping_utils.normalize_terms_of_use_text(
+                        "  Utilisation libre.\n  Obligation d’indiquer la source. "
+                    ),
+                )
+            ],
+        )
+
+    def test_terms_of_use_index_matches_graph_scan(self):
+        terms_of_use = mapping_utils.get_terms_of_use()
+        terms_of_use_index = mapping_utils.get_terms_of_use_index()
+        literals = [
+            literal
+            for literal in terms_of_use.objects()
+            if isinstance(literal, Literal) and literal.language
+        ]
+        self.assertTrue(len(literals) > 0)
+        for literal in literals:
+            expected = None
+            for rights_uri in terms_of_use.subjects(object=literal):
+                for mapping_object in terms_of_use.objects(
+                    predicate=SKOS.mappingRelation, subject=rights_uri
+                ):
+                    expected = expected or str(mapping_object) or None
+            self.assertEqual(
+                expected,
+                terms_of_use_index.get(
+                    (
+                        literal.language,
+                        mapping_utils.normalize_terms_of_use_text(str(literal)),
+                    )
+                ),
+                literal,
+            )
@@ -0,0 +1,138 @@
+"""Tests for the reconciliation of gathered and existing identifiers."""
+
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from ckanext.geocat.utils import search_utils
+
+EXISTING = {
+    "harvested@org": search_utils.OgdchDatasetInfo("harvested", True, "id-1"),
+    "missing@org": search_utils.OgdchDatasetInfo("missing", True, "id-2"),
+    "manual@org": search_utils.OgdchDatasetInfo("manual", False, "id-3"),
+    "other@org": search_utils.OgdchDatasetInfo("other", False, "id-4"),
+}
+
+
+class TestReconcileIdentifiers(unittest.TestCase):
+    def setUp(self):
+        self.reconciliation = search_utils.reconcile_identifiers(
+            EXISTING, ["harvested@org", "manual@org", "new@org", "new@org"]
+        )
+
+    def test_identifiers_are_sorted_into_sets(self):
+        self.assertEqual(
+            search_utils.IdentifierReconciliation(
+                create={"new@org"},
+                update={"harvested@org"},
+                delete={"missing@org"},
+                double={"manual@org"},
+            ),
+            self.reconciliation,
+        )
+
+    def test_packages_to_delete_belong_to_harvester(self):
+        self.assertEqual(
+            [("missing@org", EXISTING["missing@org"])],
+            search_utils.get_packages_to_delete(EXISTING, self.reconciliation),
+        )
+
+    def test_double_packages_do_not_belong_to_harvester(self):
+        self.assertEqual(
+            [("manual@org", EXISTING["manual@org"])],
+            search_utils.get_double_packages(EXISTING, self.reconciliation),
+        )
+
+
+class FakePackageSearch(object):
+    """package_search over ``datasets``, returning at most ``rows_max`` rows."""
+
+    def __init__(self, datasets, rows_max):
+        self.datasets = datasets
+        self.rows_max = rows_max
+        self.calls = []
+
+    def __call__(self, context, data_dict):
+        self.calls.append(data_dict)
+        start = data_dict["start"]
+        rows = min(data_dict["rows"], self.rows_max)
+        return {
+            "count": len(self.datasets),
+            "results": self.datasets[start : start + rows],
+        }
+
+
+def _dataset(number, harvest_source_id=None, identifier=True):
+    dataset = {"id": f"id-{number}", "name": f"dataset-{number}", "extras": []}
+    if identifier:
+        dataset["identifier"] = f"{number}@org"
+    if harvest_source_id:
+        dataset["extras"].append(
+            {"key": "harvest_source_id", "value": harvest_source_id}
+        )
+    return dataset
+
+
+class TestIterDatasetInfosForOrganization(unittest.TestCase):
+    def setUp(self):
+        self.package_search = FakePackageSearch(
+            [
+                _dataset(1, "source-id"),
+                _dataset(2, "other-source-id"),
+                _dataset(3),
+                _dataset(4, "source-id", identifier=False),
+                _dataset(5, "source-id"),
+            ],
+            rows_max=2,
+        )
+        patcher = mock.patch.object(
+            search_utils.tk, "get_action", return_value=self.package_search
+        )
+        self.get_action = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _list(self, **kwargs):
+        return list(
+            search_utils.iter_dataset_infos_for_organization(
+                "org", "source-id", rows=3, **kwargs
+            )
+        )
+
+    def test_datasets_belong_to_their_harvest_source(self):
+        self.assertEqual(
+            [
+                ("1@org", search_utils.OgdchDatasetInfo("dataset-1", True, "id-1")),
+                ("2@org", search_utils.OgdchDatasetInfo("dataset-2", False, "id-2")),
+                ("3@org", search_utils.OgdchDatasetInfo("dataset-3", False, "id-3")),
+                ("5@org", search_utils.OgdchDatasetInfo("dataset-5", True, "id-5")),
+            ],
+            self._list(),
+        )
+        self.get_action.assert_called_with("package_search")
+
+    def test_pages_start_after_the_returned_rows(self):
+        self._list()
+        self.assertEqual(
+            [0, 2, 4], [data_dict["start"] for data_dict in self.package_search.calls]
+        )
+
+    def test_listing_is_sorted_and_includes_private_datasets(self):
+        self._list()
+        self.assertEqual(
+            {
+                "fq": '+organization:"org" +dataset_type:dataset',
+                "rows": 3,
+                "start": 0,
+                "sort": "index_id asc",
+                "include_private": True,
+            },
+            self.package_search.calls[0],
+        )
+
+    def test_modified_since_is_filtered_in_utc(self):
+        self._list(modified_since=datetime(2024, 5, 1, 12, tzinfo=timezone.utc))
+        self.assertTrue(
+            self.package_search.calls[0]["fq"].endswith(
+                " +metadata_modified:[2024-05-01T12:00:00Z TO *]"
+            )
+        )
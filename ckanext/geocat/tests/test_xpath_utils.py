@@ -23,3 +23,84 @@ class TestXpathUtils(unittest.TestCase):
             path=path_identifier, node=self.root
         )
         assert value == data_identifier
+
+
+MULTILANGUAGE_NODE = """
+<gmd:title xmlns:gmd="http://www.isotc211.org/2005/gmd"
+           xmlns:gco="http://www.isotc211.org/2005/gco"
+           xmlns:che="http://www.geocat.ch/2008/che">
+  <gco:CharacterString>Fallback  title</gco:CharacterString>
+  <gmd:PT_FreeText>
+    <gmd:textGroup>
+      <gmd:LocalisedCharacterString locale="#FR">Titre</gmd:LocalisedCharacterString>
+    </gmd:textGroup>
+    <gmd:textGroup>
+      <gmd:LocalisedCharacterString locale="#RM">Titel rumantsch</gmd:LocalisedCharacterString>
+    </gmd:textGroup>
+    <gmd:textGroup>
+      <gmd:LocalisedCharacterString locale="#DE">Titel
+        Deutsch</gmd:LocalisedCharacterString>
+    </gmd:textGroup>
+    <gmd:textGroup>
+      <gmd:LocalisedCharacterString locale="#DE">Zweiter Titel</gmd:LocalisedCharacterString>
+    </gmd:textGroup>
+  </gmd:PT_FreeText>
+</gmd:title>
+"""
+
+LINKAGE_NODE = """
+<gmd:linkage xmlns:gmd="http://www.isotc211.org/2005/gmd"
+             xmlns:che="http://www.geocat.ch/2008/che">
+  <che:PT_FreeURL>
+    <che:URLGroup>
+      <che:LocalisedURL locale="#FR">https://example.org/fr</che:LocalisedURL>
+    </che:URLGroup>
+    <che:URLGroup>
+      <che:LocalisedURL locale="#DE">https://example.org/de</che:LocalisedURL>
+    </che:URLGroup>
+  </che:PT_FreeURL>
+  <gmd:URL>https://example.org/url</gmd:URL>
+</gmd:linkage>
+"""
+
+
+class TestXpathUtilsMultilanguage(unittest.TestCase):
+    def test_language_dict_uses_localised_strings(self):
+        node = etree.fromstring(MULTILANGUAGE_NODE)
+        language_dict = (
+            xpath_utils.xpath_get_language_dict_from_geocat_multilanguage_node(node)
+        )
+        assert language_dict == {
+            "en": "",
+            "it": "",
+            "de": "Titel Deutsch",
+            "fr": "Titre",
+        }
+
+    def test_language_dict_falls_back_to_character_string(self):
+        node = etree.fromstring(MULTILANGUAGE_NODE)
+        for text_group in node.iter("{http://www.isotc211.org/2005/gmd}textGroup"):
+            text_group.getparent().remove(text_group)
+        language_dict = (
+            xpath_utils.xpath_get_language_dict_from_geocat_multilanguage_node(node)
+        )
+        assert language_dict == {lang: "Fallback title" for lang in language_dict}
+
+    def test_one_value_prefers_character_string(self):
+        node = etree.fromstring(MULTILANGUAGE_NODE)
+        value = xpath_utils.xpath_get_one_value_from_geocat_multilanguage_node(node)
+        assert value == ["Fallback  title"]
+
+    def test_url_and_languages(self):
+        node = etree.fromstring(LINKAGE_NODE)
+        url, languages = xpath_utils.xpath_get_url_and_languages(node)
+        assert url == "https://example.org/fr"
+        assert languages == ["de", "fr"]
+
+    def test_url_from_node_prefers_linkage_url(self):
+        node = etree.fromstring(f"<root>{LINKAGE_NODE}</root>")
+        assert xpath_utils.xpath_get_url_from_node(node) == "https://example.org/url"
+
+    def test_url_from_node_uses_locale_order(self):
+        node = etree.fromstring(LINKAGE_NODE)
+        assert xpath_utils.xpath_get_url_from_node(node) == "https://example.org/de"
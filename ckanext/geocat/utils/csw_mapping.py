@@ -1,10 +1,8 @@
 import logging
-
-from rdflib import Literal
+from collections import namedtuple
 
 import ckanext.geocat.utils.ogdch_map_utils as ogdch_map_utils
 from ckanext.geocat.utils import mapping_utils, xpath_utils
-from ckanext.geocat.utils.mapping_utils import SKOS
 
 log = logging.getLogger(__name__)
 
@@ -34,55 +32,81 @@ gmd_namespaces = {
     "xlink": "http://www.w3.org/1999/xlink",
 }
 GMD_PROTOCOL = ".//gmd:protocol/gco:CharacterString/text()"
-GMD_RESOURCES = "//gmd:distributionInfo/gmd:MD_Distribution//gmd:transferOptions//gmd:CI_OnlineResource"
 GMD_IDENTIFIER = ".//gmd:fileIdentifier/gco:CharacterString/text()"
-GMD_TITLE = "//gmd:identificationInfo//gmd:citation//gmd:title"
-GMD_ISSUED = [
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "publication"]//gco:DateTime',
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "publication"]//gco:Date',
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "creation"]//gco:DateTime',
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "creation"]//gco:Date',
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "revision"]//gco:DateTime',
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "revision"]//gco:Date',
-]
-GMD_DESCRIPTION = "//gmd:identificationInfo//gmd:abstract"
+
+# The identification, distribution and content info subtrees of a record are
+# looked up once per record; the paths below are relative to them.
+GMD_RECORD_SECTIONS = (
+    ".//gmd:identificationInfo | .//gmd:distributionInfo | .//gmd:contentInfo"
+)
+GMD_RECORD_SECTION_FIELDS = {
+    f"{{{gmd_namespaces['gmd']}}}identificationInfo": "identification",
+    f"{{{gmd_namespaces['gmd']}}}distributionInfo": "distribution",
+    f"{{{gmd_namespaces['gmd']}}}contentInfo": "content",
+}
+
+# relative to gmd:distributionInfo
+GMD_RESOURCES = "gmd:MD_Distribution//gmd:transferOptions//gmd:CI_OnlineResource"
+
+# relative to gmd:identificationInfo
+GMD_TITLE = ".//gmd:citation//gmd:title"
+GMD_CITATION_DATES = ".//gmd:citation//gmd:CI_Date"
+GMD_DESCRIPTION = ".//gmd:abstract"
 GMD_RIGHTS = ".//gmd:resourceConstraints//gmd:otherConstraints"
-GMD_QUALIFIED_RELATIONS = "//gmd:identificationInfo//gmd:aggregationInfo//gmd:aggregateDataSetIdentifier/gmd:MD_Identifier/gmd:code/gco:CharacterString/text()"
-GMD_TEMPORAL_START = "//gmd:identificationInfo//gmd:extent//gmd:temporalElement//gml:TimePeriod/gml:beginPosition/text()"
-GMD_TEMPORAL_END = "//gmd:identificationInfo//gmd:extent//gmd:temporalElement//gml:TimePeriod/gml:endPosition/text()"
-GMD_LANGUAGE = [
-    "//gmd:identificationInfo//gmd:language/gco:CharacterString/text()",
-    "//gmd:language/gmd:LanguageCode/@codeListValue",
-]
-GMD_SPATIAL = (
-    "//gmd:identificationInfo//gmd:extent//gmd:description/gco:CharacterString/text()"
+GMD_QUALIFIED_RELATIONS = ".//gmd:aggregationInfo//gmd:aggregateDataSetIdentifier/gmd:MD_Identifier/gmd:code/gco:CharacterString/text()"
+GMD_TEMPORAL_START = (
+    ".//gmd:extent//gmd:temporalElement//gml:TimePeriod/gml:beginPosition/text()"
 )
-GMD_PUBLISHER = [
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "publisher"]//gmd:organisationName',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "owner"]//gmd:organisationName',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "pointOfContact"]//gmd:organisationName',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "distributor"]//gmd:organisationName',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "custodian"]//gmd:organisationName',
-    "//gmd:contact//che:CHE_CI_ResponsibleParty//gmd:organisationName",
-]
-GMD_CONTACT_POINT = [
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "pointOfContact"]//gmd:address//gmd:electronicMailAddress/gco:CharacterString',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "owner"]//gmd:address//gmd:electronicMailAddress/gco:CharacterString',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "publisher"]//gmd:address//gmd:electronicMailAddress/gco:CharacterString',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "distributor"]//gmd:address//gmd:electronicMailAddress/gco:CharacterString',
-    '//gmd:identificationInfo//gmd:pointOfContact[.//gmd:CI_RoleCode/@codeListValue = "custodian"]//gmd:address//gmd:electronicMailAddress/gco:CharacterString',
-    "//gmd:contact//che:CHE_CI_ResponsibleParty//gmd:address//gmd:electronicMailAddress/gco:CharacterString",
+GMD_TEMPORAL_END = (
+    ".//gmd:extent//gmd:temporalElement//gml:TimePeriod/gml:endPosition/text()"
+)
+GMD_LANGUAGE = ".//gmd:language/gco:CharacterString/text()"
+GMD_SPATIAL = ".//gmd:extent//gmd:description/gco:CharacterString/text()"
+GMD_POINTS_OF_CONTACT = ".//gmd:pointOfContact"
+GMD_KEYWORDS = ".//gmd:descriptiveKeywords//gmd:keyword"
+GMD_THEME = ".//gmd:topicCategory/gmd:MD_TopicCategoryCode/text()"
+GMD_ACCRUAL_PERIODICITY = ".//che:CHE_MD_MaintenanceInformation/gmd:maintenanceAndUpdateFrequency/gmd:MD_MaintenanceFrequencyCode/@codeListValue"
+
+# relative to a gmd:CI_Date of the citation
+GMD_DATE_TYPE = ".//gmd:CI_DateTypeCode/@codeListValue"
+GMD_DATE_VALUES = [".//gco:DateTime/text()", ".//gco:Date/text()"]
+
+# relative to a gmd:pointOfContact
+GMD_ROLE = ".//gmd:CI_RoleCode/@codeListValue"
+GMD_ORGANISATION_NAME = ".//gmd:organisationName"
+GMD_EMAIL = ".//gmd:address//gmd:electronicMailAddress/gco:CharacterString/text()"
+
+# relative to the whole record
+GMD_LANGUAGE_CODE = ".//gmd:language/gmd:LanguageCode/@codeListValue"
+GMD_METADATA_CONTACT = ".//gmd:contact//che:CHE_CI_ResponsibleParty"
+GMD_METADATA_CONTACT_NAME = f"{GMD_METADATA_CONTACT}//gmd:organisationName"
+GMD_METADATA_CONTACT_EMAIL = f"{GMD_METADATA_CONTACT}//gmd:address//gmd:electronicMailAddress/gco:CharacterString/text()"
+
+# Priorities: the first date type or role in these lists that has a value
+# is mapped. DateTime values take precedence over Date values.
+GMD_ISSUED_DATE_TYPES = ["publication", "creation", "revision"]
+GMD_MODIFIED_DATE_TYPES = ["revision"]
+GMD_PUBLISHER_ROLES = [
+    "publisher",
+    "owner",
+    "pointOfContact",
+    "distributor",
+    "custodian",
 ]
-GMD_PUBLISHER_NAME = "//gmd:organisationName"
-GMD_MODIFIED = [
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "revision"]//gco:DateTime',
-    '//gmd:identificationInfo//gmd:citation//gmd:CI_Date[.//gmd:CI_DateTypeCode/@codeListValue = "revision"]//gco:Date',
+GMD_CONTACT_POINT_ROLES = [
+    "pointOfContact",
+    "owner",
+    "publisher",
+    "distributor",
+    "custodian",
 ]
-GMD_KEYWORDS = "//gmd:identificationInfo//gmd:descriptiveKeywords//gmd:keyword"
-GMD_THEME = (
-    "//gmd:identificationInfo//gmd:topicCategory/gmd:MD_TopicCategoryCode/text()"
+
+CheRecordSections = namedtuple(
+    "CheRecordSections", ["identification", "distribution", "content"]
+)
+PointOfContact = namedtuple(
+    "PointOfContact", ["node", "roles", "organisation_name", "email"]
 )
-GMD_ACCRUAL_PERIODICITY = "//gmd:identificationInfo//che:CHE_MD_MaintenanceInformation/gmd:maintenanceAndUpdateFrequency/gmd:MD_MaintenanceFrequencyCode/@codeListValue"
 
 EMPTY_PUBLISHER = {
     "url": "",
@@ -105,58 +129,83 @@ class GeoMetadataMapping(object):
         self.organization_slug = organization_slug
         self.legal_basis_url = legal_basis_url
         self.valid_identifiers = valid_identifiers
-        self.terms_of_use_graph = mapping_utils.get_terms_of_use()
+        self.terms_of_use_index = mapping_utils.get_terms_of_use_index()
         self.excluded_protocols = mapping_utils.get_excluded_protocols()
         self.default_rights = default_rights
 
     def get_metadata(self, csw_record_as_string, geocat_id):
-        log.debug(f"processing geocat_id {geocat_id}")
         root_node = xpath_utils.get_elem_tree_from_string(csw_record_as_string)
+        return self.get_metadata_from_element(root_node, geocat_id)
+
+    def get_metadata_from_element(self, root_node, geocat_id):
+        """
+        Map an already parsed record: either a GetRecordById response or a
+        single ``gmd:MD_Metadata`` element taken from a GetRecords page.
+        """
+        log.debug(f"processing geocat_id {geocat_id}")
+        sections = _get_record_sections(root_node)
+        identification_nodes = sections.identification
+        citation_dates = _get_citation_dates(identification_nodes)
+        points_of_contact = _get_points_of_contact(identification_nodes)
         dataset_dict = {}
         dataset_dict["identifier"] = _map_dataset_identifier(
             node=root_node, organization_slug=self.organization_slug
         )
-        dataset_dict["title"] = _map_dataset_title(node=root_node)
-        dataset_dict["description"] = _map_dataset_description(node=root_node)
+        dataset_dict["title"] = _map_dataset_title(nodes=identification_nodes)
+        dataset_dict["description"] = _map_dataset_description(
+            nodes=identification_nodes
+        )
         dataset_dict["publisher"] = _map_dataset_publisher(
-            node=root_node, organization_slug=self.organization_slug
+            node=root_node,
+            points_of_contact=points_of_contact,
+            organization_slug=self.organization_slug,
+        )
+        dataset_dict["contact_points"] = _map_dataset_contact_points(
+            node=root_node, points_of_contact=points_of_contact
+        )
+        dataset_dict["issued"] = _map_dataset_issued(citation_dates=citation_dates)
+        dataset_dict["modified"] = _map_dataset_modified(citation_dates=citation_dates)
+        dataset_dict["keywords"] = _map_dataset_keywords(nodes=identification_nodes)
+        dataset_dict["groups"] = _map_dataset_categories(nodes=identification_nodes)
+        dataset_dict["language"] = _map_dataset_language(
+            node=root_node, identification_nodes=identification_nodes
+        )
+        dataset_dict["accrual_periodicity"] = _map_dataset_frequency(
+            nodes=identification_nodes
         )
-        dataset_dict["contact_points"] = _map_dataset_contact_points(node=root_node)
-        dataset_dict["issued"] = _map_dataset_issued(node=root_node)
-        dataset_dict["modified"] = _map_dataset_modified(node=root_node)
-        dataset_dict["keywords"] = _map_dataset_keywords(node=root_node)
-        dataset_dict["groups"] = _map_dataset_categories(node=root_node)
-        dataset_dict["language"] = _map_dataset_language(node=root_node)
-        dataset_dict["accrual_periodicity"] = _map_dataset_frequency(node=root_node)
         dataset_dict["coverage"] = _map_dataset_coverage()
-        dataset_dict["spatial"] = _map_dataset_spatial(node=root_node)
-        dataset_dict["temporals"] = _map_dataset_temporals(node=root_node)
+        dataset_dict["spatial"] = _map_dataset_spatial(nodes=identification_nodes)
+        dataset_dict["temporals"] = _map_dataset_temporals(nodes=identification_nodes)
         dataset_dict["qualified_relations"] = _map_dataset_qualified_relations(
-            node=root_node,
+            nodes=identification_nodes,
             organization_slug=self.organization_slug,
             valid_identifiers=self.valid_identifiers,
         )
         dataset_dict["owner_org"] = self.organization_slug
-        dataset_dict["conforms_to"], _ = _map_dataset_conforms_to(node=root_node)
+        dataset_dict["conforms_to"], _ = _map_dataset_conforms_to(
+            nodes=sections.content
+        )
 
         rights = _map_dataset_rights(
-            node=root_node,
-            terms_of_use=self.terms_of_use_graph,
+            nodes=identification_nodes,
+            terms_of_use=self.terms_of_use_index,
             default_rights=self.default_rights,
         )
 
         # Map resource nodes as resources
         dataset_dict["relations"] = []
         dataset_dict["resources"] = []
-        resource_nodes = xpath_utils.xpath_get_all_sub_nodes_for_node_and_path(
-            node=root_node, path=GMD_RESOURCES
+        resource_nodes = xpath_utils.xpath_get_all_sub_nodes_for_nodes_and_path(
+            nodes=sections.distribution, path=GMD_RESOURCES
         )
         if resource_nodes is not None:
             for resource_node in resource_nodes:
                 self._map_resource_onto_dataset(dataset_dict, resource_node, rights)
 
         # Map geocat services as resources
-        geocat_services = xpath_utils.xpath_get_geocat_services(node=root_node)
+        geocat_services = xpath_utils.xpath_get_geocat_services(
+            nodes=identification_nodes
+        )
         if geocat_services:
             for geocat_service in geocat_services:
                 ogdch_service = ogdch_map_utils.map_service(
@@ -243,6 +292,80 @@ class GeoMetadataMapping(object):
                     dataset_dict["language"].append(lang)
 
 
+def _get_record_sections(node):
+    """
+    Find the identification, distribution and content info subtrees of a
+    record in a single traversal of the document.
+    """
+    sections = CheRecordSections(identification=[], distribution=[], content=[])
+    for section_node in xpath_utils.xpath_evaluate(node, GMD_RECORD_SECTIONS):
+        field = GMD_RECORD_SECTION_FIELDS[section_node.tag]
+        getattr(sections, field).append(section_node)
+    return sections
+
+
+def _get_citation_dates(identification_nodes):
+    """
+    Collect the citation dates in one traversal of the identification info.
+
+    Returns a dict ``(date type, index in GMD_DATE_VALUES) -> value`` that
+    holds the first value in document order for each key.
+    """
+    citation_dates = {}
+    for date_node in (
+        xpath_utils.xpath_get_all_sub_nodes_for_nodes_and_path(
+            nodes=identification_nodes, path=GMD_CITATION_DATES
+        )
+        or []
+    ):
+        date_types = xpath_utils.xpath_evaluate(date_node, GMD_DATE_TYPE)
+        for index, path in enumerate(GMD_DATE_VALUES):
+            value = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
+                node=date_node, path=path
+            )
+            if value is None:
+                continue
+            for date_type in date_types:
+                citation_dates.setdefault((date_type, index), value)
+    return citation_dates
+
+
+def _get_first_citation_date(citation_dates, date_types):
+    for date_type in date_types:
+        for index in range(len(GMD_DATE_VALUES)):
+            value = citation_dates.get((date_type, index))
+            if value is not None:
+                return value
+    return None
+
+
+def _get_points_of_contact(identification_nodes):
+    """
+    Collect the points of contact of the identification info with their
+    roles, first organisation name and first email in one traversal.
+    """
+    points_of_contact = []
+    for contact_node in (
+        xpath_utils.xpath_get_all_sub_nodes_for_nodes_and_path(
+            nodes=identification_nodes, path=GMD_POINTS_OF_CONTACT
+        )
+        or []
+    ):
+        points_of_contact.append(
+            PointOfContact(
+                node=contact_node,
+                roles=set(xpath_utils.xpath_evaluate(contact_node, GMD_ROLE)),
+                organisation_name=xpath_utils.xpath_get_single_sub_node_for_node_and_path(
+                    node=contact_node, path=GMD_ORGANISATION_NAME
+                ),
+                email=xpath_utils.xpath_get_single_sub_node_for_node_and_path(
+                    node=contact_node, path=GMD_EMAIL
+                ),
+            )
+        )
+    return points_of_contact
+
+
 def _map_dataset_identifier(node, organization_slug):
     geocat_identifier = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
         node=node, path=GMD_IDENTIFIER
@@ -253,9 +376,21 @@ def _map_dataset_identifier(node, organization_slug):
         )
 
 
-def _map_dataset_title(node):
-    title_node = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node=node, path=GMD_TITLE
+def _get_point_of_contact_for_roles(points_of_contact, roles, field):
+    """
+    Return the first point of contact that has a value for *field*, trying
+    *roles* in order, together with the role it was found for.
+    """
+    for role in roles:
+        for contact in points_of_contact:
+            if role in contact.roles and getattr(contact, field) is not None:
+                return contact, role
+    return None, None
+
+
+def _map_dataset_title(nodes):
+    title_node = xpath_utils.xpath_get_single_sub_node_for_nodes_and_path(
+        nodes=nodes, path=GMD_TITLE
     )
     if title_node is not None:
         return xpath_utils.xpath_get_language_dict_from_geocat_multilanguage_node(
@@ -264,9 +399,9 @@ def _map_dataset_title(node):
     return {"en": "", "it": "", "de": "", "fr": ""}
 
 
-def _map_dataset_description(node):
-    description_node = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node=node, path=GMD_DESCRIPTION
+def _map_dataset_description(nodes):
+    description_node = xpath_utils.xpath_get_single_sub_node_for_nodes_and_path(
+        nodes=nodes, path=GMD_DESCRIPTION
     )
     if description_node is not None:
         return xpath_utils.xpath_get_language_dict_from_geocat_multilanguage_node(
@@ -275,13 +410,22 @@ def _map_dataset_description(node):
     return {"en": "", "it": "", "de": "", "fr": ""}
 
 
-def _map_dataset_publisher(node, organization_slug):
-    (
-        publisher_name_node,
-        publisher_name_path,
-    ) = xpath_utils.xpath_get_first_of_values_from_path_list(
-        node=node, path_list=GMD_PUBLISHER, get=xpath_utils.XPATH_NODE
+def _map_dataset_publisher(node, points_of_contact, organization_slug):
+    contact, role = _get_point_of_contact_for_roles(
+        points_of_contact, GMD_PUBLISHER_ROLES, "organisation_name"
     )
+    if contact is not None:
+        publisher_name_node = contact.organisation_name
+        publisher_url_node = next(
+            contact.node for contact in points_of_contact if role in contact.roles
+        )
+    else:
+        publisher_name_node = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
+            node=node, path=GMD_METADATA_CONTACT_NAME
+        )
+        publisher_url_node = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
+            node=node, path=GMD_METADATA_CONTACT
+        )
     if publisher_name_node is None:
         return EMPTY_PUBLISHER
     # extract the language dictionary from the publisher name node
@@ -291,48 +435,48 @@ def _map_dataset_publisher(node, organization_slug):
     if not isinstance(publisher_name, dict) or not publisher_name:
         return EMPTY_PUBLISHER
     geocat_publisher = {"name": publisher_name}
-    publisher_url_path = publisher_name_path.replace(GMD_PUBLISHER_NAME, "")
-    publisher_url_node = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node, publisher_url_path
-    )
     publisher_url = xpath_utils.xpath_get_url_from_node(publisher_url_node)
     if publisher_url:
         geocat_publisher["url"] = publisher_url
     return ogdch_map_utils.map_to_ogdch_publisher(geocat_publisher, organization_slug)
 
 
-def _map_dataset_contact_points(node):
-    (
-        geocat_contact_point,
-        _,
-    ) = xpath_utils.xpath_get_first_of_values_from_path_list(
-        node=node, path_list=GMD_CONTACT_POINT, get=xpath_utils.XPATH_TEXT
+def _map_dataset_contact_points(node, points_of_contact):
+    contact, _ = _get_point_of_contact_for_roles(
+        points_of_contact, GMD_CONTACT_POINT_ROLES, "email"
     )
+    if contact is not None:
+        geocat_contact_point = contact.email
+    else:
+        geocat_contact_point = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
+            node=node, path=GMD_METADATA_CONTACT_EMAIL
+        )
     if geocat_contact_point:
         return ogdch_map_utils.map_contact_points(geocat_contact_point)
     return []
 
 
-def _map_dataset_issued(node):
-    geocat_issued, _ = xpath_utils.xpath_get_first_of_values_from_path_list(
-        node=node, path_list=GMD_ISSUED, get=xpath_utils.XPATH_TEXT
-    )
+def _map_dataset_issued(citation_dates):
+    geocat_issued = _get_first_citation_date(citation_dates, GMD_ISSUED_DATE_TYPES)
     if geocat_issued:
         return ogdch_map_utils.map_to_ogdch_datetime(geocat_issued)
     return ""
 
 
-def _map_dataset_modified(node):
-    geocat_modified, _ = xpath_utils.xpath_get_first_of_values_from_path_list(
-        node=node, path_list=GMD_MODIFIED, get=xpath_utils.XPATH_TEXT
-    )
+def _map_dataset_modified(citation_dates):
+    geocat_modified = _get_first_citation_date(citation_dates, GMD_MODIFIED_DATE_TYPES)
     if geocat_modified:
         return ogdch_map_utils.map_to_ogdch_datetime(geocat_modified)
     return ""
 
 
-def _map_dataset_keywords(node):
-    keyword_nodes = node.xpath(GMD_KEYWORDS, namespaces=gmd_namespaces)
+def _map_dataset_keywords(nodes):
+    keyword_nodes = (
+        xpath_utils.xpath_get_all_sub_nodes_for_nodes_and_path(
+            nodes=nodes, path=GMD_KEYWORDS
+        )
+        or []
+    )
     geocat_keywords = []
     for node in keyword_nodes:
         keyword_dict = (
@@ -344,18 +488,18 @@ def _map_dataset_keywords(node):
     return []
 
 
-def _map_dataset_categories(node):
-    geocat_categories = xpath_utils.xpath_get_all_sub_nodes_for_node_and_path(
-        node=node, path=GMD_THEME
+def _map_dataset_categories(nodes):
+    geocat_categories = xpath_utils.xpath_get_all_sub_nodes_for_nodes_and_path(
+        nodes=nodes, path=GMD_THEME
     )
     if geocat_categories:
         return ogdch_map_utils.map_to_ogdch_categories(geocat_categories)
     return []
 
 
-def _map_dataset_frequency(node):
-    geocat_frequency = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node=node, path=GMD_ACCRUAL_PERIODICITY
+def _map_dataset_frequency(nodes):
+    geocat_frequency = xpath_utils.xpath_get_single_sub_node_for_nodes_and_path(
+        nodes=nodes, path=GMD_ACCRUAL_PERIODICITY
     )
     if geocat_frequency:
         accrual_periodicity = ogdch_map_utils.map_frequency(geocat_frequency)
@@ -368,19 +512,23 @@ def _map_dataset_coverage():
     return ""
 
 
-def _map_dataset_spatial(node):
-    geocat_spatial = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node=node, path=GMD_SPATIAL
+def _map_dataset_spatial(nodes):
+    geocat_spatial = xpath_utils.xpath_get_single_sub_node_for_nodes_and_path(
+        nodes=nodes, path=GMD_SPATIAL
     )
     if geocat_spatial:
         return geocat_spatial
     return ""
 
 
-def _map_dataset_language(node):
-    geocat_languages = xpath_utils.xpath_get_all_values_for_node_and_path_list(
-        node=node, path_list=GMD_LANGUAGE
+def _map_dataset_language(node, identification_nodes):
+    geocat_languages = (
+        xpath_utils.xpath_get_all_sub_nodes_for_nodes_and_path(
+            nodes=identification_nodes, path=GMD_LANGUAGE
+        )
+        or []
     )
+    geocat_languages.extend(xpath_utils.xpath_evaluate(node, GMD_LANGUAGE_CODE))
     languages = []
     if geocat_languages:
         for geocat_language in set(geocat_languages):
@@ -390,19 +538,19 @@ def _map_dataset_language(node):
     return languages
 
 
-def _map_dataset_temporals(node):
-    geocat_temporal_start = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node=node, path=GMD_TEMPORAL_START
+def _map_dataset_temporals(nodes):
+    geocat_temporal_start = xpath_utils.xpath_get_single_sub_node_for_nodes_and_path(
+        nodes=nodes, path=GMD_TEMPORAL_START
     )
-    geocat_temporal_end = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node=node, path=GMD_TEMPORAL_END
+    geocat_temporal_end = xpath_utils.xpath_get_single_sub_node_for_nodes_and_path(
+        nodes=nodes, path=GMD_TEMPORAL_END
     )
     return ogdch_map_utils.map_temporals(geocat_temporal_start, geocat_temporal_end)
 
 
-def _map_dataset_qualified_relations(node, organization_slug, valid_identifiers):
-    geocat_qualified_relations = xpath_utils.xpath_get_all_sub_nodes_for_node_and_path(
-        node=node, path=GMD_QUALIFIED_RELATIONS
+def _map_dataset_qualified_relations(nodes, organization_slug, valid_identifiers):
+    geocat_qualified_relations = xpath_utils.xpath_get_all_sub_nodes_for_nodes_and_path(
+        nodes=nodes, path=GMD_QUALIFIED_RELATIONS
     )
     if geocat_qualified_relations:
         return ogdch_map_utils.map_qualified_relations(
@@ -411,9 +559,9 @@ def _map_dataset_qualified_relations(node, organization_slug, valid_identifiers)
     return []
 
 
-def _map_dataset_rights(node, terms_of_use, default_rights):
-    rights_node = xpath_utils.xpath_get_single_sub_node_for_node_and_path(
-        node=node, path=GMD_RIGHTS
+def _map_dataset_rights(nodes, terms_of_use, default_rights):
+    rights_node = xpath_utils.xpath_get_single_sub_node_for_nodes_and_path(
+        nodes=nodes, path=GMD_RIGHTS
     )
     if rights_node is not None:
         geocat_rights_dict = xpath_utils.xpath_get_rights_dict_form_rights_node(
@@ -421,20 +569,17 @@ def _map_dataset_rights(node, terms_of_use, default_rights):
         )
         if geocat_rights_dict:
             for lang, rights_value in list(geocat_rights_dict.items()):
-                rights_literal = Literal(rights_value, lang=lang)
-                for rights_uri in terms_of_use.subjects(object=rights_literal):
-                    for mapping_object in terms_of_use.objects(
-                        predicate=SKOS.mappingRelation, subject=rights_uri
-                    ):
-                        ogdch_rights = str(mapping_object)
-                        if ogdch_rights:
-                            return ogdch_rights
+                ogdch_rights = terms_of_use.get(
+                    (lang, mapping_utils.normalize_terms_of_use_text(rights_value))
+                )
+                if ogdch_rights:
+                    return ogdch_rights
     return default_rights
 
 
-def _map_dataset_conforms_to(node):
+def _map_dataset_conforms_to(nodes):
     (
         conforms_to_urls_list,
         conforms_to_languages_list,
-    ) = xpath_utils.xpath_get_url_and_languages_for_data_model(node=node)
+    ) = xpath_utils.xpath_get_url_and_languages_for_data_model(nodes=nodes)
     return conforms_to_urls_list, conforms_to_languages_list
@@ -1,40 +1,89 @@
+import copy
+import hashlib
+import itertools
 import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
 
 import requests
 from lxml import etree
 from owslib.catalogue.csw2 import CatalogueServiceWeb
-from owslib.fes import PropertyIsEqualTo
+from owslib.util import clean_ows_url
+
+from ckanext.geocat.utils import http_utils
 
 log = logging.getLogger(__name__)
 
+CSW_RECORD_SCHEMA = "http://www.opengis.net/cat/csw/2.0.2"
 CHE_SCHEMA = "http://www.geocat.ch/2008/che"
 DCAT_AP_CH_SCHEMA = "http://dcat-ap.ch/schema/dcat-ap-ch/2.0"
 CQL_QUERY_DEFAULT = "subject"
 CQL_SEARCH_TERM_DEFAULT = "opendata.swiss"
+DEFAULT_PAGE_SIZE = 50
+ID_LISTING_PAGE_SIZE = 1000
+# adaptive page sizes aim for GetRecords responses that take about this long
+# and never grow past this many bytes
+TARGET_PAGE_SECONDS = 10
+MAX_PAGE_BYTES = 8 * 1024 * 1024
+CAPABILITIES_CACHE_TTL = 24 * 60 * 60
+CAPABILITIES_CACHE_DIR = os.path.join(
+    tempfile.gettempdir(), "ckanext-geocat-capabilities"
+)
 
 _DCAT_DATASET_TAG = "{http://www.w3.org/ns/dcat#}Dataset"
 _DCT_IDENTIFIER_TAG = "{http://purl.org/dc/terms/}identifier"
+_CHE_RECORD_TAGS = (
+    "{http://www.isotc211.org/2005/gmd}MD_Metadata",
+    "{http://www.geocat.ch/2008/che}CHE_MD_Metadata",
+)
+_GMD_FILE_IDENTIFIER_PATH = (
+    "{http://www.isotc211.org/2005/gmd}fileIdentifier/"
+    "{http://www.isotc211.org/2005/gco}CharacterString"
+)
 
-# Wraps a single dcat:Dataset in a minimal GetRecordByIdResponse envelope
-# so that dcat_mapping.DcatMetadataMapping can parse it unchanged.
-_GETRECORDBYID_ENVELOPE = (
-    '<?xml version="1.0" encoding="UTF-8"?>'
-    '<csw:GetRecordByIdResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2">'
-    "{dataset_xml}"
-    "</csw:GetRecordByIdResponse>"
+# servers may ignore ELEMENTSETNAME=brief, so any csw:Record flavour is accepted
+_CSW_RECORD_TAGS = (
+    "{http://www.opengis.net/cat/csw/2.0.2}BriefRecord",
+    "{http://www.opengis.net/cat/csw/2.0.2}SummaryRecord",
+    "{http://www.opengis.net/cat/csw/2.0.2}Record",
 )
+_DC_IDENTIFIER_TAG = "{http://purl.org/dc/elements/1.1/}identifier"
 
 _CSW_SEARCH_RESULTS_NS = {"csw": "http://www.opengis.net/cat/csw/2.0.2"}
 
+_CSW_SEARCH_RESULTS_TAG = "{http://www.opengis.net/cat/csw/2.0.2}SearchResults"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_END_OF_ITEMS = object()
 
-def _build_cql_params(cql, cql_query, cql_search_term):
-    """Return the CQL constraint parameters to add to a GetRecords request."""
+SearchResultsCounts = namedtuple(
+    "SearchResultsCounts", ["matched", "returned", "next_record"]
+)
+
+
+def _build_cql_params(cql, cql_query, cql_search_term, modified_since=None):
+    """
+    Return the CQL constraint parameters to add to a GetRecords request.
+    With ``modified_since`` (an aware datetime) only the records changed
+    since then match.
+    """
     if cql_query and cql_search_term:
         constraint = f"{cql_query} = '{cql_search_term}'"
     elif cql:
         constraint = cql
     else:
         constraint = f"{CQL_QUERY_DEFAULT} = '{CQL_SEARCH_TERM_DEFAULT}'"
+    if modified_since is not None:
+        modified = modified_since.astimezone(timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        )
+        constraint = f"({constraint}) AND Modified >= '{modified}'"
     return {
         "CONSTRAINTLANGUAGE": "CQL_TEXT",
         "CONSTRAINT_LANGUAGE_VERSION": "1.1.0",
@@ -42,14 +91,65 @@ def _build_cql_params(cql, cql_query, cql_search_term):
     }
 
 
-def _next_record_from_results(root, current_start):
-    """Return the next start position from a GetRecords response, or None if done."""
+def _build_getrecords_params(
+    output_schema,
+    cql,
+    cql_query,
+    cql_search_term,
+    maxrecords,
+    element_set_name="full",
+    modified_since=None,
+):
+    """Return the parameters of a GetRecords request."""
+    params = {
+        "SERVICE": "CSW",
+        "VERSION": "2.0.2",
+        "REQUEST": "GetRecords",
+        "OUTPUTSCHEMA": output_schema,
+        "TYPENAMES": "csw:Record",
+        "ELEMENTSETNAME": element_set_name,
+        "RESULTTYPE": "results",
+        "MAXRECORDS": str(maxrecords),
+    }
+    params.update(_build_cql_params(cql, cql_query, cql_search_term, modified_since))
+    return params
+
+
+def _counts_from_search_results(csw_search_results):
+    return SearchResultsCounts(
+        matched=int(csw_search_results.get("numberOfRecordsMatched", 0)),
+        returned=int(csw_search_results.get("numberOfRecordsReturned", 0)),
+        next_record=int(csw_search_results.get("nextRecord", 0)),
+    )
+
+
+def _search_results_counts(root):
+    """Return the SearchResultsCounts of a GetRecords response, or None."""
     csw_search_results = root.find(".//csw:SearchResults", _CSW_SEARCH_RESULTS_NS)
     if csw_search_results is None:
         return None
-    next_record = int(csw_search_results.get("nextRecord", 0))
-    matched = int(csw_search_results.get("numberOfRecordsMatched", 0))
-    returned = int(csw_search_results.get("numberOfRecordsReturned", 0))
+    return _counts_from_search_results(csw_search_results)
+
+
+def _clear_element(elem):
+    """Free a parsed element and the siblings before it (iterparse idiom)."""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def _next_record_from_results(root, current_start):
+    """Return the next start position from a GetRecords response, or None if done."""
+    return _next_record_from_counts(_search_results_counts(root), current_start)
+
+
+def _next_record_from_counts(counts, current_start):
+    """Return the next start position from SearchResultsCounts, or None if done."""
+    if counts is None:
+        return None
+    matched, returned, next_record = counts
     log.debug(
         "GetRecords: matched=%s returned=%s nextRecord=%s start=%s",
         matched,
@@ -69,49 +169,590 @@ def _next_record_from_results(root, current_start):
     return next_record
 
 
+def _is_expected_page(root, start, matched, page_size):
+    """
+    Check that a page fetched during fan-out is the page sequential paging
+    would have returned: the catalogue still matches the same number of
+    records and the page starts and ends where expected.
+    """
+    counts = _search_results_counts(root)
+    if counts is None or counts.matched != matched:
+        return False
+    expected_returned = min(page_size, matched - start + 1)
+    if counts.returned != expected_returned:
+        return False
+    if start + counts.returned > matched:
+        return counts.next_record == 0 or counts.next_record > matched
+    return counts.next_record == start + counts.returned
+
+
+def _get_che_records(root):
+    csw_search_results = root.find("csw:SearchResults", _CSW_SEARCH_RESULTS_NS)
+    if csw_search_results is None:
+        return []
+    return [record for record in csw_search_results if record.tag in _CHE_RECORD_TAGS]
+
+
+def _get_dcat_datasets(root):
+    return list(root.iter(_DCAT_DATASET_TAG))
+
+
+def _records_from_pages(pages, start, get_page_records, on_page=None):
+    """
+    Yield the records of parsed GetRecords pages, stopping at the first page
+    without records. Once the caller has consumed all records of a page,
+    ``on_page`` is called with the start position of the next page, or None
+    after the last one.
+    """
+    for root in pages:
+        records = get_page_records(root)
+        if not records:
+            break
+        yield from records
+        start = _next_record_from_results(root, start)
+        if on_page is not None:
+            on_page(start)
+
+
+def _read_ahead(iterator, size):
+    """
+    Advance ``iterator`` in a background thread, at most ``size`` items ahead
+    of the item the caller is processing. Items are yielded in order and an
+    exception raised by ``iterator`` is raised to the caller.
+    """
+    items = queue.Queue()
+    slots = threading.Semaphore(size)
+    stop = threading.Event()
+
+    producer = threading.Thread(
+        target=_produce_ahead,
+        args=(iterator, items, slots, stop),
+        name="geocat-read-ahead",
+        daemon=True,
+    )
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _END_OF_ITEMS:
+                return
+            slots.release()
+            yield item
+    finally:
+        stop.set()
+        slots.release()
+
+
+def _produce_ahead(iterator, items, slots, stop):
+    """Producer of _read_ahead: puts (item, error) tuples on the items queue."""
+    try:
+        while True:
+            slots.acquire()
+            if stop.is_set():
+                return
+            try:
+                item = next(iterator)
+            except StopIteration:
+                items.put((_END_OF_ITEMS, None))
+                return
+            items.put((item, None))
+    except Exception as e:
+        items.put((_END_OF_ITEMS, e))
+
+
+class AdaptivePageSize(object):
+    """
+    MAXRECORDS of the GetRecords pages of one listing, adapted to the
+    responses: starting at ``size``, a page that came back fast grows the
+    next one, and a slow or large page shrinks it, at most by a factor of
+    two per page and always within ``minimum`` and ``maximum``. Without
+    bounds the size stays fixed.
+    """
+
+    def __init__(self, size, minimum=None, maximum=None):
+        self.minimum = size if minimum is None else minimum
+        self.maximum = size if maximum is None else maximum
+        self.size = min(max(size, self.minimum), self.maximum)
+
+    def page_done(self, start, returned, seconds, size_bytes):
+        """Choose the size of the next page from the one that was received."""
+        size = self.size
+        if returned:
+            fitting = [self.maximum, size * 2]
+            if seconds > 0:
+                fitting.append(int(returned * TARGET_PAGE_SECONDS / seconds))
+            if size_bytes > 0:
+                fitting.append(int(returned * MAX_PAGE_BYTES / size_bytes))
+            self.size = max(min(fitting), size // 2, self.minimum)
+        log.info(
+            "GetRecords page startPosition=%s maxRecords=%s: %s records, "
+            "%s bytes in %.1fs, next maxRecords=%s",
+            start,
+            size,
+            returned,
+            size_bytes,
+            seconds,
+            self.size,
+        )
+
+    def shrink(self):
+        """
+        Halve the size after a page timed out; the following pages do not
+        grow past it again. Returns False if it is already at the minimum,
+        so the page cannot be retried smaller.
+        """
+        if self.size <= self.minimum:
+            return False
+        size = self.size
+        self.size = max(size // 2, self.minimum)
+        self.maximum = self.size
+        log.warning(
+            "GetRecords page with maxRecords=%s timed out, retrying with %s",
+            size,
+            self.size,
+        )
+        return True
+
+
+class _StreamedPage(object):
+    """Progress of a streamed GetRecords response."""
+
+    def __init__(self):
+        self.counts = None
+        self.returned = 0
+        self.size_bytes = 0
+
+
+def _as_page_size(maxrecords):
+    if isinstance(maxrecords, AdaptivePageSize):
+        return maxrecords
+    return AdaptivePageSize(maxrecords)
+
+
+def _endpoint_cache_path(cache_dir, url):
+    return os.path.join(
+        cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".url"
+    )
+
+
+def _read_cached_endpoint(cache_path, ttl):
+    """Return the cached GetRecordById URL, or None if missing or stale."""
+    try:
+        if time.time() - os.path.getmtime(cache_path) >= ttl:
+            return None
+        with open(cache_path) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_cached_endpoint(cache_path, endpoint):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, "w") as f:
+            f.write(endpoint)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        log.warning(f"Could not cache the GetRecordById URL in {cache_path}: {e}")
+
+
+def _get_record_by_id_endpoint(csw):
+    """Return the GET URL the capabilities of ``csw`` give for GetRecordById."""
+    try:
+        methods = csw.get_operation_by_name("GetRecordById").methods
+    except KeyError:
+        return None
+    get_urls = [m.get("url") for m in methods if m.get("type", "").lower() == "get"]
+    return get_urls[0] if get_urls else None
+
+
 class GeocatCswClientBase(object):
     """
     Shared OWSLib ``CatalogueServiceWeb`` wrapper for CSW listing.
 
     Subclasses set ``schema`` for ``get_record_by_id`` output (CHE vs DCAT-AP-CH).
+    Explicit HTTP requests go through one pooled keep-alive ``requests.Session``
+    per client that retries idempotent requests. The requests in flight to
+    the host of ``url`` are limited by its limiter in ``host_limiters``,
+    which by default is shared by all clients of the process. Clients that
+    gather at the same time can also share one ``session``.
+
+    With ``hedge_percentile``, GetRecordById requests and GetRecords pages
+    that are not streamed are hedged with an ``http_utils.RequestHedger``.
+
+    The OWSLib client is only created when it is first used. The
+    GetRecordById URL from its GetCapabilities response is cached in
+    ``capabilities_cache_dir`` for ``capabilities_cache_ttl`` seconds (0
+    disables the cache); meanwhile the client is built with ``skip_caps``
+    on that URL.
     """
 
-    def __init__(self, url):
-        self.csw = CatalogueServiceWeb(url)
+    def __init__(
+        self,
+        url,
+        timeout=http_utils.DEFAULT_TIMEOUT,
+        capabilities_cache_ttl=CAPABILITIES_CACHE_TTL,
+        capabilities_cache_dir=CAPABILITIES_CACHE_DIR,
+        host_limiters=http_utils.HOST_LIMITERS,
+        hedge_percentile=None,
+        hedge_max_extra_load=http_utils.HEDGE_MAX_EXTRA_LOAD,
+        session=None,
+    ):
+        self.url = clean_ows_url(url)
+        self.timeout = timeout
+        if session is None:
+            session = http_utils.build_session(host_limiters=host_limiters)
+        self.session = session
+        self.limiter = None
+        if host_limiters is not None:
+            self.limiter = host_limiters.get(self.url)
+        self.hedger = None
+        if hedge_percentile:
+            self.hedger = http_utils.RequestHedger(
+                hedge_percentile, hedge_max_extra_load
+            )
+        self.capabilities_cache_ttl = capabilities_cache_ttl
+        self.capabilities_cache_dir = capabilities_cache_dir
+        self._csw = None
+        self._csw_lock = threading.Lock()
+
+    @property
+    def csw(self):
+        with self._csw_lock:
+            if self._csw is None:
+                self._csw = self._build_csw()
+        return self._csw
+
+    def _build_csw(self):
+        if self.capabilities_cache_ttl <= 0:
+            return CatalogueServiceWeb(self.url, timeout=self.timeout)
+
+        cache_path = _endpoint_cache_path(self.capabilities_cache_dir, self.url)
+        endpoint = _read_cached_endpoint(cache_path, self.capabilities_cache_ttl)
+        if endpoint is not None:
+            log.debug(f"Using cached GetRecordById URL {endpoint} for {self.url}")
+            return CatalogueServiceWeb(endpoint, timeout=self.timeout, skip_caps=True)
+
+        csw = CatalogueServiceWeb(self.url, timeout=self.timeout)
+        endpoint = _get_record_by_id_endpoint(csw)
+        if csw.exceptionreport is None and endpoint:
+            _write_cached_endpoint(cache_path, endpoint)
+        return csw
+
+    def get_connection_stats(self):
+        return http_utils.get_connection_stats(self.session)
+
+    def get_hedge_stats(self):
+        """Return the HedgeStats of the client, or None without hedging."""
+        if self.hedger is None:
+            return None
+        return self.hedger.get_stats()
+
+    def _hedge(self, kind, fn, *args):
+        if self.hedger is None:
+            return fn(*args)
+        return self.hedger.call(kind, fn, *args)
+
+    def _get(self, params):
+        """Send a GET request with ``params`` to the CSW, hedged if enabled."""
+        return self._hedge(params["REQUEST"], self._get_response, params)
 
-    def get_geocat_id_from_csw(self, cql=None, cql_query=None, cql_search_term=None):
+    def _get_response(self, params):
+        resp = self.session.get(self.url, params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp
+
+    def get_geocat_id_from_csw(
+        self,
+        cql=None,
+        cql_query=None,
+        cql_search_term=None,
+        maxrecords=ID_LISTING_PAGE_SIZE,
+        modified_since=None,
+    ):
         """
-        List dataset identifiers via OWSLib ``getrecords2`` (summary records).
+        List dataset identifiers with GetRecords for brief ``csw:Record``
+        elements, parsing only their ``dc:identifier`` while the response is
+        downloaded. Yields the identifiers in catalogue order and raises
+        CswNotFoundError if there are none, unless only the records changed
+        since ``modified_since`` are listed. ``maxrecords`` is a page size or
+        an AdaptivePageSize.
         """
-        nextrecord = 1
-        record_ids = []
-        csw_args = {"maxrecords": 50, "startposition": nextrecord}
+        records = self._stream_records(
+            CSW_RECORD_SCHEMA,
+            _CSW_RECORD_TAGS,
+            cql=cql,
+            cql_query=cql_query,
+            cql_search_term=cql_search_term,
+            maxrecords=maxrecords,
+            element_set_name="brief",
+            modified_since=modified_since,
+        )
+        seen_ids = set()
+        for record_elem in records:
+            id_elem = record_elem.find(_DC_IDENTIFIER_TAG)
+            if id_elem is None or not id_elem.text:
+                log.warning("csw:Record without dc:identifier, skipping")
+                continue
+            geocat_id = id_elem.text.strip()
+            if geocat_id in seen_ids:
+                continue
+            seen_ids.add(geocat_id)
+            yield geocat_id
+
+        if not seen_ids and modified_since is None:
+            raise CswNotFoundError(
+                f"No dataset found for url {self.url} with arguments "
+                f"{_build_cql_params(cql, cql_query, cql_search_term)}"
+            )
 
-        if cql_query and cql_search_term:
-            csw_args["constraints"] = [PropertyIsEqualTo(cql_query, cql_search_term)]
-        elif cql:
-            csw_args["cql"] = cql
-        else:
-            csw_args["constraints"] = [
-                PropertyIsEqualTo(CQL_QUERY_DEFAULT, CQL_SEARCH_TERM_DEFAULT)
-            ]
-
-        while nextrecord is not None:
-            csw_args["startposition"] = nextrecord
-            self.csw.getrecords2(**csw_args)
-            if self.csw.response is None or self.csw.results["matches"] == 0:
-                raise CswNotFoundError(
-                    f"No dataset found for url {self.csw.url} with arguments "
-                    f"{csw_args}"
-                )
-            if self.csw.results["returned"] > 0:
-                if 0 < self.csw.results["nextrecord"] <= self.csw.results["matches"]:
-                    nextrecord = self.csw.results["nextrecord"]
-                else:
-                    nextrecord = None
-                for record_id in list(self.csw.records.keys()):
-                    record_ids.append(record_id)
-        return record_ids
+    def _get_records_pages(
+        self,
+        output_schema,
+        cql=None,
+        cql_query=None,
+        cql_search_term=None,
+        maxrecords=DEFAULT_PAGE_SIZE,
+        prefetch_pages=0,
+        fanout_concurrency=0,
+        modified_since=None,
+        start_position=1,
+    ):
+        """
+        Page through GetRecords with full records in ``output_schema``,
+        starting at ``start_position``. Yields the parsed root element of
+        every response page in start position order.
+
+        With ``prefetch_pages`` > 0 up to that many pages are fetched in the
+        background while the caller processes the current page. With
+        ``fanout_concurrency`` > 1 the remaining pages are requested
+        ``fanout_concurrency`` at a time once the first page has told how
+        many records match.
+
+        ``maxrecords`` is a page size or an AdaptivePageSize that is updated
+        after every page and shrunk to retry a page that timed out. Fanned
+        out pages all keep the size of the first one.
+        """
+        page_size = _as_page_size(maxrecords)
+        params = _build_getrecords_params(
+            output_schema,
+            cql,
+            cql_query,
+            cql_search_term,
+            page_size.size,
+            modified_since=modified_since,
+        )
+        if fanout_concurrency > 1:
+            return self._fan_out_records_pages(
+                params, fanout_concurrency, page_size, start=start_position
+            )
+        pages = self._fetch_records_pages(params, page_size, start=start_position)
+        if prefetch_pages > 0:
+            pages = _read_ahead(pages, prefetch_pages)
+        return pages
+
+    def _stream_records(
+        self,
+        output_schema,
+        record_tags,
+        cql=None,
+        cql_query=None,
+        cql_search_term=None,
+        maxrecords=DEFAULT_PAGE_SIZE,
+        element_set_name="full",
+        modified_since=None,
+        start_position=1,
+        on_page=None,
+    ):
+        """
+        Page through GetRecords like _get_records_pages, but parse each
+        response incrementally while it is downloaded and yield the
+        elements with a tag in ``record_tags`` one by one. A record is cleared, together
+        with the records before it, once the caller asks for the next one,
+        so memory use does not grow with the page size. ``on_page`` is
+        called like in _records_from_pages and ``maxrecords`` is used like
+        there.
+        """
+        page_size = _as_page_size(maxrecords)
+        params = _build_getrecords_params(
+            output_schema,
+            cql,
+            cql_query,
+            cql_search_term,
+            page_size.size,
+            element_set_name=element_set_name,
+            modified_since=modified_since,
+        )
+        start = start_position
+        while True:
+            counts = yield from self._stream_records_page(
+                params, start, record_tags, page_size
+            )
+            next_record = _next_record_from_counts(counts, start)
+            if on_page is not None:
+                on_page(next_record)
+            if next_record is None:
+                break
+            start = next_record
+
+    def _stream_records_page(self, params, start, record_tags, page_size):
+        """
+        Yield the record elements of the page at ``start``; return its
+        SearchResultsCounts. If the response times out, the page size is
+        shrunk and the rest of the page is requested again.
+        """
+        position = start
+        while True:
+            page = _StreamedPage()
+            # the time the caller spends between records is not the server's
+            started = time.monotonic()
+            try:
+                for elem in self._stream_response_records(
+                    dict(params, MAXRECORDS=str(page_size.size)),
+                    position,
+                    record_tags,
+                    page,
+                ):
+                    paused = time.monotonic()
+                    yield elem
+                    started += time.monotonic() - paused
+            except requests.RequestException as exc:
+                if not (http_utils.is_timeout(exc) and page_size.shrink()):
+                    raise
+                position += page.returned
+                continue
+            page_size.page_done(
+                position, page.returned, time.monotonic() - started, page.size_bytes
+            )
+            return page.counts
+
+    def _stream_response_records(self, params, start, record_tags, page):
+        """Yield the record elements of one response, counting them in ``page``."""
+        params = dict(params, STARTPOSITION=str(start))
+        log.debug(
+            "GetRecords stream outputSchema=%s startPosition=%s url=%s",
+            params["OUTPUTSCHEMA"],
+            start,
+            self.url,
+        )
+        parser = etree.XMLPullParser(
+            events=("start", "end"), tag=[_CSW_SEARCH_RESULTS_TAG, *record_tags]
+        )
+        with self.session.get(
+            self.url, params=params, timeout=self.timeout, stream=True
+        ) as resp:
+            resp.raise_for_status()
+            try:
+                for chunk in resp.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    page.size_bytes += len(chunk)
+                    parser.feed(chunk)
+                    for event, elem in parser.read_events():
+                        if elem.tag == _CSW_SEARCH_RESULTS_TAG:
+                            if event == "start":
+                                page.counts = _counts_from_search_results(elem)
+                        elif event == "end":
+                            page.returned += 1
+                            yield elem
+                            _clear_element(elem)
+                parser.close()
+            except etree.XMLSyntaxError as exc:
+                raise CswNotFoundError(f"Could not parse GetRecords response: {exc}")
+
+    def _fetch_records_page(self, params, start, page_size=None):
+        """
+        Fetch and parse the page at ``start``. With ``page_size`` the page
+        is requested with its size, which is then adapted to the response.
+        """
+        if page_size is not None:
+            params = dict(params, MAXRECORDS=str(page_size.size))
+        params = dict(params, STARTPOSITION=str(start))
+        log.debug(
+            "GetRecords batch outputSchema=%s startPosition=%s url=%s",
+            params["OUTPUTSCHEMA"],
+            start,
+            self.url,
+        )
+        started = time.monotonic()
+        resp = self._get(params)
+
+        try:
+            root = etree.fromstring(resp.content)
+        except etree.XMLSyntaxError as exc:
+            raise CswNotFoundError(f"Could not parse GetRecords response: {exc}")
+        if page_size is not None:
+            counts = _search_results_counts(root)
+            page_size.page_done(
+                start,
+                counts.returned if counts is not None else 0,
+                time.monotonic() - started,
+                len(resp.content),
+            )
+        return root
+
+    def _fetch_records_pages(self, params, page_size, start=1):
+        while True:
+            try:
+                root = self._fetch_records_page(params, start, page_size)
+            except requests.RequestException as exc:
+                if http_utils.is_timeout(exc) and page_size.shrink():
+                    continue
+                raise
+            next_record = _next_record_from_results(root, start)
+            yield root
+            if next_record is None:
+                break
+            start = next_record
+
+    def _fan_out_records_pages(self, params, concurrency, page_size, start=1):
+        """
+        Fetch the page at ``start``, then the pages at all remaining start
+        positions with up to ``concurrency`` requests in flight. If a page
+        shows that the catalogue changed while paging, the pages from there
+        on are fetched sequentially instead, with the adaptive ``page_size``.
+        """
+        root = self._fetch_records_page(params, start)
+        next_record = _next_record_from_results(root, start)
+        yield root
+        if next_record is None:
+            return
+
+        matched = _search_results_counts(root).matched
+        step = next_record - start
+        sequential_start = None
+        with ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="geocat-fanout"
+        ) as executor:
+            # submitted lazily, so at most `concurrency` pages are in flight
+            futures = (
+                (start, executor.submit(self._fetch_records_page, params, start))
+                for start in range(next_record, matched + 1, step)
+            )
+            pending = deque(itertools.islice(futures, concurrency))
+            try:
+                while pending:
+                    start, future = pending.popleft()
+                    root = future.result()
+                    if not _is_expected_page(root, start, matched, step):
+                        log.warning(
+                            "GetRecords results changed while paging at "
+                            "startPosition=%s, continuing sequentially",
+                            start,
+                        )
+                        sequential_start = start
+                        break
+                    yield root
+                    pending.extend(itertools.islice(futures, 1))
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+        if sequential_start is not None:
+            yield from self._fetch_records_pages(
+                params, page_size, start=sequential_start
+            )
 
 
 class GeocatCatalogueServiceWeb(GeocatCswClientBase):
@@ -122,18 +763,118 @@ class GeocatCatalogueServiceWeb(GeocatCswClientBase):
     ``csw_mapping.GeoMetadataMapping``.
     """
 
-    def __init__(self, url):
-        super().__init__(url)
+    def __init__(self, url, **kwargs):
+        super().__init__(url, **kwargs)
         self.schema = CHE_SCHEMA
+        self._thread_local = threading.local()
+
+    def _get_thread_csw(self):
+        """
+        OWSLib keeps the request and response of the last call on the
+        ``CatalogueServiceWeb`` object, so every thread gets its own shallow
+        copy, sharing the capabilities that were parsed once.
+        """
+        csw = getattr(self._thread_local, "csw", None)
+        if csw is None:
+            csw = copy.copy(self.csw)
+            self._thread_local.csw = csw
+        return csw
 
     def get_record_by_id(self, geocat_id):
-        self.csw.getrecordbyid(id=[geocat_id], outputschema=self.schema)
-        csw_record_as_string = self.csw.response
+        return self._hedge("GetRecordById", self._get_record_by_id, geocat_id)
+
+    def _get_record_by_id(self, geocat_id):
+        csw = self._get_thread_csw()
+        # OWSLib does not use the session, so its requests are limited here
+        if self.limiter is None:
+            csw.getrecordbyid(id=[geocat_id], outputschema=self.schema)
+        else:
+            with self.limiter.request():
+                csw.getrecordbyid(id=[geocat_id], outputschema=self.schema)
+        csw_record_as_string = csw.response
         if csw_record_as_string:
             return csw_record_as_string
         else:
             return None
 
+    def get_records_by_id(self, geocat_ids, fetch_concurrency=1):
+        """
+        Fetch the records for ``geocat_ids`` with GetRecordById, using up to
+        ``fetch_concurrency`` requests at a time. Yields
+        (geocat_id, csw_record_as_string, error) tuples in the order of
+        ``geocat_ids``; error is the exception raised for that record, or None.
+        """
+        if fetch_concurrency <= 1:
+            for geocat_id in geocat_ids:
+                yield self._fetch_record(geocat_id)
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=fetch_concurrency, thread_name_prefix="geocat-fetch"
+        ) as executor:
+            yield from executor.map(self._fetch_record, geocat_ids)
+
+    def _fetch_record(self, geocat_id):
+        try:
+            return geocat_id, self.get_record_by_id(geocat_id), None
+        except Exception as e:
+            return geocat_id, None, e
+
+    def get_records_che(
+        self,
+        cql=None,
+        cql_query=None,
+        cql_search_term=None,
+        maxrecords=DEFAULT_PAGE_SIZE,
+        prefetch_pages=0,
+        fanout_concurrency=0,
+        modified_since=None,
+        start_position=1,
+        seen_ids=None,
+        on_page=None,
+    ):
+        """
+        Fetch all matching records in batch using GetRecords with the CHE
+        outputschema. Yields (geocat_id, record_element) tuples, where
+        record_element is the ``gmd:MD_Metadata`` / ``che:CHE_MD_Metadata``
+        element of a single record. With ``modified_since`` only the records
+        changed since then are fetched.
+
+        To resume an earlier listing, pass the ``start_position`` of its next
+        page and the ``seen_ids`` set of the identifiers it yielded; the set
+        is updated with every yielded identifier. ``on_page`` is called with
+        the next start position once all records of a page were consumed.
+        """
+        if seen_ids is None:
+            seen_ids = set()
+        pages = self._get_records_pages(
+            self.schema,
+            cql=cql,
+            cql_query=cql_query,
+            cql_search_term=cql_search_term,
+            maxrecords=maxrecords,
+            prefetch_pages=prefetch_pages,
+            fanout_concurrency=fanout_concurrency,
+            modified_since=modified_since,
+            start_position=start_position,
+        )
+        for record_elem in _records_from_pages(
+            pages, start_position, _get_che_records, on_page
+        ):
+            id_elem = record_elem.find(_GMD_FILE_IDENTIFIER_PATH)
+            if id_elem is None or not id_elem.text:
+                log.warning("CHE record without gmd:fileIdentifier, skipping")
+                continue
+            geocat_id = id_elem.text.strip()
+            if geocat_id in seen_ids:
+                log.warning(
+                    "Duplicate CHE record id=%s in GetRecords batch, skipping",
+                    geocat_id,
+                )
+                continue
+            seen_ids.add(geocat_id)
+            yield geocat_id, record_elem
+
 
 class GeocatDcatCatalogueServiceWeb(GeocatCswClientBase):
     """
@@ -143,8 +884,8 @@ class GeocatDcatCatalogueServiceWeb(GeocatCswClientBase):
     including batch GetRecords to avoid one request per record.
     """
 
-    def __init__(self, url):
-        super().__init__(url)
+    def __init__(self, url, **kwargs):
+        super().__init__(url, **kwargs)
         self.schema = DCAT_AP_CH_SCHEMA
 
     def get_record_by_id(self, geocat_id):
@@ -156,9 +897,7 @@ class GeocatDcatCatalogueServiceWeb(GeocatCswClientBase):
             "ELEMENTSETNAME": "full",
             "id": geocat_id,
         }
-        resp = requests.get(self.csw.url, params=params, timeout=60)
-        resp.raise_for_status()
-        body = resp.text
+        body = self._get(params).text
         if not body:
             return None
         if "ExceptionReport" in body or "ows:Exception" in body:
@@ -168,62 +907,75 @@ class GeocatDcatCatalogueServiceWeb(GeocatCswClientBase):
         return body
 
     def get_records_dcat(
-        self, cql=None, cql_query=None, cql_search_term=None, maxrecords=50
+        self,
+        cql=None,
+        cql_query=None,
+        cql_search_term=None,
+        maxrecords=DEFAULT_PAGE_SIZE,
+        prefetch_pages=0,
+        fanout_concurrency=0,
+        stream=False,
+        modified_since=None,
+        start_position=1,
+        seen_ids=None,
+        on_page=None,
     ):
         """
         Fetch all matching records in batch using GetRecords with the DCAT-AP-CH
-        outputschema. Yields (geocat_id, wrapped_xml_string) tuples.
+        outputschema. Yields (geocat_id, dataset_element) tuples for
+        ``dcat_mapping.DcatMetadataMapping.get_metadata_from_element``. With
+        ``modified_since`` only the records changed since then are fetched.
+        ``start_position``, ``seen_ids`` and ``on_page`` resume an earlier
+        listing like in ``GeocatCatalogueServiceWeb.get_records_che``.
+
+        With ``stream`` the responses are parsed incrementally with bounded
+        memory; prefetch_pages and fanout_concurrency are then not used, and
+        each dataset_element is cleared as soon as the next one is requested.
         """
-        base_url = self.csw.url
-        params = {
-            "SERVICE": "CSW",
-            "VERSION": "2.0.2",
-            "REQUEST": "GetRecords",
-            "OUTPUTSCHEMA": DCAT_AP_CH_SCHEMA,
-            "TYPENAMES": "csw:Record",
-            "ELEMENTSETNAME": "full",
-            "RESULTTYPE": "results",
-            "MAXRECORDS": str(maxrecords),
-        }
-        params.update(_build_cql_params(cql, cql_query, cql_search_term))
-
-        start = 1
-        seen_ids = set()
-        while True:
-            params["STARTPOSITION"] = str(start)
-            log.debug("GetRecords DCAT batch startPosition=%s url=%s", start, base_url)
-            resp = requests.get(base_url, params=params, timeout=60)
-            resp.raise_for_status()
-
-            try:
-                root = etree.fromstring(resp.content)
-            except etree.XMLSyntaxError as exc:
-                raise CswNotFoundError(f"Could not parse GetRecords response: {exc}")
-
-            datasets = list(root.iter(_DCAT_DATASET_TAG))
-            if not datasets:
-                break
-
-            for dataset_elem in datasets:
-                id_elem = dataset_elem.find(_DCT_IDENTIFIER_TAG)
-                if id_elem is None or not id_elem.text:
-                    log.warning("dcat:Dataset without dct:identifier, skipping")
-                    continue
-                geocat_id = id_elem.text.strip()
-                if geocat_id in seen_ids:
-                    log.warning(
-                        "Duplicate dcat:Dataset id=%s in GetRecords batch, skipping",
-                        geocat_id,
-                    )
-                    continue
-                seen_ids.add(geocat_id)
-                dataset_xml = etree.tostring(dataset_elem, encoding="unicode")
-                yield geocat_id, _GETRECORDBYID_ENVELOPE.format(dataset_xml=dataset_xml)
+        if stream:
+            datasets = self._stream_records(
+                DCAT_AP_CH_SCHEMA,
+                (_DCAT_DATASET_TAG,),
+                cql=cql,
+                cql_query=cql_query,
+                cql_search_term=cql_search_term,
+                maxrecords=maxrecords,
+                modified_since=modified_since,
+                start_position=start_position,
+                on_page=on_page,
+            )
+        else:
+            pages = self._get_records_pages(
+                DCAT_AP_CH_SCHEMA,
+                cql=cql,
+                cql_query=cql_query,
+                cql_search_term=cql_search_term,
+                maxrecords=maxrecords,
+                prefetch_pages=prefetch_pages,
+                fanout_concurrency=fanout_concurrency,
+                modified_since=modified_since,
+                start_position=start_position,
+            )
+            datasets = _records_from_pages(
+                pages, start_position, _get_dcat_datasets, on_page
+            )
 
-            next_record = _next_record_from_results(root, start)
-            if next_record is None:
-                break
-            start = next_record
+        if seen_ids is None:
+            seen_ids = set()
+        for dataset_elem in datasets:
+            id_elem = dataset_elem.find(_DCT_IDENTIFIER_TAG)
+            if id_elem is None or not id_elem.text:
+                log.warning("dcat:Dataset without dct:identifier, skipping")
+                continue
+            geocat_id = id_elem.text.strip()
+            if geocat_id in seen_ids:
+                log.warning(
+                    "Duplicate dcat:Dataset id=%s in GetRecords batch, skipping",
+                    geocat_id,
+                )
+                continue
+            seen_ids.add(geocat_id)
+            yield geocat_id, dataset_elem
 
 
 class CswNotFoundError(Exception):
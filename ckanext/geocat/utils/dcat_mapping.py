@@ -74,6 +74,7 @@ DCAT_NS = {
 XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
 RDF_RESOURCE_ATTR = f"{{{DCAT_NS['rdf']}}}resource"
 RDF_ABOUT_ATTR = f"{{{DCAT_NS['rdf']}}}about"
+DCAT_DATASET_TAG = f"{{{DCAT_NS['dcat']}}}Dataset"
 
 # Languages supported by opendata.swiss / CKAN
 CKAN_LANGS = ["de", "fr", "it", "en"]
@@ -177,8 +178,6 @@ class DcatMetadataMapping:
         Parse the raw XML string returned by ``GetRecordById`` (DCAT schema)
         and return a CKAN-compatible dataset dict.
         """
-        log.debug("Processing geocat_id %s", geocat_id)
-
         if isinstance(csw_record_as_string, str):
             csw_record_as_string = csw_record_as_string.encode("utf-8")
 
@@ -192,7 +191,20 @@ class DcatMetadataMapping:
             raise MetadataFormatError(
                 f"No dcat:Dataset element found for geocat_id {geocat_id}"
             )
-        node = dataset_nodes[0]
+        return self.get_metadata_from_element(dataset_nodes[0], geocat_id)
+
+    def get_metadata_from_element(self, node, geocat_id):
+        """
+        Map an already parsed ``dcat:Dataset`` element, e.g. one taken from a
+        ``GetRecords`` page, and return a CKAN-compatible dataset dict.
+        """
+        if node.tag != DCAT_DATASET_TAG:
+            raise MetadataFormatError(
+                f"Expected a dcat:Dataset element for geocat_id {geocat_id}, "
+                f"got {node.tag}"
+            )
+
+        log.debug("Processing geocat_id %s", geocat_id)
 
         # --- dataset-level fields ---
         raw_identifier = self._text(node, "dct:identifier")
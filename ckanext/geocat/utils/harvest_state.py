@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from ckan import model
+
+log = logging.getLogger(__name__)
+
+STATE_KEY_PREFIX = "ckanext.geocat.harvest_state."
+CHECKPOINT_KEY_PREFIX = "ckanext.geocat.gather_checkpoint."
+CHECKPOINT_MAX_AGE = timedelta(days=1)
+# records changed while the previous gather was running, or stamped by a
+# server clock that runs behind ours, are harvested again
+MODIFIED_SINCE_OVERLAP = timedelta(hours=1)
+DATASET_INDEX_CACHE_DIR = os.path.join(
+    tempfile.gettempdir(), "ckanext-geocat-dataset-index"
+)
+DATASET_INDEX_MAX_AGE = timedelta(days=7)
+# packages changed while the index was built, or not yet committed to Solr
+# then, are read again by the next refresh
+DATASET_INDEX_OVERLAP = timedelta(minutes=10)
+
+
+def load_harvest_state(harvest_source_id):
+    """Return the persisted gather state of a harvest source, or {}."""
+    value = model.get_system_info(STATE_KEY_PREFIX + harvest_source_id)
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except ValueError:
+        log.warning(f"Ignoring invalid harvest state for source {harvest_source_id}")
+        return {}
+
+
+def save_harvest_state(harvest_source_id, state):
+    model.set_system_info(STATE_KEY_PREFIX + harvest_source_id, json.dumps(state))
+
+
+def get_modified_since(state, full_harvest_interval, now=None):
+    """
+    Return the UTC datetime from which an incremental gather harvests the
+    changed records, or None if a full gather is due: there is no successful
+    gather yet, or the last full one is ``full_harvest_interval`` old.
+    """
+    now = now or datetime.now(timezone.utc)
+    last_gather = _parse_timestamp(state.get("last_gather"))
+    last_full_gather = _parse_timestamp(state.get("last_full_gather"))
+    if last_gather is None or last_full_gather is None:
+        return None
+    if now - last_full_gather >= full_harvest_interval:
+        return None
+    return last_gather - MODIFIED_SINCE_OVERLAP
+
+
+def record_gather(state, gather_started, full):
+    """Return ``state`` updated for a successful gather from ``gather_started``."""
+    state = dict(state, last_gather=gather_started.isoformat())
+    if full:
+        state["last_full_gather"] = gather_started.isoformat()
+    return state
+
+
+def record_gather_duration(state, seconds):
+    """Return ``state`` updated with the duration of the last gather."""
+    return dict(state, last_gather_seconds=round(seconds, 1))
+
+
+def get_last_gather_seconds(state):
+    """Return the duration of the last gather in seconds, or None if unknown."""
+    return state.get("last_gather_seconds")
+
+
+def refresh_dataset_index(
+    harvest_source_id,
+    scope,
+    list_datasets,
+    list_package_ids,
+    now=None,
+    cache_dir=DATASET_INDEX_CACHE_DIR,
+):
+    """
+    Return the dict of identifier to dataset info of a harvest source that
+    is kept in a file in ``cache_dir`` between gathers. It is refreshed with
+    ``list_datasets(modified_since)``, which yields (identifier, info) tuples
+    of the datasets changed since then, where info is a (name,
+    belongs_to_harvester, package_id) sequence. Entries of packages that
+    ``list_package_ids()`` no longer returns are dropped, and so are the old
+    identifiers of changed packages. The index is rebuilt with
+    ``list_datasets(None)`` if there is none yet, or if it was built for
+    another ``scope`` or is DATASET_INDEX_MAX_AGE old.
+    """
+    now = now or datetime.now(timezone.utc)
+    path = os.path.join(cache_dir, f"{harvest_source_id}.json")
+    index = _read_json_file(path)
+    built = _parse_timestamp(index.get("built"))
+    if (
+        index.get("scope") == scope
+        and built is not None
+        and now - built < DATASET_INDEX_MAX_AGE
+    ):
+        changed = dict(list_datasets(built - DATASET_INDEX_OVERLAP))
+        package_ids = set(list_package_ids())
+        package_ids.difference_update(info[2] for info in changed.values())
+        indexed = index.get("datasets") or {}
+        datasets = {
+            identifier: info
+            for identifier, info in indexed.items()
+            if info[2] in package_ids
+        }
+        log.info(
+            f"Refreshed dataset index of source {harvest_source_id} with "
+            f"{len(changed)} changed datasets, dropped "
+            f"{len(indexed) - len(datasets)} changed or deleted ones"
+        )
+        datasets.update(changed)
+    else:
+        datasets = dict(list_datasets(None))
+    _write_json_file(
+        path, {"scope": scope, "built": now.isoformat(), "datasets": datasets}
+    )
+    return datasets
+
+
+def _read_json_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+    except ValueError:
+        log.warning(f"Ignoring invalid file {path}")
+        return {}
+
+
+def _write_json_file(path, value):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning(f"Could not write {path}: {e}")
+
+
+def _load_system_info_json(key):
+    value = model.get_system_info(key)
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except ValueError:
+        log.warning(f"Ignoring invalid system info {key}")
+        return {}
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+class _SeenIds(set):
+    """Set of identifiers that also lists the ones added since it was saved."""
+
+    def __init__(self, ids=()):
+        super().__init__(ids)
+        self.unsaved = []
+
+    def add(self, geocat_id):
+        if geocat_id not in self:
+            self.unsaved.append(geocat_id)
+        super().add(geocat_id)
+
+
+class GatherCheckpoint(object):
+    """
+    Pagination checkpoint of a batch gather, persisted after every
+    GetRecords page. A gather of the same source and query that starts
+    within CHECKPOINT_MAX_AGE resumes at the page where the previous one
+    stopped, instead of fetching and mapping all pages again.
+
+    Each page only writes the position of the next page and, under a key of
+    its own, the identifiers it added to ``seen_ids``, so the checkpoint
+    does not rewrite all identifiers seen so far after every page.
+    """
+
+    def __init__(self, harvest_source_id, query, gather_started):
+        self.key = CHECKPOINT_KEY_PREFIX + harvest_source_id
+        self.query = query
+        checkpoint = self._load(gather_started)
+        self.next_record = checkpoint.get("next_record", 1)
+        self.pages = checkpoint.get("pages", 0)
+        self.seen_ids = _SeenIds(self._load_seen_ids())
+        self.gather_started = (
+            _parse_timestamp(checkpoint.get("gather_started")) or gather_started
+        )
+
+    @property
+    def resumed(self):
+        return self.next_record > 1
+
+    def _page_key(self, page):
+        return f"{self.key}.{page}"
+
+    def _load(self, gather_started):
+        checkpoint = _load_system_info_json(self.key)
+        if not checkpoint:
+            return {}
+        saved = _parse_timestamp(checkpoint.get("saved"))
+        if (
+            checkpoint.get("query") != self.query
+            or checkpoint.get("next_record") is None
+            or saved is None
+            or gather_started - saved >= CHECKPOINT_MAX_AGE
+        ):
+            self._delete(checkpoint.get("pages", 0))
+            return {}
+        return checkpoint
+
+    def _load_seen_ids(self):
+        seen_ids = set()
+        for page in range(self.pages):
+            seen_ids.update(_load_system_info_json(self._page_key(page)) or [])
+        return seen_ids
+
+    def page_done(self, next_record):
+        """
+        Persist the checkpoint once all records of a page were gathered.
+        ``next_record`` is the start position of the next page, or None
+        after the last one.
+        """
+        self.next_record = next_record
+        if self.seen_ids.unsaved:
+            model.set_system_info(
+                self._page_key(self.pages), json.dumps(self.seen_ids.unsaved)
+            )
+            self.seen_ids.unsaved = []
+            self.pages += 1
+        checkpoint = {
+            "query": self.query,
+            "next_record": next_record,
+            "pages": self.pages,
+            "gather_started": self.gather_started.isoformat(),
+            "saved": datetime.now(timezone.utc).isoformat(),
+        }
+        model.set_system_info(self.key, json.dumps(checkpoint))
+
+    def clear(self):
+        """Forget the checkpoint after a gather that went through all pages."""
+        self._delete(self.pages)
+
+    def _delete(self, pages):
+        for page in range(pages):
+            model.delete_system_info(self._page_key(page))
+        model.delete_system_info(self.key)
@@ -0,0 +1,500 @@
+import functools
+import logging
+import math
+import threading
+import time
+import weakref
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import (
+    ConnectTimeoutError,
+    MaxRetryError,
+    NewConnectionError,
+    ReadTimeoutError,
+)
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 60
+POOL_MAXSIZE = 16
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+MAX_RETRY_AFTER = 120
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+THROTTLE_STATUS_CODES = (429, 503)
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = POOL_MAXSIZE
+# a response slower than both of these does not raise the concurrency limit
+SLOW_LATENCY_FACTOR = 2
+SLOW_LATENCY_FLOOR = 1.0
+LATENCY_SMOOTHING = 0.2
+HEDGE_MAX_EXTRA_LOAD = 0.1
+HEDGE_LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_WORKERS = 2 * MAX_CONCURRENCY
+
+ConnectionStats = namedtuple(
+    "ConnectionStats", ["requests", "new_connections", "reused_connections"]
+)
+HedgeStats = namedtuple("HedgeStats", ["requests", "hedged", "hedge_wins"])
+
+
+class _CappedRetry(Retry):
+    """Retry that honours Retry-After, but never sleeps longer than
+    MAX_RETRY_AFTER seconds for a single attempt."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER)
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Limit of the requests in flight to one host, adapted with AIMD: every
+    healthy response raises it by 1/limit, so by about one per round of
+    requests, and a throttling response (429, 503) or a timeout halves it.
+    Requests sent before the last decrease do not decrease it again, so a
+    burst of errors only halves it once. Slow responses and other errors
+    keep the limit as it is.
+    """
+
+    def __init__(
+        self, name, initial=INITIAL_CONCURRENCY, minimum=1, maximum=MAX_CONCURRENCY
+    ):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.latency = None
+        self._epoch = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot and return the token to release it with."""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            return self._epoch, time.monotonic()
+
+    def release(self, token, throttled=False, failed=False):
+        """Free the slot of ``token`` and adapt the limit to the outcome."""
+        epoch, started = token
+        latency = time.monotonic() - started
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self._decrease(epoch)
+            elif not failed:
+                self._increase(latency)
+            self._cond.notify_all()
+
+    @contextmanager
+    def request(self):
+        """Hold a slot for a request that raises on errors."""
+        token = self.acquire()
+        try:
+            yield
+        except Exception as exc:
+            self.release(token, throttled=is_throttling_error(exc), failed=True)
+            raise
+        self.release(token)
+
+    def _increase(self, latency):
+        slow = self.latency is not None and latency > max(
+            SLOW_LATENCY_FACTOR * self.latency, SLOW_LATENCY_FLOOR
+        )
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        if not slow:
+            self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+    def _decrease(self, epoch):
+        if epoch != self._epoch:
+            return
+        self._epoch += 1
+        limit = max(self.limit / 2, self.minimum)
+        log.warning(
+            "Throttled by %s, concurrency limit %s -> %s",
+            self.name,
+            int(self.limit),
+            int(limit),
+        )
+        self.limit = limit
+
+
+class HostConcurrencyLimiters(object):
+    """
+    One AdaptiveConcurrencyLimiter per host, shared by all sessions and
+    clients of the process that use this registry.
+    """
+
+    def __init__(self, **limiter_kwargs):
+        self.limiter_kwargs = limiter_kwargs
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = AdaptiveConcurrencyLimiter(host, **self.limiter_kwargs)
+                self._limiters[host] = limiter
+            return limiter
+
+
+HOST_LIMITERS = HostConcurrencyLimiters()
+
+
+class _LimitedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that sends every attempt of a request within the limit of its
+    host. The retries are made here instead of in urllib3, so that a slot is
+    only held while an attempt is in flight and not while waiting for the
+    backoff or a Retry-After. The slot of an attempt is held until its body
+    has been read or the response is closed, so that streamed responses
+    count while they are downloaded.
+    """
+
+    def __init__(self, host_limiters, retry, **kwargs):
+        self.host_limiters = host_limiters
+        self.retry = retry
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        limiter = self.host_limiters.get(request.url)
+        call = getattr(_hedged_calls, "current", None)
+        retries = self.retry
+        while True:
+            token = limiter.acquire()
+            try:
+                resp = super().send(request, **kwargs)
+            except requests.RequestException as exc:
+                limiter.release(token, throttled=is_throttling_error(exc), failed=True)
+                if call is not None and call.abandoned.is_set():
+                    raise
+                retries = _increment_on_error(retries, request, exc)
+                retries.sleep()
+                continue
+            _release_with_response(
+                resp,
+                functools.partial(
+                    _finish_attempt, limiter, token, resp.status_code, call
+                ),
+            )
+            if (call is not None and call.abandoned.is_set()) or not retries.is_retry(
+                request.method, resp.status_code, "Retry-After" in resp.headers
+            ):
+                return resp
+            try:
+                retries = retries.increment(
+                    request.method, request.url, response=resp.raw
+                )
+            except MaxRetryError:
+                return resp
+            try:
+                # read the body, so that the connection is kept alive for the retry
+                resp.content
+            except requests.RequestException:
+                pass
+            finally:
+                resp.close()
+            retries.sleep(resp.raw)
+
+
+def _finish_attempt(limiter, token, status_code, call):
+    """
+    Release the slot of an attempt that got a response with ``status_code``
+    and, for a call of a RequestHedger, record the latency of the attempt.
+    The response of an abandoned hedged call is dropped, so only a
+    throttling status adapts the limit.
+    """
+    throttled = status_code in THROTTLE_STATUS_CODES
+    failed = status_code >= 500
+    if call is not None:
+        if call.abandoned.is_set():
+            failed = True
+        elif not failed and not throttled:
+            _, started = token
+            call.latencies.append(time.monotonic() - started)
+    limiter.release(token, throttled=throttled, failed=failed)
+
+
+def _release_with_response(resp, release):
+    """
+    Call ``release`` once, when urllib3 returns the connection of ``resp`` to
+    the pool: after its body was read or when it is closed. A response that
+    is dropped without either releases when it is garbage collected.
+    """
+    raw = resp.raw
+    release_conn = raw.release_conn
+    once = threading.Lock()
+
+    def release_once():
+        if once.acquire(blocking=False):
+            release()
+
+    def release_slot_and_conn():
+        release_once()
+        release_conn()
+
+    raw.release_conn = release_slot_and_conn
+    weakref.finalize(resp, release_once)
+
+
+def _increment_on_error(retries, request, exc):
+    """
+    Return ``retries`` incremented for a failed attempt, or raise the error
+    of the request as requests does once they are exhausted.
+    """
+    error = exc.args[0] if exc.args else None
+    if isinstance(error, MaxRetryError):
+        error = error.reason
+    try:
+        return retries.increment(request.method, request.url, error=error)
+    except MaxRetryError as e:
+        if isinstance(e.reason, ConnectTimeoutError) and not isinstance(
+            e.reason, NewConnectionError
+        ):
+            raise requests.ConnectTimeout(e, request=request)
+        raise requests.ConnectionError(e, request=request)
+    except Exception:
+        # not retried, e.g. a read error of a method that is not idempotent
+        raise exc
+
+
+def build_session(
+    pool_maxsize=POOL_MAXSIZE,
+    backoff_factor=BACKOFF_FACTOR,
+    host_limiters=HOST_LIMITERS,
+):
+    """
+    Return a ``requests.Session`` with a keep-alive connection pool that
+    retries idempotent requests with exponential backoff on connection
+    errors and on the status codes in RETRY_STATUS_CODES. The requests in
+    flight to a host are limited by its limiter in ``host_limiters``, unless
+    that is None.
+    """
+    retry = _CappedRetry(
+        total=MAX_RETRIES,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    if host_limiters is None:
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+    else:
+        adapter = _LimitedHTTPAdapter(host_limiters, retry, pool_maxsize=pool_maxsize)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_connection_stats(session):
+    """
+    Count the requests sent through the connection pools of ``session`` and
+    how many of them opened a new connection instead of reusing a kept-alive
+    one. Retries count as requests of their own.
+    """
+    requests_sent = 0
+    new_connections = 0
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            new_connections += pool.num_connections
+    return ConnectionStats(
+        requests=requests_sent,
+        new_connections=new_connections,
+        reused_connections=max(requests_sent - new_connections, 0),
+    )
+
+
+def is_timeout(exc):
+    """
+    Tell whether a requests exception was caused by a timeout. After the
+    retries are used up, or while a streamed body is read, requests raises a
+    ``ConnectionError`` that wraps the urllib3 timeout instead of a
+    ``Timeout``.
+    """
+    if isinstance(exc, requests.Timeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    return _is_timeout_error(getattr(reason, "reason", reason))
+
+
+def is_throttling_error(exc):
+    """Tell whether an exception shows that the server is overloaded."""
+    if isinstance(exc, requests.HTTPError):
+        resp = exc.response
+        return resp is not None and resp.status_code in THROTTLE_STATUS_CODES
+    return isinstance(exc, requests.RequestException) and is_timeout(exc)
+
+
+def _is_timeout_error(error):
+    # urllib3 derives NewConnectionError, e.g. a refused connection, from
+    # ConnectTimeoutError
+    if isinstance(error, NewConnectionError):
+        return False
+    return isinstance(error, (ConnectTimeoutError, ReadTimeoutError))
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+# the _HedgedCall the current thread runs, read by _LimitedHTTPAdapter
+_hedged_calls = threading.local()
+
+
+class _HedgedCall(object):
+    """
+    One run of a request by a RequestHedger: the latencies of its attempts,
+    and whether its result is no longer needed because the other request
+    answered first. An abandoned call sends no more retries.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.abandoned = threading.Event()
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="geocat-hedge"
+            )
+        return _hedge_executor
+
+
+class RequestHedger(object):
+    """
+    Sends a duplicate of a request that has not answered within the
+    ``percentile`` of the recent latencies of its kind, and uses whichever
+    answers first. At most ``max_extra_load`` duplicates are sent per
+    request, and none before HEDGE_MIN_SAMPLES latencies of the kind are
+    known; until then requests are sent from the calling thread. Hedged
+    requests run in a thread pool shared by all hedgers of the process.
+
+    Requests sent through a session of ``build_session`` with host limiters
+    are timed per attempt, so that the backoff before a retry does not count
+    as latency. The request that loses sends no more retries, its response
+    is closed once it arrives and does not raise the concurrency limit.
+    """
+
+    def __init__(self, percentile, max_extra_load=HEDGE_MAX_EXTRA_LOAD):
+        self.percentile = percentile
+        self.max_extra_load = max_extra_load
+        self._latencies = {}
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def call(self, kind, fn, *args):
+        """Return ``fn(*args)``, hedged against the latencies of ``kind``."""
+        delay = self._get_hedge_delay(kind)
+        if delay is None:
+            return self._timed(kind, _HedgedCall(), fn, *args)
+        executor = _get_hedge_executor()
+        primary_call = _HedgedCall()
+        primary = executor.submit(self._timed, kind, primary_call, fn, *args)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        if self._take_hedge():
+            hedge_call = _HedgedCall()
+            hedge = executor.submit(self._timed, kind, hedge_call, fn, *args)
+            return self._first_result((primary, primary_call), (hedge, hedge_call))
+        return primary.result()
+
+    def get_stats(self):
+        with self._lock:
+            return HedgeStats(self._requests, self._hedged, self._hedge_wins)
+
+    def _get_hedge_delay(self, kind):
+        with self._lock:
+            self._requests += 1
+            latencies = sorted(self._latencies.get(kind, ()))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[math.ceil(self.percentile / 100 * len(latencies)) - 1]
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._hedged + 1 > self.max_extra_load * self._requests:
+                return False
+            self._hedged += 1
+            return True
+
+    def _timed(self, kind, call, fn, *args):
+        started = time.monotonic()
+        _hedged_calls.current = call
+        try:
+            result = fn(*args)
+        finally:
+            _hedged_calls.current = None
+        if call.abandoned.is_set():
+            return result
+        # the last attempt is the one that answered; without attempts, e.g.
+        # for requests OWSLib sends itself, the call is timed as a whole
+        latency = call.latencies[-1] if call.latencies else time.monotonic() - started
+        with self._lock:
+            latencies = self._latencies.get(kind)
+            if latencies is None:
+                latencies = deque(maxlen=HEDGE_LATENCY_WINDOW)
+                self._latencies[kind] = latencies
+            latencies.append(latency)
+        return result
+
+    def _first_result(self, primary, hedge):
+        """
+        Return the first successful result of the (future, _HedgedCall)
+        tuples ``primary`` and ``hedge`` and abandon the other call; raise
+        the primary's error if both fail.
+        """
+        pending = {primary[0], hedge[0]}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future, _ in (primary, hedge):
+                if future in done and future.exception() is None:
+                    if future is hedge[0]:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    for other, other_call in (primary, hedge):
+                        if other is not future:
+                            other_call.abandoned.set()
+                            other.add_done_callback(_close_result)
+                    return future.result()
+        return primary[0].result()
+
+
+def _close_result(future):
+    """Close the response an abandoned hedged call returned, if any."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), "close", None)
+    if close is not None:
+        close()
@@ -1,6 +1,10 @@
+import functools
 import logging
 import os
+import re
 import xml.etree.ElementTree as ET
+from collections import namedtuple
+from types import MappingProxyType
 
 import rdflib
 import yaml
@@ -61,6 +65,42 @@ def get_terms_of_use():
     return g
 
 
+def normalize_terms_of_use_text(value):
+    """Collapse whitespace in a terms of use text used as index key."""
+    return re.sub(r"\s+", " ", value).strip()
+
+
+@functools.lru_cache(maxsize=None)
+def get_terms_of_use_index():
+    """
+    Return a read-only ``(lang, normalised text) -> opendata terms IRI`` dict
+    built from the terms of use graph.
+
+    Every language tagged literal of a concept with a ``skos:mappingRelation``
+    is indexed. If a text maps to several concepts, the first one found in
+    the graph is kept, as the graph scan did before.
+    """
+    terms_of_use = get_terms_of_use()
+    terms_of_use_index = {}
+    for rights_uri, mapping_object in terms_of_use.subject_objects(
+        predicate=SKOS.mappingRelation
+    ):
+        ogdch_rights = str(mapping_object)
+        if not ogdch_rights:
+            continue
+        for rights_literal in terms_of_use.objects(subject=rights_uri):
+            if not isinstance(rights_literal, rdflib.Literal):
+                continue
+            if not rights_literal.language:
+                continue
+            key = (
+                rights_literal.language.lower(),
+                normalize_terms_of_use_text(str(rights_literal)),
+            )
+            terms_of_use_index.setdefault(key, ogdch_rights)
+    return MappingProxyType(terms_of_use_index)
+
+
 def get_excluded_protocols():
     try:
         mapping_path = os.path.join(__location__, "mapping.yaml")
@@ -107,3 +147,48 @@ def get_iana_media_type_values():
         file_value = record.find("ns:file", media_types_namespaces).text
         media_type_values[name] = media_types_namespaces["ns"] + "/" + file_value
     return media_type_values
+
+
+VocabularyIndex = namedtuple("VocabularyIndex", ["formats", "media_types"])
+
+
+def normalize_vocabulary_key(value):
+    """Normalise a geocat format string to the form used as vocabulary key."""
+    return value.replace(" ", "_")
+
+
+@functools.lru_cache(maxsize=None)
+def get_vocabulary_index():
+    """
+    Return the format and IANA media type vocabularies as read-only dicts.
+
+    The vocabulary files are parsed once per process on first use. Keys are
+    normalised with ``normalize_vocabulary_key``; vocabulary entries whose
+    key contains a space are left out, since no normalised lookup value can
+    match them.
+    """
+    formats = {
+        key: value for key, value in get_format_values().items() if " " not in key
+    }
+    media_types = {
+        key: value
+        for key, value in get_iana_media_type_values().items()
+        if " " not in key
+    }
+    return VocabularyIndex(
+        formats=MappingProxyType(formats),
+        media_types=MappingProxyType(media_types),
+    )
+
+
+def get_vocabulary_format(geocat_format):
+    """
+    Look up a geocat format in the format vocabulary, then in the IANA media
+    types. Returns None if the format is in neither vocabulary.
+    """
+    vocabulary_index = get_vocabulary_index()
+    key = normalize_vocabulary_key(geocat_format)
+    value = vocabulary_index.formats.get(key)
+    if value is None:
+        value = vocabulary_index.media_types.get(key)
+    return value
@@ -276,12 +276,7 @@ def map_service(geocat_service, issued, modified, description, rights, license):
 
 
 def _map_geocat_resource_format_to_valid_format(geocat_format):
-    valid_formats = mu.get_format_values()
-    for key, value in list(valid_formats.items()):
-        if geocat_format.replace(" ", "_") == key:
-            return value
-    valid_media_types = mu.get_iana_media_type_values()
-    for key, value in list(valid_media_types.items()):
-        if geocat_format.replace(" ", "_") == key:
-            return value
+    valid_format = mu.get_vocabulary_format(geocat_format)
+    if valid_format is not None:
+        return valid_format
     return geocat_format
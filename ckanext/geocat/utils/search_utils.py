@@ -1,9 +1,14 @@
 import logging
 from collections import namedtuple
+from datetime import timezone
 
 import ckan.plugins.toolkit as tk
 from ckan import model
 from ckan.model import Session
+from sqlalchemy import and_
+
+from ckanext.geocat.utils import harvest_state
+from ckanext.harvest.model import HarvestObject
 
 log = logging.getLogger(__name__)
 
@@ -11,6 +16,20 @@ OgdchDatasetInfo = namedtuple(
     "OgdchDatasetInfo", ["name", "belongs_to_harvester", "package_id"]
 )
 
+IdentifierReconciliation = namedtuple(
+    "IdentifierReconciliation", ["create", "update", "delete", "double"]
+)
+
+DATASET_INDEX_SOLR = "solr"
+DATASET_INDEX_DATABASE = "database"
+DATASET_INDEX_BACKENDS = [DATASET_INDEX_SOLR, DATASET_INDEX_DATABASE]
+ORGANIZATION_LISTING_ROWS = 1000
+DB_LISTING_ROWS = 1000
+
+# harvest object extras with the package gather found for the identifier
+PACKAGE_ID_EXTRA = "package_id"
+PACKAGE_NAME_EXTRA = "package_name"
+
 
 def get_organization_slug_for_harvest_source(harvest_source_id):
     context = get_default_context()
@@ -23,19 +42,44 @@ def get_organization_slug_for_harvest_source(harvest_source_id):
         raise tk.ObjectNotFound
 
 
-def get_packages_to_delete(existing_dataset_infos, gathered_ogdch_identifiers):
+def reconcile_identifiers(existing_dataset_infos, gathered_ogdch_identifiers):
+    """
+    Sort the gathered identifiers and those of the existing datasets into
+    sets with one pass over the existing datasets: ``create`` were gathered
+    and have no dataset yet, ``update`` were gathered and their dataset
+    belongs to the harvest source, ``double`` were gathered but their
+    dataset does not belong to it, and ``delete`` were not gathered and
+    their dataset belongs to it.
+    """
+    create = set(gathered_ogdch_identifiers)
+    update = set()
+    delete = set()
+    double = set()
+    for identifier, info in existing_dataset_infos.items():
+        if identifier in create:
+            create.remove(identifier)
+            if info.belongs_to_harvester:
+                update.add(identifier)
+            else:
+                double.add(identifier)
+        elif info.belongs_to_harvester:
+            delete.add(identifier)
+    return IdentifierReconciliation(
+        create=create, update=update, delete=delete, double=double
+    )
+
+
+def get_packages_to_delete(existing_dataset_infos, reconciliation):
     return [
-        (identifier, info)
-        for identifier, info in list(existing_dataset_infos.items())
-        if info.belongs_to_harvester and identifier not in gathered_ogdch_identifiers
+        (identifier, existing_dataset_infos[identifier])
+        for identifier in sorted(reconciliation.delete)
     ]
 
 
-def get_double_packages(existing_dataset_infos, gathered_ogdch_identifiers):
+def get_double_packages(existing_dataset_infos, reconciliation):
     return [
-        (identifier, info)
-        for identifier, info in list(existing_dataset_infos.items())
-        if not info.belongs_to_harvester and identifier in gathered_ogdch_identifiers
+        (identifier, existing_dataset_infos[identifier])
+        for identifier in sorted(reconciliation.double)
     ]
 
 
@@ -65,54 +109,217 @@ def find_package_for_identifier(identifier):
         )
 
 
-def get_dataset_infos_for_organization(organization_name, harvest_source_id):
+def get_package_info_for_harvest_object(harvest_object):
+    """
+    Return the package that gather found for the identifier of the harvest
+    object. Without it, e.g. for objects of an older gather, the package
+    is searched by identifier.
+    """
+    package_id = get_value_from_object_extra(harvest_object.extras, PACKAGE_ID_EXTRA)
+    if package_id:
+        return OgdchDatasetInfo(
+            name=get_value_from_object_extra(harvest_object.extras, PACKAGE_NAME_EXTRA),
+            package_id=package_id,
+            belongs_to_harvester=True,
+        )
+    return find_package_for_identifier(harvest_object.guid)
+
+
+def get_dataset_infos_for_organization(
+    organization_name, harvest_source_id, dataset_index=DATASET_INDEX_SOLR
+):
+    """
+    Return a dict of identifier to OgdchDatasetInfo for the datasets of an
+    organization, read from Solr or, with DATASET_INDEX_DATABASE, from the
+    package tables.
+    """
+    return dict(
+        _iter_dataset_infos(organization_name, harvest_source_id, dataset_index)
+    )
+
+
+def get_cached_dataset_infos_for_organization(
+    organization_name, harvest_source_id, dataset_index=DATASET_INDEX_SOLR
+):
+    """
+    Return the same dict as get_dataset_infos_for_organization from the
+    index kept for the harvest source, refreshed with only the datasets
+    modified since it was built. The ids of all datasets of the organization
+    tell which entries were deleted, see harvest_state.refresh_dataset_index.
+    """
+
+    def list_datasets(modified_since):
+        return _iter_dataset_infos(
+            organization_name, harvest_source_id, dataset_index, modified_since
+        )
+
+    def list_package_ids():
+        return iter_package_ids_for_organization(organization_name, dataset_index)
+
+    dataset_infos = harvest_state.refresh_dataset_index(
+        harvest_source_id,
+        f"{dataset_index}:{organization_name}",
+        list_datasets,
+        list_package_ids,
+    )
+    return {
+        identifier: OgdchDatasetInfo(*info)
+        for identifier, info in dataset_infos.items()
+    }
+
+
+def iter_package_ids_for_organization(
+    organization_name, dataset_index=DATASET_INDEX_SOLR
+):
+    """
+    Yield the ids of the datasets get_dataset_infos_for_organization reads
+    for an organization, without reading the datasets.
+    """
+    if dataset_index == DATASET_INDEX_DATABASE:
+        query = _organization_packages_query(organization_name, model.Package.id)
+        for (package_id,) in query.yield_per(DB_LISTING_ROWS):
+            yield package_id
+        return
+    for dataset in _iter_package_search(
+        _organization_listing_fq(organization_name),
+        ORGANIZATION_LISTING_ROWS,
+        fl="id",
+    ):
+        yield dataset["id"]
+
+
+def _iter_dataset_infos(
+    organization_name, harvest_source_id, dataset_index, modified_since=None
+):
+    if dataset_index == DATASET_INDEX_DATABASE:
+        return iter_dataset_infos_for_organization_from_db(
+            organization_name, harvest_source_id, modified_since=modified_since
+        )
+    return iter_dataset_infos_for_organization(
+        organization_name, harvest_source_id, modified_since=modified_since
+    )
+
+
+def iter_dataset_infos_for_organization(
+    organization_name,
+    harvest_source_id,
+    rows=ORGANIZATION_LISTING_ROWS,
+    modified_since=None,
+):
+    """
+    Yield (identifier, OgdchDatasetInfo) tuples for the datasets of an
+    organization that package_search finds, including private ones, or only
+    for those modified since the UTC datetime ``modified_since``.
+    """
+    fq = _organization_listing_fq(organization_name)
+    if modified_since is not None:
+        since = modified_since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        fq += f" +metadata_modified:[{since} TO *]"
+    for dataset in _iter_package_search(fq, rows):
+        if not dataset.get("identifier"):
+            log.warning(
+                f"Package {dataset.get('id') or dataset.get('name')} of "
+                f"organization {organization_name} has no identifier"
+            )
+            continue
+        dataset_harvest_source_id = get_value_from_dataset_extras(
+            dataset.get("extras"), "harvest_source_id"
+        )
+        yield dataset["identifier"], OgdchDatasetInfo(
+            name=dataset["name"],
+            package_id=dataset["id"],
+            belongs_to_harvester=bool(dataset_harvest_source_id)
+            and dataset_harvest_source_id == harvest_source_id,
+        )
+
+
+def _iter_package_search(fq, rows, **params):
+    """
+    Yield the results of package_search for ``fq`` and further ``params``,
+    e.g. ``fl``, page by page. The pages are sorted by index_id, so that
+    they follow each other without gaps, and each one starts after the
+    results actually returned, as package_search returns at most
+    ``ckan.search.rows_max`` of the ``rows`` asked for.
+    """
     context = get_default_context()
-    rows = 500
-    page = 0
-    result_count = 0
-    fq = f"organization:({organization_name})"
-    processed_count = 0
-    ogdch_dataset_infos = {}
-    while page == 0 or processed_count < result_count:
-        page = page + 1
-        start = (page - 1) * rows
+    start = 0
+    while True:
         result = tk.get_action("package_search")(
             context,
-            {"fq": fq, "rows": rows, "start": start, "include_private": True},
+            dict(
+                params,
+                fq=fq,
+                rows=rows,
+                start=start,
+                sort="index_id asc",
+                include_private=True,
+            ),
         )
-        if not result_count:
-            result_count = result["count"]
-        datasets_in_result = result.get("results", [])
-        for dataset in datasets_in_result:
-            try:
-                extras = dataset.get("extras")
-                dataset_harvest_source_id = get_value_from_dataset_extras(
-                    extras, "harvest_source_id"
-                )
-                if (
-                    dataset_harvest_source_id
-                    and dataset_harvest_source_id == harvest_source_id
-                ):
-                    belongs_to_harvester = True
-                else:
-                    belongs_to_harvester = False
-                ogdch_dataset_infos[dataset["identifier"]] = OgdchDatasetInfo(
-                    name=dataset["name"],
-                    package_id=dataset["id"],
-                    belongs_to_harvester=belongs_to_harvester,
-                )
-            except KeyError as e:
-                package_id = (
-                    dataset.get("id")
-                    or dataset.get("name")
-                    or dataset.get("identifier", "")
-                )
-                log.warn(
-                    "KeyError occured while searching with fq {}. "
-                    "Package {} is missing field {}".format(fq, package_id, e)
-                )
-        processed_count += len(datasets_in_result)
-    return ogdch_dataset_infos
+        datasets = result.get("results", [])
+        yield from datasets
+        start += len(datasets)
+        if not datasets or start >= result["count"]:
+            break
+
+
+def _organization_listing_fq(organization_name):
+    # package_search itself only returns active datasets of this site that
+    # the context may see
+    return f'+organization:"{organization_name}" +dataset_type:dataset'
+
+
+def iter_dataset_infos_for_organization_from_db(
+    organization_name, harvest_source_id, modified_since=None
+):
+    """
+    Yield the same tuples as iter_dataset_infos_for_organization, read with
+    one query on the packages instead of package_search. The packages are
+    loaded in batches of DB_LISTING_ROWS, and their identifier is read from
+    their extras.
+    """
+    # ckanext-harvest only indexes the harvest source of a dataset, the
+    # database has it on the current harvest object of the package
+    query = _organization_packages_query(
+        organization_name, model.Package, HarvestObject.harvest_source_id
+    ).outerjoin(
+        HarvestObject,
+        and_(
+            HarvestObject.package_id == model.Package.id,
+            HarvestObject.current == True,  # noqa: E712
+        ),
+    )
+    if modified_since is not None:
+        # metadata_modified is stored as naive UTC
+        query = query.filter(
+            model.Package.metadata_modified
+            >= modified_since.astimezone(timezone.utc).replace(tzinfo=None)
+        )
+    for package, dataset_harvest_source_id in query.yield_per(DB_LISTING_ROWS):
+        ogdch_identifier = package.extras.get("identifier")
+        if not ogdch_identifier:
+            log.warning(
+                f"Package {package.id} of organization {organization_name} "
+                f"has no identifier"
+            )
+            continue
+        yield ogdch_identifier, OgdchDatasetInfo(
+            name=package.name,
+            package_id=package.id,
+            belongs_to_harvester=dataset_harvest_source_id == harvest_source_id,
+        )
+
+
+def _organization_packages_query(organization_name, *entities):
+    # the datasets package_search returns with include_private
+    return (
+        model.Session.query(*entities)
+        .join(model.Group, model.Group.id == model.Package.owner_org)
+        .filter(
+            model.Group.name == organization_name,
+            model.Package.type == "dataset",
+            model.Package.state == "active",
+        )
+    )
 
 
 def get_default_context():
@@ -34,8 +34,25 @@ gmd_namespaces = {
     "xlink": "http://www.w3.org/1999/xlink",
 }
 
+_LOCALE_ATTRIBUTES = {f"#{locale}": locale for locale in LOCALES}
+GCO_CHARACTER_STRING_TAG = f"{{{gmd_namespaces['gco']}}}CharacterString"
+GMD_LINKAGE_TAG = f"{{{gmd_namespaces['gmd']}}}linkage"
+GMD_URL_TAG = f"{{{gmd_namespaces['gmd']}}}URL"
+CHE_LOCALISED_URL_TAG = f"{{{gmd_namespaces['che']}}}LocalisedURL"
+
 GMD_URL_LABEL = ".//gmd:description"
-GMD_SERVICE_NODES = "//gmd:identificationInfo//srv:containsOperations/srv:SV_OperationMetadata[.//srv:operationName//gco:CharacterString/text()]"
+GMD_CHARACTER_STRING = ".//gco:CharacterString/text()"
+GMD_LOCALISED_CHARACTER_STRING = ".//gmd:textGroup/gmd:LocalisedCharacterString/text()"
+GMD_MULTILANGUAGE_TEXTS = f"{GMD_LOCALISED_CHARACTER_STRING} | {GMD_CHARACTER_STRING}"
+GMD_LOCALISED_CHARACTER_STRING_EN = (
+    './/gmd:LocalisedCharacterString[@locale = "#EN"]/text()'
+)
+GMD_LINKAGE_URL = ".//gmd:linkage/gmd:URL/text()"
+CHE_LOCALISED_URL = ".//che:LocalisedURL/text()"
+GMD_URL_TEXTS = f"{CHE_LOCALISED_URL} | .//gmd:URL/text()"
+GMD_LINKAGE_URL_TEXTS = f"{GMD_LINKAGE_URL} | {CHE_LOCALISED_URL}"
+# GMD_SERVICE_NODES and GMD_MEDIA_TYPE are relative to gmd:identificationInfo
+GMD_SERVICE_NODES = ".//srv:containsOperations/srv:SV_OperationMetadata[.//srv:operationName//gco:CharacterString/text()]"
 GMD_SERVICE_URLS = [
     './/srv:connectPoint//gmd:linkage//che:LocalisedURL[@locale = "#DE" and ./text()]/text()',
     './/srv:connectPoint//gmd:linkage//che:LocalisedURL[@locale = "#FR" and ./text()]/text()',
@@ -43,26 +60,17 @@ GMD_SERVICE_URLS = [
     './/srv:connectPoint//gmd:linkage//che:LocalisedURL[@locale = "#IT" and ./text()]/text()',
     ".//srv:connectPoint//gmd:linkage//che:LocalisedURL[./text()]/text()",
 ]
-GMD_MEDIA_TYPE = "//gmd:identificationInfo//srv:serviceType/gco:LocalName/text()"
+GMD_MEDIA_TYPE = ".//srv:serviceType/gco:LocalName/text()"
 GMD_SERVICE_TITLE = ".//srv:operationName/gco:CharacterString/text()"
-URL_PATH_LIST = [
-    './/gmd:linkage//che:LocalisedURL[@locale="#DE"]/text()',
-    './/gmd:linkage//che:LocalisedURL[@locale="#FR"]/text()',
-    './/gmd:linkage//che:LocalisedURL[@locale="#EN"]/text()',
-    './/gmd:linkage//che:LocalisedURL[@locale="#IT"]/text()',
-    ".//che:LocalisedURL/text()",
-    ".//gmd:URL/text()",
-]
 
-CHE_DATA_MODEL_NODE = (
-    ".//gmd:contentInfo//che:CHE_MD_FeatureCatalogueDescription//che:dataModel/text()"
-)
+# CHE_DATA_MODEL_NODE and CONFORMS_TO_URL_PATH_LIST are relative to gmd:contentInfo
+CHE_DATA_MODEL_NODE = ".//che:CHE_MD_FeatureCatalogueDescription//che:dataModel/text()"
 CONFORMS_TO_URL_PATH_LIST = [
-    './/gmd:contentInfo//che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL[@locale="#DE"]/text()',
-    './/gmd:contentInfo//che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURLL[@locale="#FR"]/text()',
-    './/gmd:contentInfo//che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL[@locale="#EN"]/text()',
-    './/gmd:contentInfo//che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL[@locale="#IT"]/text()',
-    ".//gmd:contentInfo//che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL/text()",
+    './/che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL[@locale="#DE"]/text()',
+    './/che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURLL[@locale="#FR"]/text()',
+    './/che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL[@locale="#EN"]/text()',
+    './/che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL[@locale="#IT"]/text()',
+    ".//che:CHE_MD_FeatureCatalogueDescription//che:dataModel//che:PT_FreeURL//che:URLGroup//che:LocalisedURL/text()",
 ]
 
 GMD_RESOURCE_NAME = ".//gmd:name"
@@ -99,6 +107,29 @@ API_FORMAT = "API"
 LINKED_DATA_SERVICE = "Linked Data Service"
 
 
+_compiled_xpaths = {}
+
+
+def get_compiled_xpath(path):
+    """
+    Return *path* as an ``etree.XPath`` bound to ``gmd_namespaces``.
+
+    Each expression is compiled on first use and then kept for the lifetime
+    of the process, so that lxml does not parse and compile the same
+    expressions again for every record.
+    """
+    compiled_xpath = _compiled_xpaths.get(path)
+    if compiled_xpath is None:
+        compiled_xpath = etree.XPath(path, namespaces=gmd_namespaces)
+        _compiled_xpaths[path] = compiled_xpath
+    return compiled_xpath
+
+
+def xpath_evaluate(node, path):
+    """Evaluate *path* on *node* with the compiled XPath from the registry."""
+    return get_compiled_xpath(path)(node)
+
+
 def get_elem_tree_from_string(xml_string):
     try:
         # If input is str and starts with XML declaration, encode to bytes
@@ -111,7 +142,7 @@ def get_elem_tree_from_string(xml_string):
 
 
 def xpath_get_single_sub_node_for_node_and_path(node, path):
-    results = node.xpath(path, namespaces=gmd_namespaces)
+    results = xpath_evaluate(node, path)
     if results:
         return results[0]
     else:
@@ -119,7 +150,25 @@ def xpath_get_single_sub_node_for_node_and_path(node, path):
 
 
 def xpath_get_all_sub_nodes_for_node_and_path(node, path):
-    results = node.xpath(path, namespaces=gmd_namespaces)
+    results = xpath_evaluate(node, path)
+    if results:
+        return results
+    else:
+        return None
+
+
+def xpath_get_single_sub_node_for_nodes_and_path(nodes, path):
+    for node in nodes:
+        result = xpath_get_single_sub_node_for_node_and_path(node, path)
+        if result is not None:
+            return result
+    return None
+
+
+def xpath_get_all_sub_nodes_for_nodes_and_path(nodes, path):
+    results = []
+    for node in nodes:
+        results.extend(xpath_evaluate(node, path))
     if results:
         return results
     else:
@@ -129,7 +178,7 @@ def xpath_get_all_sub_nodes_for_node_and_path(node, path):
 def xpath_get_all_values_for_node_and_path_list(node, path_list):
     values = []
     for path in path_list:
-        value = node.xpath(path, namespaces=gmd_namespaces)
+        value = xpath_evaluate(node, path)
         if value:
             values.extend(value)
     return values
@@ -140,7 +189,7 @@ def xpath_get_first_of_values_from_path_list(node, path_list, get=XPATH_NODE):
     if get == XPATH_TEXT:
         get_text = "/text()"
     for path in path_list:
-        value = node.xpath(path + get_text, namespaces=gmd_namespaces)
+        value = xpath_evaluate(node, path + get_text)
         if value:
             return value[0], path
     return None, None
@@ -151,7 +200,7 @@ def xpath_get_values_list_from_path_list(node, path_list, get=XPATH_NODE):
     if get == XPATH_TEXT:
         get_text = "/text()"
     for path in path_list:
-        value = node.xpath(path + get_text, namespaces=gmd_namespaces)
+        value = xpath_evaluate(node, path + get_text)
         if value:
             return value, path
     return None, None
@@ -159,21 +208,11 @@ def xpath_get_values_list_from_path_list(node, path_list, get=XPATH_NODE):
 
 def xpath_get_language_dict_from_geocat_multilanguage_node(node):
     language_dict = {"en": "", "it": "", "de": "", "fr": ""}
-    localised_string_found = False
-    for locale in LOCALES:
-        value_locale = node.xpath(
-            './/gmd:textGroup/gmd:LocalisedCharacterString[@locale="#{}"]/text()'.format(
-                locale
-            ),
-            namespaces=gmd_namespaces,
-        )
-        if value_locale:
-            localised_string_found = True
-            cleaned_value = _clean_string(value_locale[0])
-            language_dict[locale.lower()] = cleaned_value
-    if localised_string_found:
+    localised_texts, value = _xpath_get_multilanguage_texts(node)
+    if localised_texts:
+        for locale, value_locale in localised_texts.items():
+            language_dict[locale.lower()] = _clean_string(value_locale[0])
         return language_dict
-    value = node.xpath(".//gco:CharacterString/text()", namespaces=gmd_namespaces)
     if value:
         cleaned_value = _clean_string(value[0])
         for locale in LOCALES:
@@ -183,37 +222,59 @@ def xpath_get_language_dict_from_geocat_multilanguage_node(node):
 
 
 def xpath_get_url_and_languages(node):
-    languages = []
-    url, _ = xpath_get_first_of_values_from_path_list(
-        node=node, path_list=URL_PATH_LIST
-    )
-    for locale in LOCALES:
-        value_locale = node.xpath(
-            f'.//che:LocalisedURL[@locale="#{locale}"]' + "/text()",
-            namespaces=gmd_namespaces,
-        )
-        if value_locale:
-            languages.append(locale.lower())
-    return url, languages
-
+    """
+    Return the url of a node and the languages of its localised urls.
 
-def xpath_get_url_and_languages_for_data_model(node):
-    data_model_node = xpath_get_all_sub_nodes_for_node_and_path(
-        node=node, path=CHE_DATA_MODEL_NODE
+    The url is taken with this precedence: a localised url inside a nested
+    ``gmd:linkage`` in the order of ``LOCALES``, then the first localised url,
+    then the first ``gmd:URL``.
+    """
+    localised_urls = []
+    urls = []
+    for text in xpath_evaluate(node, GMD_URL_TEXTS):
+        if _get_text_element(text).tag == CHE_LOCALISED_URL_TAG:
+            localised_urls.append(text)
+        else:
+            urls.append(text)
+    localised_urls_by_locale = _group_texts_by_locale(localised_urls)
+    languages = [
+        locale.lower() for locale in LOCALES if locale in localised_urls_by_locale
+    ]
+    for locale in LOCALES:
+        for url in localised_urls_by_locale.get(locale, []):
+            if _has_ancestor_below(_get_text_element(url), node, GMD_LINKAGE_TAG):
+                return url, languages
+    if localised_urls:
+        return localised_urls[0], languages
+    if urls:
+        return urls[0], languages
+    return None, languages
+
+
+def xpath_get_url_and_languages_for_data_model(nodes):
+    """Map the data model url of the ``gmd:contentInfo`` *nodes* of a record."""
+    data_model_node = xpath_get_all_sub_nodes_for_nodes_and_path(
+        nodes=nodes, path=CHE_DATA_MODEL_NODE
     )
 
     if data_model_node:
         languages = []
         validated_urls = []
-        urls_list, _ = xpath_get_values_list_from_path_list(
-            node=node, path_list=CONFORMS_TO_URL_PATH_LIST
+        urls_list = None
+        for path in CONFORMS_TO_URL_PATH_LIST:
+            urls_list = xpath_get_all_sub_nodes_for_nodes_and_path(
+                nodes=nodes, path=path
+            )
+            if urls_list:
+                break
+        localised_urls_by_locale = _group_texts_by_locale(
+            xpath_get_all_sub_nodes_for_nodes_and_path(
+                nodes=nodes, path=CHE_LOCALISED_URL
+            )
+            or []
         )
         for locale in LOCALES:
-            value_locale = node.xpath(
-                f'.//che:LocalisedURL[@locale="#{locale}"]' + "/text()",
-                namespaces=gmd_namespaces,
-            )
-            if value_locale:
+            if locale in localised_urls_by_locale:
                 languages.append(locale.lower())
         for url in urls_list:
             validated_urls.append(_is_valid_url(url))
@@ -225,33 +286,20 @@ def xpath_get_url_and_languages_for_data_model(node):
 def xpath_get_rights_dict_form_rights_node(node):
     rights_dict = {"en": "", "it": "", "de": "", "fr": ""}
     try:
-        for locale in LOCALES:
-            value_locale = node.xpath(
-                './/gmd:textGroup/gmd:LocalisedCharacterString[@locale="#{}"]'.format(
-                    locale
-                )
-                + "/text()",
-                namespaces=gmd_namespaces,
-            )
-            if value_locale:
-                rights_dict[locale.lower()] = _clean_string(value_locale[0])
+        localised_texts, _ = _xpath_get_multilanguage_texts(node)
+        for locale, value_locale in localised_texts.items():
+            rights_dict[locale.lower()] = _clean_string(value_locale[0])
         return rights_dict
     except Exception:
         return ""
 
 
 def xpath_get_one_value_from_geocat_multilanguage_node(node):
-    value = node.xpath(".//gco:CharacterString/text()", namespaces=gmd_namespaces)
+    localised_texts, value = _xpath_get_multilanguage_texts(node)
     if value:
         return value
     for locale in LOCALES:
-        value_locale = node.xpath(
-            './/gmd:textGroup/gmd:LocalisedCharacterString[@locale="#{}"]'.format(
-                locale
-            )
-            + "/text()",
-            namespaces=gmd_namespaces,
-        )
+        value_locale = localised_texts.get(locale)
         if value_locale:
             return value_locale
 
@@ -259,16 +307,13 @@ def xpath_get_one_value_from_geocat_multilanguage_node(node):
 def xpath_get_url_with_label(node):
     url = xpath_get_url_from_node(node)
     url = {"url": url, "label": url}
-    value_locale_en = node.xpath(
-        './/gmd:LocalisedCharacterString[@locale = "#EN"]/text()',
-        namespaces=gmd_namespaces,
-    )
+    value_locale_en = xpath_evaluate(node, GMD_LOCALISED_CHARACTER_STRING_EN)
 
     if value_locale_en and value_locale_en[0].startswith(LINKED_DATA_SERVICE):
         url["label"] = value_locale_en[0]
         return url
 
-    text_node = node.xpath(GMD_URL_LABEL, namespaces=gmd_namespaces)
+    text_node = xpath_evaluate(node, GMD_URL_LABEL)
     if text_node:
         url_text_node = xpath_get_one_value_from_geocat_multilanguage_node(text_node[0])
         if url_text_node:
@@ -282,19 +327,17 @@ def xpath_get_url_with_label(node):
 
 
 def xpath_get_url_from_node(node):
-    url_node = node.xpath(".//gmd:linkage/gmd:URL/text()", namespaces=gmd_namespaces)
-    if url_node:
-        return url_node[0]
+    localised_urls = []
+    for text in xpath_evaluate(node, GMD_LINKAGE_URL_TEXTS):
+        if _get_text_element(text).tag == GMD_URL_TAG:
+            return text
+        localised_urls.append(text)
+    localised_urls_by_locale = _group_texts_by_locale(localised_urls)
     for locale in LOCALES:
-        url_node = node.xpath(
-            f'.//che:LocalisedURL[@locale="#{locale}"]' + "/text()",
-            namespaces=gmd_namespaces,
-        )
-        if url_node:
-            return url_node[0]
-    url_node = node.xpath(".//che:LocalisedURL/text()", namespaces=gmd_namespaces)
-    if url_node:
-        return url_node[0]
+        if locale in localised_urls_by_locale:
+            return localised_urls_by_locale[locale][0]
+    if localised_urls:
+        return localised_urls[0]
     return None
 
 
@@ -397,12 +440,16 @@ def _set_distribution_format_and_media_type(
         distribution["format"] = format
 
 
-def xpath_get_geocat_services(node):
-    service_nodes = xpath_get_all_sub_nodes_for_node_and_path(
-        node=node, path=GMD_SERVICE_NODES
+def xpath_get_geocat_services(nodes):
+    """Map the services of the ``gmd:identificationInfo`` *nodes* of a record."""
+    service_nodes = xpath_get_all_sub_nodes_for_nodes_and_path(
+        nodes=nodes, path=GMD_SERVICE_NODES
     )
     geocat_services = []
     if service_nodes:
+        media_type = xpath_get_single_sub_node_for_nodes_and_path(
+            nodes=nodes, path=GMD_MEDIA_TYPE
+        )
         for service_node in service_nodes:
             geocat_service = {}
             geocat_service["name"] = xpath_get_single_sub_node_for_node_and_path(
@@ -414,9 +461,7 @@ def xpath_get_geocat_services(node):
             ) = xpath_get_first_of_values_from_path_list(
                 node=service_node, path_list=GMD_SERVICE_URLS
             )
-            geocat_service["media_type"] = xpath_get_single_sub_node_for_node_and_path(
-                node=service_node, path=GMD_MEDIA_TYPE
-            )
+            geocat_service["media_type"] = media_type
             geocat_services.append(geocat_service)
     return geocat_services
 
@@ -439,6 +484,56 @@ def _get_normed_protocol(protocol):
     return None
 
 
+def _get_text_element(text):
+    """Return the element that an XPath ``text()`` result belongs to."""
+    element = text.getparent()
+    if text.is_tail:
+        element = element.getparent()
+    return element
+
+
+def _group_texts_by_locale(texts):
+    """
+    Group ``text()`` results by the ``@locale`` of their element.
+
+    Only the locales in ``LOCALES`` are kept; the texts of each locale stay
+    in document order.
+    """
+    texts_by_locale = {}
+    for text in texts:
+        locale = _LOCALE_ATTRIBUTES.get(_get_text_element(text).get("locale"))
+        if locale:
+            texts_by_locale.setdefault(locale, []).append(text)
+    return texts_by_locale
+
+
+def _xpath_get_multilanguage_texts(node):
+    """
+    Collect the texts of a multilanguage node in one traversal.
+
+    Returns the ``gmd:LocalisedCharacterString`` texts grouped by locale and
+    the ``gco:CharacterString`` texts, both in document order.
+    """
+    localised_texts = []
+    character_strings = []
+    for text in xpath_evaluate(node, GMD_MULTILANGUAGE_TEXTS):
+        if _get_text_element(text).tag == GCO_CHARACTER_STRING_TAG:
+            character_strings.append(text)
+        else:
+            localised_texts.append(text)
+    return _group_texts_by_locale(localised_texts), character_strings
+
+
+def _has_ancestor_below(element, node, tag):
+    """Check whether *element* has an ancestor with *tag* below *node*."""
+    for ancestor in element.iterancestors():
+        if ancestor is node:
+            return False
+        if ancestor.tag == tag:
+            return True
+    return False
+
+
 def _clean_string(value):
     try:
         return re.sub(r"\s+", " ", value).strip()